@@ -1,24 +1,29 @@
 import importlib
 import re
+import threading
 from datetime import datetime
 
 from django.contrib.auth.models import Permission
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Max
 from django.utils.timezone import make_aware
 
 from airone.lib.acl import ACLObjType, ACLType
-from user.models import User
+from user.models import PermissionContext, User
+
+# This is names of Permission that are created for each ACLBase object (c.f. acl/signals.py)
+ACL_PERMISSION_NAMES = set([x.name for x in ACLType.all()])
 
 
 # Add comparison operations to the Permission model
 def _get_acltype(permission):
-    if not any([permission.name == x.name for x in ACLType.all()]):
+    if permission.name not in ACL_PERMISSION_NAMES:
         return 0
     return int(permission.codename.split(".")[-1])
 
 
 def _get_objid(permission):
-    if not any([permission.name == x.name for x in ACLType.all()]):
+    if permission.name not in ACL_PERMISSION_NAMES:
         return 0
     return int(permission.codename.split(".")[0])
 
@@ -45,6 +50,13 @@ class ACLBase(models.Model):
     # This fields describes the sub-class of this object
     objtype = models.IntegerField(default=0)
 
+    class Meta:
+        # This is for getting objects by name (e.g. Entry of a Entity), because is_active and
+        # name of subclasses (e.g. Entry) are stored in this table.
+        indexes = [
+            models.Index(fields=["name", "is_active"], name="aclbase_name_active"),
+        ]
+
     def set_status(self, val):
         self.status |= val
         self.save(update_fields=["status"])
@@ -128,3 +140,146 @@ class ACLBase(models.Model):
             )
 
         return results
+
+
+class ACLPermission(models.Model):
+    """This holds the object ID and ACLType ID of Permission as integer columns.
+
+    These are encoded in the codename of Permission (formatted as "<object ID>.<ACLType ID>"),
+    so this makes it possible to look up permissions to an object by index.
+    """
+
+    permission = models.OneToOneField(Permission, on_delete=models.CASCADE, related_name="acl")
+    object_id = models.IntegerField()
+    acl = models.IntegerField()
+
+    class Meta:
+        index_together = ("object_id", "acl")
+
+    @classmethod
+    def register(kls, permissions):
+        kls.objects.bulk_create(
+            [
+                kls(permission=x, object_id=x.get_objid(), acl=x.get_aclid())
+                for x in permissions
+                if x.name in ACL_PERMISSION_NAMES
+            ]
+        )
+
+    @classmethod
+    def register_all(kls):
+        """This registers ACLPermissions of Permissions that don't have it yet"""
+        kls.register(
+            Permission.objects.filter(name__in=ACL_PERMISSION_NAMES, acl__isnull=True).iterator()
+        )
+
+    @classmethod
+    def get_acl(kls, object_id, **query):
+        """This returns the highest ACLType ID of Permissions to the object.
+
+        The Permissions are able to be narrowed by query (e.g. permission__role=role).
+        """
+        return (
+            kls.objects.filter(object_id=object_id, **query).aggregate(acl=Max("acl"))["acl"] or 0
+        )
+
+
+class EffectivePermission(models.Model):
+    """This is a materialized permission that a user has to an ACLBase object through Roles.
+
+    The acl is the highest ACLType ID of all Roles that the user and groups, which the user
+    belongs to (including hierarchical superior groups), have. These are refreshed by the
+    signal handlers (c.f. acl/signals.py) when Roles, Groups or their members are changed,
+    so that readers are able to filter objects by permission in SQL.
+
+    Refreshing is deferred until the current transaction is committed (or permissions are
+    read in the same thread) to coalesce the ones that are requested in a transaction.
+    """
+
+    # This holds users and objects whose permissions are waiting to be refreshed
+    _pending = threading.local()
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="effective_permissions")
+    object_id = models.IntegerField()
+    acl = models.IntegerField()
+
+    class Meta:
+        unique_together = ("user", "object_id")
+
+    @classmethod
+    def refresh(kls, user_ids):
+        """This rebuilds EffectivePermissions of specified users from their Roles"""
+        for user in User.objects.filter(id__in=user_ids):
+            permissions = PermissionContext(user).permissions
+
+            with transaction.atomic():
+                kls.objects.filter(user=user).delete()
+                kls.objects.bulk_create(
+                    [kls(user=user, object_id=x, acl=y) for (x, y) in permissions.items()]
+                )
+
+    @classmethod
+    def refresh_objects(kls, user_ids, object_ids):
+        """This refreshes EffectivePermissions of specified users only to specified objects"""
+        object_ids = set(object_ids)
+        if not object_ids:
+            return
+
+        for user in User.objects.filter(id__in=user_ids):
+            permissions = {}
+            for (obj_id, acl_id) in ACLPermission.objects.filter(
+                object_id__in=object_ids,
+                permission__role__in=[x.id for x in user.get_belonged_roles()],
+            ).values_list("object_id", "acl"):
+                permissions[obj_id] = max(permissions.get(obj_id, 0), acl_id)
+
+            with transaction.atomic():
+                kls.objects.filter(user=user, object_id__in=object_ids).delete()
+                kls.objects.bulk_create(
+                    [kls(user=user, object_id=x, acl=y) for (x, y) in permissions.items()]
+                )
+
+    @classmethod
+    def refresh_all(kls):
+        kls.refresh(User.objects.values_list("id", flat=True))
+
+    @classmethod
+    def schedule_refresh(kls, user_ids, object_ids=None):
+        """This requests to refresh EffectivePermissions of specified users.
+
+        When object_ids is specified, only permissions to them are refreshed. Otherwise
+        all permissions of the users are rebuilt (e.g. when their memberships are changed).
+        """
+        pending = getattr(kls._pending, "value", None)
+        if pending is None:
+            pending = kls._pending.value = {"user_ids": set(), "object_ids": {}}
+
+        if object_ids is None:
+            pending["user_ids"] |= set(user_ids)
+        else:
+            object_ids = set(object_ids)
+            for user_id in user_ids:
+                pending["object_ids"].setdefault(user_id, set()).update(object_ids)
+
+        # This runs immediately when it's called out of transaction
+        transaction.on_commit(kls.flush_pending)
+
+    @classmethod
+    def flush_pending(kls):
+        """This refreshes EffectivePermissions that are requested by schedule_refresh()"""
+        pending = kls._pending.__dict__.pop("value", None)
+        if not pending:
+            return
+
+        kls.refresh(pending["user_ids"])
+        for (user_id, object_ids) in pending["object_ids"].items():
+            if user_id not in pending["user_ids"]:
+                kls.refresh_objects([user_id], object_ids)
+
+    @classmethod
+    def get_permitted_object_ids(kls, user, permission_level):
+        """This returns a QuerySet of object IDs, which is able to be used as a sub-query"""
+        # This reflects the changes that are made in this thread and not committed yet
+        kls.flush_pending()
+
+        return kls.objects.filter(user=user, acl__gte=permission_level.id).values("object_id")
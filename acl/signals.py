@@ -1,20 +1,65 @@
 from django.contrib.auth.models import Permission
 from django.contrib.contenttypes.models import ContentType
-from django.db.models.signals import post_save
+from django.db.models.signals import m2m_changed, post_save
 from django.dispatch import receiver
 
 from airone.lib.acl import ACLType
 from entity.models import Entity, EntityAttr
 from entry.models import Attribute, Entry
+from group.models import Group, GroupHierarchy
+from role.models import Role
+from user.models import PermissionContext, User
 
-from .models import ACLBase
+from .models import ACLBase, ACLPermission, EffectivePermission
+
+
+def _get_subordinate_group_ids(group_ids):
+    """This returns IDs of specified groups and all groups that are hierarchically under them"""
+    return set(group_ids) | set(
+        GroupHierarchy.objects.filter(ancestor__in=group_ids).values_list("descendant", flat=True)
+    )
+
+
+def _get_dependent_user_ids(objs):
+    """This returns IDs of users whose EffectivePermissions depend on specified objects"""
+    user_ids = set()
+    group_ids = set()
+    for obj in objs:
+        if isinstance(obj, User):
+            user_ids.add(obj.id)
+
+        elif isinstance(obj, Group):
+            group_ids.add(obj.id)
+
+        elif isinstance(obj, Role):
+            user_ids |= set(obj.users.values_list("id", flat=True))
+            user_ids |= set(obj.admin_users.values_list("id", flat=True))
+            group_ids |= set(obj.groups.values_list("id", flat=True))
+            group_ids |= set(obj.admin_groups.values_list("id", flat=True))
+
+        elif isinstance(obj, Permission):
+            user_ids |= _get_dependent_user_ids(Role.objects.filter(permissions=obj))
+
+    if group_ids:
+        user_ids |= set(
+            User.objects.filter(groups__in=_get_subordinate_group_ids(group_ids)).values_list(
+                "id", flat=True
+            )
+        )
+
+    return user_ids
 
 
 def create_permission(instance):
     content_type = ContentType.objects.get_for_model(instance)
+    permissions = []
     for acltype in ACLType.availables():
         codename = "%s.%s" % (instance.id, acltype.id)
-        Permission(name=acltype.name, codename=codename, content_type=content_type).save()
+        permission = Permission(name=acltype.name, codename=codename, content_type=content_type)
+        permission.save()
+        permissions.append(permission)
+
+    ACLPermission.register(permissions)
 
 
 @receiver(post_save, sender=ACLBase)
@@ -45,3 +90,63 @@ def entry_create_permission(sender, instance, created, **kwargs):
 def attribute_create_permission(sender, instance, created, **kwargs):
     if created:
         create_permission(instance)
+
+
+@receiver(post_save, sender=Role)
+@receiver(post_save, sender=Group)
+@receiver(m2m_changed, sender=Role.permissions.through)
+@receiver(m2m_changed, sender=Role.users.through)
+@receiver(m2m_changed, sender=Role.groups.through)
+@receiver(m2m_changed, sender=Role.admin_users.through)
+@receiver(m2m_changed, sender=Role.admin_groups.through)
+@receiver(m2m_changed, sender=User.groups.through)
+def expire_permission_contexts(sender, **kwargs):
+    # permissions that users have through Roles might be changed
+    PermissionContext.expire_all()
+
+
+@receiver(post_save, sender=Role)
+@receiver(post_save, sender=Group)
+def refresh_effective_permissions(sender, instance, created, **kwargs):
+    # This is needed when Role is (in)activated or parent_group of Group is changed
+    if not created:
+        EffectivePermission.schedule_refresh(_get_dependent_user_ids([instance]))
+
+
+@receiver(m2m_changed, sender=Role.permissions.through)
+@receiver(m2m_changed, sender=Role.users.through)
+@receiver(m2m_changed, sender=Role.groups.through)
+@receiver(m2m_changed, sender=Role.admin_users.through)
+@receiver(m2m_changed, sender=Role.admin_groups.through)
+@receiver(m2m_changed, sender=User.groups.through)
+def refresh_effective_permissions_by_relation(sender, instance, action, model, pk_set, **kwargs):
+    # pk_set is not specified when relations are cleared, so this keeps users who depend on
+    # the instance before they are removed from it.
+    if action == "pre_clear":
+        instance._dependent_user_ids = _get_dependent_user_ids([instance])
+
+    if not action.startswith("post_"):
+        return
+
+    # When permissions of Roles are added or removed, only the permissions to the objects
+    # of them are needed to be refreshed for users who have the Roles.
+    if sender == Role.permissions.through and pk_set:
+        if isinstance(instance, Role):
+            (roles, permission_ids) = ([instance], pk_set)
+        else:
+            (roles, permission_ids) = (Role.objects.filter(pk__in=pk_set), [instance.id])
+
+        EffectivePermission.schedule_refresh(
+            _get_dependent_user_ids(roles),
+            ACLPermission.objects.filter(permission__in=permission_ids).values_list(
+                "object_id", flat=True
+            ),
+        )
+        return
+
+    user_ids = instance.__dict__.pop("_dependent_user_ids", set())
+    user_ids |= _get_dependent_user_ids([instance])
+    if pk_set and model in [User, Group, Role]:
+        user_ids |= _get_dependent_user_ids(model.objects.filter(pk__in=pk_set))
+
+    EffectivePermission.schedule_refresh(user_ids)
@@ -3,7 +3,7 @@ from importlib import import_module
 from django.contrib.auth.models import Permission
 from django.test import TestCase
 
-from acl.models import ACLBase
+from acl.models import ACLBase, ACLPermission
 from airone.lib.acl import ACLType
 from airone.lib.types import AttrTypeValue
 from group.models import Group
@@ -145,6 +145,35 @@ class ModelTest(TestCase):
         self.assertTrue(type_readable <= ACLType.Writable)
         self.assertFalse(type_readable <= ACLType.Nothing)
 
+    def test_acl_permission(self):
+        aclobj = ACLBase.objects.create(name="obj", created_user=self.user, is_public=False)
+
+        # checks ACLPermissions are created with Permissions of the object
+        self.assertEqual(
+            sorted(ACLPermission.objects.filter(object_id=aclobj.id).values_list("acl", flat=True)),
+            sorted([x.id for x in ACLType.availables()]),
+        )
+        self.assertEqual(aclobj.writable.acl.acl, ACLType.Writable.id)
+
+        # checks permission of Role and Group to the object is looked up with it
+        group = Group.objects.create(name="group")
+        group.permissions.add(aclobj.writable)
+        self.role.permissions.add(aclobj.readable)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.role.get_current_permission(aclobj), ACLType.Readable.id)
+        self.assertTrue(self.role.is_permitted(aclobj, ACLType.Readable))
+        self.assertFalse(self.role.is_permitted(aclobj, ACLType.Writable))
+        self.assertTrue(group.has_permission(aclobj, ACLType.Writable))
+        self.assertFalse(group.has_permission(aclobj, ACLType.Full))
+
+        # checks register_all() registers ACLPermissions only for Permissions that lack it
+        ACLPermission.objects.filter(object_id=aclobj.id).delete()
+        ACLPermission.register_all()
+        self.assertEqual(
+            ACLPermission.get_acl(aclobj.id, permission__role=self.role), ACLType.Readable.id
+        )
+        self.assertEqual(ACLPermission.objects.filter(object_id=aclobj.id).count(), 3)
+
     def test_default_permission(self):
         admin_user = User.objects.create(username="admin", is_superuser=True)
         another_user = User.objects.create(username="bar", email="bar@example.com", password="")
@@ -1,11 +1,15 @@
+from unittest import mock
+
 from django.contrib.auth.models import Permission
 from django.test import TestCase
 
-from acl.models import ACLBase
+from acl.models import ACLBase, EffectivePermission
 from airone.lib.acl import ACLType
 from airone.lib.types import AttrTypeValue
 from entity.models import Entity, EntityAttr
 from entry.models import Attribute, Entry
+from group.models import Group
+from role.models import Role
 from user.models import User
 
 
@@ -89,3 +93,60 @@ class SignalTest(TestCase):
         obj.name = "changedName"
         obj.save(update_fields=["name"])
         self.assertTrue(Attribute.objects.filter(name="changedName", is_active=True).exists())
+
+    def test_refresh_effective_permissions(self):
+        def _get_effective_permissions(user):
+            # This test runs in a transaction, so pending refreshes are flushed explicitly
+            EffectivePermission.flush_pending()
+
+            return dict(
+                EffectivePermission.objects.filter(user=user).values_list("object_id", "acl")
+            )
+
+        entity = Entity.objects.create(name="entity", created_user=self.user, is_public=False)
+        role = Role.objects.create(name="role")
+        role.permissions.add(entity.readable)
+        self.assertEqual(_get_effective_permissions(self.user), {})
+
+        # checks permissions are materialized when user belongs to Role
+        role.users.add(self.user)
+        self.assertEqual(_get_effective_permissions(self.user), {entity.id: ACLType.Readable.id})
+
+        role.permissions.add(entity.full)
+        self.assertEqual(_get_effective_permissions(self.user), {entity.id: ACLType.Full.id})
+
+        role.users.clear()
+        self.assertEqual(_get_effective_permissions(self.user), {})
+
+        # checks permissions through hierarchical groups are also materialized
+        parent_group = Group.objects.create(name="parent")
+        group = Group.objects.create(name="group")
+        self.user.groups.add(group)
+        role.groups.add(parent_group)
+        self.assertEqual(_get_effective_permissions(self.user), {})
+
+        group.parent_group = parent_group
+        group.save()
+        self.assertEqual(_get_effective_permissions(self.user), {entity.id: ACLType.Full.id})
+
+        role.permissions.remove(entity.full)
+        self.assertEqual(_get_effective_permissions(self.user), {entity.id: ACLType.Readable.id})
+
+        # checks editing permissions of Role refreshes only permissions to the object
+        # without rebuilding all permissions of users
+        with mock.patch.object(EffectivePermission, "refresh") as mock_refresh:
+            role.permissions.add(entity.writable)
+            role.permissions.remove(entity.readable)
+            self.assertEqual(
+                _get_effective_permissions(self.user), {entity.id: ACLType.Writable.id}
+            )
+            self.assertFalse(mock_refresh.call_args.args[0])
+
+        # checks permissions are removed when Role is deleted
+        role.delete()
+        self.assertEqual(_get_effective_permissions(self.user), {})
+
+        # checks refresh_all() rebuilds the same permissions
+        Role.objects.filter(id=role.id).update(is_active=True)
+        EffectivePermission.refresh_all()
+        self.assertEqual(_get_effective_permissions(self.user), {entity.id: ACLType.Writable.id})
@@ -70,5 +70,4 @@ def celery_task_failure_update_job_status(**kwargs):
 
     job_id = kwargs["args"][0]
     job = Job.objects.get(id=job_id)
-    job.status = Job.STATUS["ERROR"]
-    job.save(update_fields=["status"])
+    job.update(Job.STATUS["ERROR"])
@@ -1,3 +1,6 @@
+from importlib import import_module
+
+from django.db.models import Q
 from six import with_metaclass
 
 __all__ = ["ACLType", "ACLObjType"]
@@ -78,6 +81,46 @@ class ACLType(Iteratable):
 
 def get_permitted_objects(user, model, permission_level):
     # This method assumes that model is a subclass of ACLBase
-    return [
-        x for x in model.objects.all() if user.has_permission(x, permission_level) and x.is_active
-    ]
+    return list(filter_permitted(user, model.objects.filter(is_active=True), permission_level))
+
+
+def filter_permitted(user, queryset, permission_level):
+    """This returns objects of the queryset that user has permission_level to access.
+
+    The result is same with checking User.has_permission() for each of them, but this is
+    evaluated in one SQL query that refers EffectivePermissions of the user. So this is
+    able to filter a large number of objects (e.g. Entries to export) at once.
+    """
+    if user.is_superuser:
+        return queryset
+
+    # This try-catch syntax is needed because the 'issubclass' may occur a
+    # TypeError exception when permission_level is not object.
+    try:
+        if not issubclass(permission_level, ACLTypeBase):
+            return queryset.none()
+    except TypeError:
+        return queryset.none()
+
+    permitted_ids = import_module("acl.models").EffectivePermission.get_permitted_object_ids(
+        user, permission_level
+    )
+
+    def _get_query(prefix=""):
+        return (
+            Q(**{prefix + "is_public": True})
+            | Q(**{prefix + "default_permission__gte": permission_level.id})
+            | Q(**{prefix + "id__in": permitted_ids})
+        )
+
+    query = _get_query()
+
+    # When the permission of Entity (or EntityAttr) is not permitted, access to its
+    # Entries (or Attributes) is also not permitted.
+    if issubclass(
+        queryset.model,
+        (import_module("entry.models").Entry, import_module("entry.models").Attribute),
+    ):
+        query &= _get_query("schema__")
+
+    return queryset.filter(query)
@@ -1,11 +1,16 @@
+import itertools
 import json
+import os
 import re
+import threading
 from datetime import datetime
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
 
 from django.conf import settings
 from django.db.models import Q
-from elasticsearch import Elasticsearch
+from django.utils.dateparse import parse_datetime
+from elasticsearch import Elasticsearch, Transport, helpers
+from elasticsearch.exceptions import HTTP_EXCEPTIONS, TransportError
 
 from airone.lib.acl import ACLType
 from airone.lib.log import Logger
@@ -14,13 +19,48 @@ from entity.models import Entity
 from entry.settings import CONFIG
 from user.models import User
 
+# This holds Transport objects, which have connection pools to the Elasticsearch nodes, to
+# share them among ESS instances in the same process. The process ID is a part of the key
+# not to share connections with forked (e.g. Celery worker) processes.
+_SHARED_TRANSPORTS: Dict[Tuple, Transport] = {}
+_SHARED_TRANSPORTS_LOCK = threading.Lock()
+
+
+def _get_shared_transport(hosts, **kwargs) -> Transport:
+    key = (
+        os.getpid(),
+        json.dumps(hosts, sort_keys=True, default=str),
+        json.dumps(kwargs, sort_keys=True, default=str),
+    )
+    with _SHARED_TRANSPORTS_LOCK:
+        if key not in _SHARED_TRANSPORTS:
+            _SHARED_TRANSPORTS[key] = Transport(hosts, **kwargs)
+
+        return _SHARED_TRANSPORTS[key]
+
+
+# This holds (process ID, index name) pairs whose max_result_window has already been expanded.
+# Indices created by ESS have it in their settings, but older ones are updated at the first
+# search in each process.
+_CONFIGURED_INDICES: Set[Tuple[int, str]] = set()
+_CONFIGURED_INDICES_LOCK = threading.Lock()
+
 
 class ESS(Elasticsearch):
     MAX_TERM_SIZE = 32766
 
-    def __init__(self, index=None, *args, **kwargs):
-        self.additional_config = False
+    # This is the default number of connections that are kept alive for each node
+    CONNECTION_POOL_MAXSIZE = 10
+
+    # These are default parameters to send documents through the bulk API. The chunk is
+    # flushed when either the number of documents or its total bytes reach these limits.
+    BULK_CHUNK_SIZE = 500
+    BULK_MAX_CHUNK_BYTES = 10 * 1024 * 1024
+
+    # This is the number of hits to get at one request when results are read page by page
+    SEARCH_PAGE_SIZE = 1000
 
+    def __init__(self, index=None, *args, **kwargs):
         self._index = index
         if not index:
             self._index = settings.ES_CONFIG["INDEX"]
@@ -28,6 +68,12 @@ class ESS(Elasticsearch):
         if ("timeout" not in kwargs) and (settings.ES_CONFIG["TIMEOUT"] is not None):
             kwargs["timeout"] = settings.ES_CONFIG["TIMEOUT"]
 
+        if "maxsize" not in kwargs:
+            kwargs["maxsize"] = settings.ES_CONFIG.get("MAXSIZE", self.CONNECTION_POOL_MAXSIZE)
+
+        # Creating ESS is cheap because the connection pool is shared in the process
+        kwargs.setdefault("transport_class", _get_shared_transport)
+
         super(ESS, self).__init__(settings.ES_CONFIG["NODES"], *args, **kwargs)
 
     def delete(self, *args, **kwargs):
@@ -39,99 +85,316 @@ class ESS(Elasticsearch):
     def index(self, *args, **kwargs):
         return super(ESS, self).index(index=self._index, *args, **kwargs)
 
-    def search(self, *args, **kwargs):
-        # expand max_result_window parameter which indicates numbers to return at one searching
-        if not self.additional_config:
-            self.additional_config = True
+    def bulk_index(self, documents, chunk_size=None, max_chunk_bytes=None, skip_refresh=False):
+        """This registers documents to the index through the bulk API.
 
-            body = {"index": {"max_result_window": settings.ES_CONFIG["MAXIMUM_RESULTS_NUM"]}}
-            self.indices.put_settings(index=self._index, body=body)
+        The documents parameter is an iterable of (id, body) tuples. It is consumed lazily
+        so that callers are able to build bodies chunk by chunk. Failures are not raised
+        but reported for each item, and the index is refreshed only once at the end.
+
+        Returns:
+            tuple(int, list(dict)): The number of registered documents and the errors
+                of the failed ones (each of them has 'id', 'status' and 'error').
+        """
+        actions = (
+            {
+                "_op_type": "index",
+                "_index": self._index,
+                "_type": "entry",
+                "_id": doc_id,
+                "_source": body,
+            }
+            for (doc_id, body) in documents
+        )
+        return self._send_bulk(actions, chunk_size, max_chunk_bytes, skip_refresh)
+
+    def bulk_delete(self, doc_ids, chunk_size=None, max_chunk_bytes=None, skip_refresh=False):
+        """This deletes documents of the specified IDs through the bulk API.
+
+        Documents that don't exist in the index are regarded as deleted ones.
+
+        Returns:
+            tuple(int, list(dict)): same as bulk_index()
+        """
+        actions = (
+            {"_op_type": "delete", "_index": self._index, "_type": "entry", "_id": doc_id}
+            for doc_id in doc_ids
+        )
+        return self._send_bulk(actions, chunk_size, max_chunk_bytes, skip_refresh)
+
+    def _send_bulk(self, actions, chunk_size=None, max_chunk_bytes=None, skip_refresh=False):
+        success_count = 0
+        errors = []
+        for is_ok, info in helpers.streaming_bulk(
+            self,
+            actions,
+            chunk_size=chunk_size or self.BULK_CHUNK_SIZE,
+            max_chunk_bytes=max_chunk_bytes or self.BULK_MAX_CHUNK_BYTES,
+            raise_on_error=False,
+            raise_on_exception=False,
+        ):
+            if is_ok:
+                success_count += 1
+                continue
+
+            # info has only one item whose key is the operation type (e.g. "index")
+            [(op_type, result)] = info.items()
+            if op_type == "delete" and result.get("status") == 404:
+                success_count += 1
+                continue
+
+            error = {
+                "id": result.get("_id"),
+                "status": result.get("status"),
+                "error": result.get("error"),
+            }
+            Logger.warning("Failed to %s document in bulk: %s" % (op_type, error))
+            errors.append(error)
+
+        if not skip_refresh:
+            self.refresh()
+
+        return (success_count, errors)
+
+    def search(self, *args, **kwargs):
+        self._expand_max_result_window()
 
         if "size" not in kwargs:
             kwargs["size"] = settings.ES_CONFIG["MAXIMUM_RESULTS_NUM"]
 
         return super(ESS, self).search(index=self._index, *args, **kwargs)
 
+    def _expand_max_result_window(self) -> None:
+        key = (os.getpid(), self._index)
+        if key in _CONFIGURED_INDICES:
+            return
+
+        with _CONFIGURED_INDICES_LOCK:
+            if key in _CONFIGURED_INDICES:
+                return
+
+            # expand max_result_window parameter which indicates numbers to return at one
+            # searching. This is retried at next search when the index doesn't exist yet.
+            body = {"index": {"max_result_window": settings.ES_CONFIG["MAXIMUM_RESULTS_NUM"]}}
+            res = self.indices.put_settings(index=self._index, body=body, ignore=[404])
+            if "error" not in res:
+                _CONFIGURED_INDICES.add(key)
+
+    def search_pages(self, body: Dict, page_size: Optional[int] = None, **kwargs) -> Iterator[Dict]:
+        """This yields search results page by page using search_after.
+
+        Unlike from/size pagination, this isn't limited by max_result_window and each
+        request returns a bounded number of hits. Hits are sorted by the sort parameter of
+        the body (by name by default) and _id as the tie-breaker. When the search fails
+        (e.g. the index doesn't exist with ignore=[404]), the error response is yielded and
+        the iteration stops.
+        """
+        [pages] = self.msearch_pages([body], page_size, **kwargs)
+        return pages
+
+    def msearch_pages(
+        self, bodies: List[Dict], page_size: Optional[int] = None, **kwargs
+    ) -> List[Iterator[Dict]]:
+        """This is the multiple version of search_pages().
+
+        The first pages of all bodies are read at once through the multi search API, then
+        following pages are read for each of them while they are consumed. So searching
+        with multiple bodies takes one round-trip unless they have more hits than page_size.
+        """
+        if not bodies:
+            return []
+
+        page_size = page_size or self.SEARCH_PAGE_SIZE
+        bodies = [self._get_paging_body(x, page_size) for x in bodies]
+
+        res = self.msearch(index=self._index, body=sum([[{}, x] for x in bodies], []), **kwargs)
+
+        # the whole request fails (e.g. the index doesn't exist with ignore=[404])
+        if "responses" not in res:
+            return [self._iterate_pages(x, res, page_size, **kwargs) for x in bodies]
+
+        for response in res["responses"]:
+            # raise the error of each search as search() does, unless it's ignored
+            if "error" in response and response.get("status") not in kwargs.get("ignore", []):
+                raise HTTP_EXCEPTIONS.get(response.get("status"), TransportError)(
+                    response.get("status"), response["error"].get("type"), response
+                )
+
+        return [
+            self._iterate_pages(x, y, page_size, **kwargs)
+            for (x, y) in zip(bodies, res["responses"])
+        ]
+
+    def _get_paging_body(self, body: Dict, page_size: int) -> Dict:
+        body = dict(body)
+        body.pop("from", None)
+        body["size"] = page_size
+        body["sort"] = list(body.get("sort", [{"name.keyword": {"order": "asc"}}])) + [
+            {"_id": {"order": "asc"}}
+        ]
+
+        return body
+
+    def _iterate_pages(self, body: Dict, res: Dict, page_size: int, **kwargs) -> Iterator[Dict]:
+        while True:
+            yield res
+
+            if "error" in res or len(res["hits"]["hits"]) < page_size:
+                return
+
+            body["search_after"] = res["hits"]["hits"][-1]["sort"]
+            res = self.search(body=body, size=page_size, **kwargs)
+
     def recreate_index(self) -> None:
+        # delete indices that are pointed by the alias, which has the same name of this index
+        for index in self.get_aliased_indices():
+            self.indices.delete(index=index, ignore=[400, 404])
+
         self.indices.delete(index=self._index, ignore=[400, 404])
-        self.indices.create(
+        self.indices.create(index=self._index, ignore=400, body=self._get_index_body())
+
+    def get_aliased_indices(self) -> List[str]:
+        """This returns names of indices that are pointed by the alias of this index name"""
+        if not self.indices.exists_alias(name=self._index):
+            return []
+
+        return list(self.indices.get_alias(name=self._index).keys())
+
+    def create_versioned_index(self) -> str:
+        """This creates a new index to build documents behind the index currently used.
+
+        The created index is named with the creation time (e.g. "airone_v20220401120000")
+        and it is not used for searching until switch_alias() is called with it.
+        """
+        index = "%s_v%s" % (self._index, datetime.now().strftime("%Y%m%d%H%M%S%f"))
+        self.indices.create(index=index, body=self._get_index_body())
+
+        return index
+
+    def switch_alias(self, new_index: str) -> None:
+        """This makes the alias of this index name point to the new_index atomically.
+
+        Then indices that the alias pointed before are deleted. When a concrete index
+        which has the same name of the alias exists (e.g. the one recreate_index() created),
+        it is also removed in the same request, because an alias can't have the same name
+        with an index.
+        """
+        old_indices = self.get_aliased_indices()
+
+        actions: List[Dict] = [{"remove": {"index": x, "alias": self._index}} for x in old_indices]
+        if not old_indices and self.indices.exists(index=self._index):
+            actions.append({"remove_index": {"index": self._index}})
+        actions.append({"add": {"index": new_index, "alias": self._index}})
+
+        self.indices.update_aliases(body={"actions": actions})
+
+        for index in [x for x in old_indices if x != new_index]:
+            self.indices.delete(index=index, ignore=[404])
+
+    def get_sync_watermark(self) -> Optional[datetime]:
+        """This returns the time until when documents of this index are synchronized.
+
+        The watermark is stored in the "_meta" of the mapping, so it's cleared whenever the
+        index is recreated.
+        """
+        if not self.indices.exists(index=self._index):
+            return None
+
+        mappings = self.indices.get_mapping(index=self._index, doc_type="entry")
+        for mapping in mappings.values():
+            meta = mapping.get("mappings", {}).get("entry", {}).get("_meta", {})
+            if "synced_time" in meta:
+                return parse_datetime(meta["synced_time"])
+
+        return None
+
+    def set_sync_watermark(self, synced_time: datetime) -> None:
+        self.indices.put_mapping(
             index=self._index,
-            ignore=400,
-            body=json.dumps(
-                {
-                    "mappings": {
-                        "entry": {
-                            "properties": {
-                                "name": {
-                                    "type": "text",
-                                    "index": "true",
-                                    "analyzer": "keyword",
-                                    "fields": {
-                                        "keyword": {"type": "keyword"},
-                                    },
+            doc_type="entry",
+            body={"_meta": {"synced_time": synced_time.isoformat()}},
+        )
+
+    def _get_index_body(self) -> str:
+        return json.dumps(
+            {
+                # expand max_result_window parameter which indicates numbers to return at
+                # one searching
+                "settings": {
+                    "index": {"max_result_window": settings.ES_CONFIG["MAXIMUM_RESULTS_NUM"]}
+                },
+                "mappings": {
+                    "entry": {
+                        "properties": {
+                            "name": {
+                                "type": "text",
+                                "index": "true",
+                                "analyzer": "keyword",
+                                "fields": {
+                                    "keyword": {"type": "keyword"},
                                 },
-                                "entity": {
-                                    "type": "nested",
-                                    "properties": {
-                                        "id": {
-                                            "type": "integer",
-                                            "index": "true",
-                                        },
-                                        "name": {
-                                            "type": "text",
-                                            "index": "true",
-                                            "analyzer": "keyword",
-                                        },
+                            },
+                            "entity": {
+                                "type": "nested",
+                                "properties": {
+                                    "id": {
+                                        "type": "integer",
+                                        "index": "true",
                                     },
-                                },
-                                "attr": {
-                                    "type": "nested",
-                                    "properties": {
-                                        "name": {
-                                            "type": "text",
-                                            "index": "true",
-                                            "analyzer": "keyword",
-                                        },
-                                        "type": {
-                                            "type": "integer",
-                                            "index": "false",
-                                        },
-                                        "id": {
-                                            "type": "integer",
-                                            "index": "false",
-                                        },
-                                        "key": {
-                                            "type": "text",
-                                            "index": "true",
-                                        },
-                                        "date_value": {
-                                            "type": "date",
-                                            "index": "true",
-                                        },
-                                        "value": {
-                                            "type": "text",
-                                            "index": "true",
-                                            "analyzer": "keyword",
-                                        },
-                                        "referral_id": {
-                                            "type": "integer",
-                                            "index": "false",
-                                        },
-                                        "is_readble": {
-                                            "type": "boolean",
-                                            "index": "true",
-                                        },
+                                    "name": {
+                                        "type": "text",
+                                        "index": "true",
+                                        "analyzer": "keyword",
                                     },
                                 },
-                                "is_readble": {
-                                    "type": "boolean",
-                                    "index": "true",
+                            },
+                            "attr": {
+                                "type": "nested",
+                                "properties": {
+                                    "name": {
+                                        "type": "text",
+                                        "index": "true",
+                                        "analyzer": "keyword",
+                                    },
+                                    "type": {
+                                        "type": "integer",
+                                        "index": "false",
+                                    },
+                                    "id": {
+                                        "type": "integer",
+                                        "index": "false",
+                                    },
+                                    "key": {
+                                        "type": "text",
+                                        "index": "true",
+                                    },
+                                    "date_value": {
+                                        "type": "date",
+                                        "index": "true",
+                                    },
+                                    "value": {
+                                        "type": "text",
+                                        "index": "true",
+                                        "analyzer": "keyword",
+                                    },
+                                    "referral_id": {
+                                        "type": "integer",
+                                        "index": "false",
+                                    },
+                                    "is_readble": {
+                                        "type": "boolean",
+                                        "index": "true",
+                                    },
                                 },
-                            }
+                            },
+                            "is_readble": {
+                                "type": "boolean",
+                                "index": "true",
+                            },
                         }
                     }
-                }
-            ),
+                },
+            }
         )
 
 
@@ -139,7 +402,12 @@ __all__ = [
     "make_query",
     "make_query_for_simple",
     "execute_query",
+    "execute_query_in_pages",
+    "execute_queries_in_pages",
+    "execute_query_in_range",
     "make_search_results",
+    "make_search_results_for_entities",
+    "iterate_search_results",
     "make_search_results_for_simple",
     "prepend_escape_character",
     "is_date_check",
@@ -695,6 +963,170 @@ def execute_query(query: Dict[str, str], size: int = 0) -> Dict[str, str]:
     return res
 
 
+def execute_query_in_pages(
+    query: Dict[str, Any], page_size: Optional[int] = None
+) -> Iterator[Dict]:
+    """Run a search query and yield its results page by page.
+
+    This keeps memory usage bounded for a large number of results, because each page has
+    at most page_size hits.
+
+    Args:
+        query (dict[str, str]): Search query
+        page_size (int): Number of hits in each page
+
+    Returns:
+        Iterator[dict]: Search execution result of each page
+    """
+    return ESS().search_pages(query, page_size, ignore=[404])
+
+
+def execute_queries_in_pages(
+    queries: List[Dict[str, Any]], page_size: Optional[int] = None
+) -> List[Iterator[Dict]]:
+    """Run multiple search queries at once and return their results page by page.
+
+    The first pages of all queries are read through one multi search request.
+
+    Args:
+        queries (list(dict[str, str])): Search queries
+        page_size (int): Number of hits in each page
+
+    Returns:
+        list(Iterator[dict]): Search execution result of each page for each query
+    """
+    return ESS().msearch_pages(queries, page_size, ignore=[404])
+
+
+def execute_query_in_range(query: Dict[str, Any], offset: int, size: int) -> Dict[str, Any]:
+    """Run a search query and return hits in the specified range.
+
+    Hits before the offset are skipped page by page, so this is able to return results
+    beyond max_result_window which from/size pagination can't reach.
+
+    Returns:
+        dict[str, str]: Search execution result which has the same structure with
+            the one of execute_query()
+    """
+    res: Dict = {"hits": {"total": 0, "hits": []}}
+
+    position = 0
+    for page in execute_query_in_pages(query):
+        if "status" in page:
+            return page
+
+        res["hits"]["total"] = page["hits"]["total"]
+
+        hits = page["hits"]["hits"]
+        res["hits"]["hits"].extend(
+            hits[max(offset - position, 0) : max(offset + size - position, 0)]
+        )
+        position += len(hits)
+
+        if position >= offset + size:
+            break
+
+    return res
+
+
+def _iterate_hit_entries(pages: Iterable[Dict[str, Any]], hint_referral: str) -> Iterator[Tuple]:
+    """This yields Entry and its document of each hit in the order of hits.
+
+    When the hint_referral is specified, only entries that are referred from the entries
+    whose name matches with it are yielded (or entries that are not referred from any
+    entries when it's the EMPTY_SEARCH_CHARACTER).
+    """
+    from entry.models import AttributeValue, Entry
+
+    for page in pages:
+        hits = page["hits"]["hits"]
+        hit_entry_ids = [x["_id"] for x in hits]
+
+        if isinstance(hint_referral, str) and hint_referral:
+            # If the hint_referral parameter is specified,
+            # this filters results that only have specified referral entry.
+
+            if (
+                CONFIG.EMPTY_SEARCH_CHARACTER == hint_referral
+                or CONFIG.EMPTY_SEARCH_CHARACTER_CODE == hint_referral
+            ):
+
+                hit_entry_ids_num = [int(x) for x in hit_entry_ids]
+                filtered_ids = set(hit_entry_ids_num) - set(
+                    AttributeValue.objects.filter(
+                        Q(
+                            referral__id__in=hit_entry_ids,
+                            parent_attr__is_active=True,
+                            is_latest=True,
+                        )
+                        | Q(
+                            referral__id__in=hit_entry_ids,
+                            parent_attr__is_active=True,
+                            parent_attrv__is_latest=True,
+                        )
+                    ).values_list("referral_id", flat=True)
+                )
+
+            else:
+
+                filtered_ids = AttributeValue.objects.filter(
+                    Q(
+                        parent_attr__parent_entry__name__iregex=prepend_escape_character(
+                            CONFIG.ESCAPE_CHARACTERS_REFERRALS_ENTRY, hint_referral
+                        ),
+                        referral__id__in=hit_entry_ids,
+                        is_latest=True,
+                    )
+                    | Q(
+                        parent_attr__parent_entry__name__iregex=prepend_escape_character(
+                            CONFIG.ESCAPE_CHARACTERS_REFERRALS_ENTRY, hint_referral
+                        ),
+                        referral__id__in=hit_entry_ids,
+                        parent_attrv__is_latest=True,
+                    )
+                ).values_list("referral", flat=True)
+
+            hit_entries = Entry.objects.filter(pk__in=filtered_ids, is_active=True)
+        else:
+            hit_entries = Entry.objects.filter(id__in=hit_entry_ids, is_active=True)
+
+        # build the map of ID and Entry once, instead of scanning hits for each entry
+        entries = {x.id: x for x in hit_entries.select_related("schema")}
+        for hit in hits:
+            entry = entries.pop(int(hit["_id"]), None)
+            if entry:
+                yield (entry, hit["_source"])
+
+
+def iterate_search_results(
+    user: User,
+    pages: Iterable[Dict[str, Any]],
+    hint_attrs: List[Dict[str, str]],
+    hint_referral: str,
+) -> Iterator[Dict[str, Any]]:
+    """This yields each search result in the order of hits while reading pages lazily.
+
+    This is the streaming version of make_search_results() to handle a large number of
+    results (e.g. exporting them) with bounded memory.
+
+    Args:
+        pages (Iterable[dict]): Search results of Elasticsearch for each page
+        hint_attrs (list(dict[str, str])):  A list of search strings and attribute sets
+        hint_referral (str): Input value used to refine the reference entry.
+
+    Returns:
+        Iterator[dict]: same as each item of 'ret_values' of make_search_results()
+    """
+    hit_infos = _iterate_hit_entries(pages, hint_referral)
+    while True:
+        # results are made for each chunk of hits to resolve them at once
+        chunk = list(itertools.islice(hit_infos, ESS.SEARCH_PAGE_SIZE))
+        if not chunk:
+            return
+
+        yield from _make_search_result_values(user, chunk, hint_attrs, hint_referral)
+
+
 def make_search_results(
     user: User,
     res: Dict[str, Any],
@@ -737,77 +1169,162 @@ def make_search_results(
             that was hit in the search
 
     """
-    from entry.models import AttributeValue, Entry
+    return make_search_results_for_entities(user, [(res, hint_attrs)], limit, hint_referral)
 
-    # set numbers of found entries
-    results = {
-        "ret_count": res["hits"]["total"],
+
+def make_search_results_for_entities(
+    user: User,
+    results_of_entities: List[Tuple[Any, List[Dict[str, str]]]],
+    limit: int,
+    hint_referral: str,
+) -> Dict[str, Any]:
+    """Merges search results of multiple Entities in the order of entry name
+
+    Each item of results_of_entities is a tuple of the search result of Elasticsearch
+    (or an iterable of them for each page) and hint_attrs for the Entity. Pages after
+    the first one are read only when they are necessary to return results up to limit.
+
+    Returns:
+        dict[str, str]: same as make_search_results()
+    """
+    results: Dict[str, Any] = {
+        "ret_count": 0,
         "ret_values": [],
     }
 
-    # get django objects from the hit information from Elasticsearch
-    hit_entry_ids = [x["_id"] for x in res["hits"]["hits"]]
-    if isinstance(hint_referral, str) and hint_referral:
-        # If the hint_referral parameter is specified,
-        # this filters results that only have specified referral entry.
+    hit_infos: List = []
+    for (index, (res, _)) in enumerate(results_of_entities):
+        (count, entity_hit_infos) = _get_hit_entries(res, limit, hint_referral)
+        results["ret_count"] += count
+        hit_infos += [(entry, entry_info, index) for (entry, entry_info) in entity_hit_infos]
+
+    hit_infos = sorted(hit_infos, key=lambda x: x[0].name)[: max(limit, 0)]
+
+    # make results for each Entity because hint_attrs depends on it
+    values: Dict[int, Dict[str, Any]] = {}
+    for (index, (_, hint_attrs)) in enumerate(results_of_entities):
+        entity_hit_infos = [(x, y) for (x, y, z) in hit_infos if z == index]
+        if entity_hit_infos:
+            for value in _make_search_result_values(
+                user, entity_hit_infos, hint_attrs, hint_referral
+            ):
+                values[value["entry"]["id"]] = value
 
-        if (
-            CONFIG.EMPTY_SEARCH_CHARACTER == hint_referral
-            or CONFIG.EMPTY_SEARCH_CHARACTER_CODE == hint_referral
-        ):
+    results["ret_values"] = [values[x.id] for (x, _, _) in hit_infos]
 
-            hit_entry_ids_num = [int(x) for x in hit_entry_ids]
-            filtered_ids = set(hit_entry_ids_num) - set(
-                AttributeValue.objects.filter(
-                    Q(
-                        referral__id__in=hit_entry_ids,
-                        parent_attr__is_active=True,
-                        is_latest=True,
-                    )
-                    | Q(
-                        referral__id__in=hit_entry_ids,
-                        parent_attr__is_active=True,
-                        parent_attrv__is_latest=True,
-                    )
-                ).values_list("referral_id", flat=True)
-            )
+    return results
 
-        else:
 
-            filtered_ids = AttributeValue.objects.filter(
-                Q(
-                    parent_attr__parent_entry__name__iregex=prepend_escape_character(
-                        CONFIG.ESCAPE_CHARACTERS_REFERRALS_ENTRY, hint_referral
-                    ),
-                    referral__id__in=hit_entry_ids,
-                    is_latest=True,
-                )
-                | Q(
-                    parent_attr__parent_entry__name__iregex=prepend_escape_character(
-                        CONFIG.ESCAPE_CHARACTERS_REFERRALS_ENTRY, hint_referral
-                    ),
-                    referral__id__in=hit_entry_ids,
-                    parent_attrv__is_latest=True,
-                )
-            ).values_list("referral", flat=True)
+def _get_hit_entries(res: Any, limit: int, hint_referral: str) -> Tuple[int, List[Tuple]]:
+    """This returns the number of matched entries and the first ones of them up to limit"""
+    # res is either one search result or an iterable of them for each page
+    pages = [res] if isinstance(res, dict) else res
+    is_filtered = isinstance(hint_referral, str) and bool(hint_referral)
 
-        hit_entries = Entry.objects.filter(pk__in=filtered_ids, is_active=True)
+    count = 0
+    hit_infos: List[Tuple] = []
+    for page in pages:
+        if not is_filtered:
+            count = page["hits"]["total"]
 
-        # reset matched count by filtered results by hint_referral parameter
-        results["ret_count"] = len(hit_entries)
-    else:
-        hit_entries = Entry.objects.filter(id__in=hit_entry_ids, is_active=True)
+        for (entry, entry_info) in _iterate_hit_entries([page], hint_referral):
+            if len(hit_infos) < limit:
+                hit_infos.append((entry, entry_info))
+
+            # reset matched count by filtered results by hint_referral parameter
+            if is_filtered:
+                count += 1
 
-    hit_infos: Dict = {}
-    for entry in hit_entries:
-        if len(hit_infos) >= limit:
+        # all results have to be read to count them when they are filtered by referral
+        if len(hit_infos) >= limit and not is_filtered:
             break
 
-        hit_infos[entry] = [x["_source"] for x in res["hits"]["hits"] if int(x["_id"]) == entry.id][
-            0
+    return (count, hit_infos)
+
+
+def _get_referrals(entry_ids: List[int]) -> Dict[int, List[Dict[str, Any]]]:
+    """This returns entries that refer each of the specified entries at once.
+
+    Each of the result is same with Entry.get_referred_objects() of the entry.
+    """
+    from entry.models import AttributeValue, Entry
+
+    referrer_ids: Dict[int, set] = {}
+    for (referral_id, referrer_id) in AttributeValue.objects.filter(
+        Q(referral__in=entry_ids, is_latest=True)
+        | Q(referral__in=entry_ids, parent_attrv__is_latest=True)
+    ).values_list("referral_id", "parent_attr__parent_entry"):
+        referrer_ids.setdefault(referral_id, set()).add(referrer_id)
+
+    referrers = Entry.objects.filter(
+        id__in=set().union(*referrer_ids.values()), is_active=True
+    ).select_related("schema")
+    referrer_infos = {
+        x.id: {"id": x.id, "name": x.name, "schema": x.schema.name} for x in referrers
+    }
+
+    return {
+        entry_id: [referrer_infos[x] for x in sorted(ids) if x in referrer_infos]
+        for (entry_id, ids) in referrer_ids.items()
+    }
+
+
+def _make_search_result_values(
+    user: User,
+    hit_infos: List[Tuple[Any, Dict[str, Any]]],
+    hint_attrs: List[Dict[str, str]],
+    hint_referral: str,
+) -> List[Dict[str, Any]]:
+    """This returns search results of entries from their documents in Elasticsearch.
+
+    Referrals and permissions of all entries (and their attributes) are resolved at once,
+    so the number of queries doesn't depend on the number of entries.
+    """
+    from entry.models import Entry
+
+    referrals: Dict[int, List[Dict[str, Any]]] = {}
+    if hint_referral is not False:
+        referrals = _get_referrals([entry.id for (entry, _) in hit_infos])
+
+    # Check for has permission to Entry
+    readable_entry_ids = set(
+        [entry.id for (entry, entry_info) in hit_infos if entry_info["is_readble"]]
+    ) | user.get_permitted_ids(
+        [entry for (entry, entry_info) in hit_infos if not entry_info["is_readble"]],
+        ACLType.Readable,
+    )
+
+    hint_attr_names = set([x["name"] for x in hint_attrs])
+    readable_hint_attr_names = set([x["name"] for x in hint_attrs if x["is_readble"]])
+
+    # get Attributes whose permission have to be checked
+    attr_keys = set(
+        [
+            (entry.id, attrinfo["name"])
+            for (entry, entry_info) in hit_infos
+            if entry.id in readable_entry_ids
+            for attrinfo in entry_info["attr"]
+            if attrinfo["name"] in readable_hint_attr_names and not attrinfo["is_readble"]
         ]
+    )
+    attrs: Dict[Tuple[int, str], Any] = {}
+    if attr_keys:
+        for entry_attr in (
+            Entry.attrs.through.objects.filter(
+                entry_id__in=set([x for (x, _) in attr_keys]),
+                attribute__schema__name__in=set([x for (_, x) in attr_keys]),
+                attribute__is_active=True,
+            )
+            .select_related("attribute__schema")
+            .order_by("attribute_id")
+        ):
+            attrs.setdefault(
+                (entry_attr.entry_id, entry_attr.attribute.schema.name), entry_attr.attribute
+            )
+    readable_attr_ids = user.get_permitted_ids(attrs.values(), ACLType.Readable)
 
-    for (entry, entry_info) in sorted(hit_infos.items(), key=lambda x: x[0].name):
+    results = []
+    for (entry, entry_info) in hit_infos:
         ret_info: Dict[str, Any] = {
             "entity": {"id": entry.schema.id, "name": entry.schema.name},
             "entry": {"id": entry.id, "name": entry.name},
@@ -816,27 +1333,20 @@ def make_search_results(
 
         # When 'hint_referral' parameter is specifed, return referred entries for each results
         if hint_referral is not False:
-            ret_info["referrals"] = [
-                {
-                    "id": x.id,
-                    "name": x.name,
-                    "schema": x.schema.name,
-                }
-                for x in entry.get_referred_objects()
-            ]
+            ret_info["referrals"] = referrals.get(entry.id, [])
 
         # Check for has permission to Entry
-        if entry_info["is_readble"] or user.has_permission(entry, ACLType.Readable):
+        if entry.id in readable_entry_ids:
             ret_info["is_readble"] = True
         else:
             ret_info["is_readble"] = False
-            results["ret_values"].append(ret_info)
+            results.append(ret_info)
             continue
 
         # formalize attribute values according to the type
         for attrinfo in entry_info["attr"]:
             # Skip other than the target Attribute
-            if attrinfo["name"] not in [x["name"] for x in hint_attrs]:
+            if attrinfo["name"] not in hint_attr_names:
                 continue
 
             if attrinfo["name"] in ret_info["attrs"]:
@@ -852,13 +1362,13 @@ def make_search_results(
                     ret_info["attrs"][attrinfo["name"]] = ret_attrinfo
 
             # Check for has permission to EntityAttr
-            if attrinfo["name"] not in [x["name"] for x in hint_attrs if x["is_readble"]]:
+            if attrinfo["name"] not in readable_hint_attr_names:
                 ret_attrinfo["is_readble"] = False
                 continue
 
             # Check for has permission to Attribute
             if not attrinfo["is_readble"]:
-                attr = entry.attrs.filter(schema__name=attrinfo["name"], is_active=True).first()
+                attr = attrs.get((entry.id, attrinfo["name"]))
                 if not attr:
                     Logger.warning(
                         "Non exist Attribute (entry:%s, name:%s) is registered in ESS."
@@ -866,7 +1376,7 @@ def make_search_results(
                     )
                     continue
 
-                if not user.has_permission(attr, ACLType.Readable):
+                if attr.id not in readable_attr_ids:
                     ret_attrinfo["is_readble"] = False
                     continue
 
@@ -939,7 +1449,7 @@ def make_search_results(
                         {"id": attrinfo["referral_id"], "name": attrinfo["value"]}
                     )
 
-        results["ret_values"].append(ret_info)
+        results.append(ret_info)
 
     return results
 
@@ -5,7 +5,7 @@ import urllib.parse
 from urllib.parse import quote
 
 from django.conf import settings
-from django.http import HttpResponse, HttpResponseRedirect
+from django.http import HttpResponse, HttpResponseRedirect, StreamingHttpResponse
 from django.shortcuts import render as django_render
 from django.utils.encoding import smart_str
 
@@ -208,6 +208,14 @@ def get_download_response(io_stream, fname):
     return response
 
 
+def get_streaming_download_response(iterator, fname):
+    response = StreamingHttpResponse(iterator, content_type="application/force-download")
+    response["Content-Disposition"] = 'attachment; filename="{fn}"'.format(
+        fn=urllib.parse.quote(smart_str(fname))
+    )
+    return response
+
+
 def _is_valid(params, meta_info):
     if not isinstance(params, dict):
         return False
@@ -3,7 +3,9 @@ import os
 import sys
 
 from django.conf import settings
+from django.db import connection
 from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 
 from airone.lib.types import AttrTypeValue
 from entity.models import Entity, EntityAttr
@@ -113,6 +115,32 @@ class AironeTestCase(TestCase):
 
         return entry
 
+    def assertConstantQueries(self, prepare, params):
+        """This checks the number of queries doesn't depend on the size of data.
+
+        The prepare is called with each of params to make data, and returns a callable
+        that processes it. Only queries that the callable sends are counted, and they
+        must be the same for all params.
+
+        Returns:
+            list: results of the callables in the order of params
+        """
+        results = []
+        num_queries = []
+        for param in params:
+            process = prepare(param)
+            with CaptureQueriesContext(connection) as ctx:
+                results.append(process())
+            num_queries.append(len(ctx.captured_queries))
+
+        self.assertEqual(
+            len(set(num_queries)),
+            1,
+            "Number of queries depends on the parameter: %s" % list(zip(params, num_queries)),
+        )
+
+        return results
+
 
 class AironeViewTest(AironeTestCase):
     def setUp(self):
@@ -244,6 +244,8 @@ class Common(Configuration):
         "INDEX": "airone",
         "MAXIMUM_RESULTS_NUM": 500000,
         "TIMEOUT": None,
+        # This is the number of connections to keep alive for each node in a process
+        "MAXSIZE": 10,
     }
 
     #
@@ -1,4 +1,9 @@
+import json
+from unittest import mock
+
+from django.conf import settings
 from django.test import TestCase
+from elasticsearch.client import IndicesClient
 
 from airone.lib import elasticsearch
 from airone.lib.types import AttrTypeStr
@@ -449,3 +454,50 @@ class ElasticSearchTest(TestCase):
                 }
             ],
         )
+
+    def test_share_connection_pool(self):
+        es1 = elasticsearch.ESS()
+        es2 = elasticsearch.ESS(index="another-index")
+
+        # checks connection pool is shared among ESS instances in the same process
+        self.assertIs(es1.transport, es2.transport)
+        self.assertNotEqual(es1._index, es2._index)
+
+        # checks different connection parameters makes another connection pool
+        es3 = elasticsearch.ESS(timeout=1)
+        self.assertIsNot(es1.transport, es3.transport)
+
+    def test_index_body_has_max_result_window(self):
+        body = json.loads(elasticsearch.ESS()._get_index_body())
+        self.assertEqual(
+            body["settings"]["index"]["max_result_window"],
+            settings.ES_CONFIG["MAXIMUM_RESULTS_NUM"],
+        )
+
+    @mock.patch("airone.lib.elasticsearch.Elasticsearch.search")
+    def test_expand_max_result_window_once(self, mock_search):
+        mock_search.return_value = {"hits": {"total": 0, "hits": []}}
+        index = "test-expand-max-result-window"
+
+        es = elasticsearch.ESS(index=index)
+        with mock.patch.object(
+            IndicesClient, "put_settings", return_value={"error": "index_not_found_exception"}
+        ) as mock_put_settings:
+            # checks settings is retried while the index doesn't exist
+            es.search(body={})
+            es.search(body={})
+            self.assertEqual(mock_put_settings.call_count, 2)
+
+        with mock.patch.object(
+            IndicesClient, "put_settings", return_value={"acknowledged": True}
+        ) as mock_put_settings:
+            # checks settings is put only once among ESS instances in the same process
+            for _ in range(2):
+                elasticsearch.ESS(index=index).search(body={})
+
+            mock_put_settings.assert_called_once_with(
+                index=index,
+                body={"index": {"max_result_window": settings.ES_CONFIG["MAXIMUM_RESULTS_NUM"]}},
+                ignore=[404],
+            )
+            self.assertEqual(mock_search.call_count, 4)
@@ -9,7 +9,7 @@ from rest_framework.views import APIView
 
 from airone.lib.acl import ACLType
 from entity.models import Entity
-from entry.models import Entry
+from entry.models import ArchivedAttributeValue, Entry
 from entry.settings import CONFIG as CONFIG_ENTRY
 
 
@@ -213,9 +213,27 @@ class UpdateHistory(APIView):
                 "entry": {"id": entry.id, "name": entry.name},
                 "attribute": {"id": attr.id, "name": attr.schema.name, "history": []},
             }
-            for attrv in attr.values.filter(
-                created_time__gt=newer_than, created_time__lt=older_than
-            ).order_by("-created_time")[: CONFIG_ENTRY.MAX_HISTORY_COUNT]:
+            # This also reads the values that have been moved to the archive tier
+            # (c.f. ArchivedAttributeValue.archive), and merges them by created_time.
+            attrvs = sorted(
+                [
+                    attrv
+                    for queryset in [
+                        attr.values.all(),
+                        ArchivedAttributeValue.objects.filter(
+                            parent_attr=attr, parent_attrv__isnull=True
+                        ),
+                    ]
+                    for attrv in queryset.filter(
+                        created_time__gt=newer_than, created_time__lt=older_than
+                    )
+                    .select_related("created_user")
+                    .order_by("-created_time")[: CONFIG_ENTRY.MAX_HISTORY_COUNT]
+                ],
+                key=lambda x: x.created_time,
+                reverse=True,
+            )
+            for attrv in attrvs[: CONFIG_ENTRY.MAX_HISTORY_COUNT]:
                 result["attribute"]["history"].append(
                     {
                         "value": attrv.get_value(with_metainfo=True)["value"],
@@ -6,7 +6,7 @@ from django.conf import settings
 from airone.lib.test import AironeViewTest
 from airone.lib.types import AttrTypeValue
 from entity.models import Entity, EntityAttr
-from entry.models import Entry
+from entry.models import ArchivedAttributeValue, Entry
 from entry.settings import CONFIG as CONFIG_ENTRY
 from group.models import Group
 
@@ -145,6 +145,34 @@ class APITest(AironeViewTest):
             )
             self.assertEqual(retdata, resp_alter.json())
 
+    def test_with_archived_values(self):
+        entry = Entry.objects.create(name="entry", schema=self.entity, created_user=self.user)
+        entry.complement_attrs(self.user)
+
+        for name in ["str", "arr_str"]:
+            attr = entry.attrs.get(schema__name=name)
+            for value in self.test_attrs[name]["set_values"]:
+                attr.add_value(self.user, value)
+
+        # move all superseded values to the archive tier
+        ArchivedAttributeValue.archive(
+            datetime.now(pytz.timezone(settings.TIME_ZONE)) + timedelta(seconds=1)
+        )
+        for name in ["str", "arr_str"]:
+            attr = entry.attrs.get(schema__name=name)
+            self.assertEqual(attr.values.count(), 1)
+            self.assertTrue(attr.archived_values.exists())
+
+        for name in ["str", "arr_str"]:
+            resp = self.client.get(
+                "/api/v1/entry/update_history", {"attribute": name, "entry": entry.name}
+            )
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(
+                [x["value"] for x in resp.json()[0]["attribute"]["history"]],
+                self.test_attrs[name]["ret_values"],
+            )
+
     def test_without_set_value(self):
         # create test entry and set each values
         entry = Entry.objects.create(name="entry", schema=self.entity, created_user=self.user)
@@ -1,9 +1,7 @@
 import csv
-import io
 import json
 
 import yaml
-from django.conf import settings
 from natsort import natsorted
 
 from airone.celery import app
@@ -12,8 +10,7 @@ from entry.models import Entry
 from job.models import Job
 
 
-def _csv_export(job, values, recv_data, has_referral):
-    output = io.StringIO(newline="")
+def _csv_export(job, output, values, recv_data, has_referral):
     writer = csv.writer(output)
 
     # write first line of CSV
@@ -99,9 +96,7 @@ def _csv_export(job, values, recv_data, has_referral):
     return output
 
 
-def _yaml_export(job, values, recv_data, has_referral):
-    output = io.StringIO()
-
+def _yaml_export(job, output, values, recv_data, has_referral):
     def _get_attr_value(atype, value):
         if atype & AttrTypeValue["array"]:
             return [_get_attr_value(atype ^ AttrTypeValue["array"], x) for x in value]
@@ -153,7 +148,7 @@ def _yaml_export(job, values, recv_data, has_referral):
         else:
             resp_data[entry_info["entity"]["name"]] = [data]
 
-    output.write(yaml.dump(resp_data, default_flow_style=False, allow_unicode=True))
+    yaml.dump(resp_data, output, default_flow_style=False, allow_unicode=True)
 
     return output
 
@@ -179,24 +174,27 @@ def export_search_result(self, job_id):
     if referral_name:
         hint_referral = referral_name
 
-    resp = Entry.search_entries(
+    # search results are read page by page while they are exported
+    values = Entry.iterate_search_entries(
         user,
         recv_data["entities"],
         recv_data["attrinfo"],
-        settings.ES_CONFIG["MAXIMUM_RESULTS_NUM"],
         entry_name,
         hint_referral,
     )
 
-    io_stream = None
+    export_method = None
     if recv_data["export_style"] == "yaml":
-        io_stream = _yaml_export(job, resp["ret_values"], recv_data, has_referral)
+        export_method = _yaml_export
 
     elif recv_data["export_style"] == "csv":
-        io_stream = _csv_export(job, resp["ret_values"], recv_data, has_referral)
+        export_method = _csv_export
 
-    if io_stream:
-        job.set_cache(io_stream.getvalue())
+    # The result is written to the job cache incrementally, and it's discarded
+    # when this job is canceled during exporting.
+    if export_method:
+        with job.open_cache() as output:
+            export_method(job, output, values, recv_data, has_referral)
 
     # update job status and save it except for the case that target job is canceled.
     if not job.is_canceled():
@@ -1,6 +1,6 @@
 from django.http.response import JsonResponse
 
-from airone.lib.acl import ACLType
+from airone.lib.acl import ACLType, filter_permitted
 from airone.lib.http import http_get
 from entity.models import Entity
 
@@ -16,8 +16,9 @@ def get_entities(request):
                     "status": x.status,
                     "note": x.note,
                 }
-                for x in Entity.objects.filter(is_active=True)
-                if request.user.has_permission(x, ACLType.Readable)
+                for x in filter_permitted(
+                    request.user, Entity.objects.filter(is_active=True), ACLType.Readable
+                )
             ]
         }
     )
@@ -9,7 +9,7 @@ from rest_framework import serializers
 from rest_framework.exceptions import PermissionDenied, ValidationError
 
 import custom_view
-from airone.lib.acl import ACLType
+from airone.lib.acl import ACLType, filter_permitted
 from airone.lib.types import AttrTypeValue
 from entity.models import Entity, EntityAttr
 from user.models import History, User
@@ -431,8 +431,9 @@ class EntityDetailSerializer(EntityListSerializer):
                     for r in x.referral.all()
                 ],
             }
-            for x in obj.attrs.filter(is_active=True).order_by("index")
-            if user.has_permission(x, ACLType.Writable)
+            for x in filter_permitted(
+                user, obj.attrs.filter(is_active=True), ACLType.Writable
+            ).order_by("index")
         ]
 
         # add and remove attributes depending on entity
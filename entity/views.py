@@ -9,7 +9,7 @@ from django.http import HttpResponse
 from django.http.response import JsonResponse
 
 import custom_view
-from airone.lib.acl import ACLType, get_permitted_objects
+from airone.lib.acl import ACLType, filter_permitted, get_permitted_objects
 from airone.lib.http import (
     get_download_response,
     get_obj_with_check_perm,
@@ -65,11 +65,9 @@ def index(request):
 @http_get
 def create(request):
     context = {
-        "entities": [
-            x
-            for x in Entity.objects.filter(is_active=True)
-            if request.user.has_permission(x, ACLType.Readable)
-        ],
+        "entities": filter_permitted(
+            request.user, Entity.objects.filter(is_active=True), ACLType.Readable
+        ),
         "attr_types": AttrTypes,
     }
     return render(request, "create_entity.html", context)
@@ -98,8 +96,9 @@ def edit(request, entity_id):
                 "is_delete_in_chain": x.is_delete_in_chain,
                 "referrals": x.referral.all(),
             }
-            for x in entity.attrs.filter(is_active=True).order_by("index")
-            if request.user.has_permission(x, ACLType.Writable)
+            for x in filter_permitted(
+                request.user, entity.attrs.filter(is_active=True), ACLType.Writable
+            ).order_by("index")
         ],
     }
     return render(request, "edit_entity.html", context)
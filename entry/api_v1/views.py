@@ -9,7 +9,7 @@ from natsort import natsorted
 from pytz import timezone
 
 from acl.models import ACLBase
-from airone.lib.acl import ACLType
+from airone.lib.acl import ACLType, filter_permitted
 from airone.lib.elasticsearch import prepend_escape_character
 from airone.lib.http import http_get, http_post
 from airone.lib.types import AttrTypeValue
@@ -243,7 +243,7 @@ def get_attr_referrals(request, attr_id):
 
 @http_get
 def get_entry_history(request, entry_id):
-    params = {"index": None, "count": None}
+    params = {"index": None, "count": None, "before": None}
 
     for key in params.keys():
         try:
@@ -268,7 +268,12 @@ def get_entry_history(request, entry_id):
 
         raise TypeError("Type %s not serializable" % type(obj))
 
-    history = entry.get_value_history(request.user, count=params["count"], index=params["index"])
+    history = entry.get_value_history(
+        request.user,
+        count=params["count"],
+        index=params["index"],
+        before_attrv_id=params["before"],
+    )
 
     return JsonResponse(
         {
@@ -299,8 +304,11 @@ def get_entry_info(request, entry_id):
                         {"id": x.id, "name": x.schema.name, "index": x.schema.index},
                         **x.get_latest_value().get_value(with_metainfo=True, is_active=False)
                     )
-                    for x in entry.attrs.all()
-                    if request.user.has_permission(x, ACLType.Readable) and x.schema.is_active
+                    for x in filter_permitted(
+                        request.user,
+                        entry.attrs.filter(schema__is_active=True).select_related("schema"),
+                        ACLType.Readable,
+                    )
                 ],
                 key=lambda x: x["index"],
             ),
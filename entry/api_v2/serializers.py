@@ -315,8 +315,20 @@ class EntryRetrieveSerializer(EntryBaseSerializer):
         read_only_fields = ["is_active"]
 
     def get_attrs(self, obj: Entry) -> List[EntryAttributeType]:
+        def get_latest_attrv(attr: Attribute) -> Optional[AttributeValue]:
+            # This picks up the latest value from the prefetched ones, and falls back to
+            # get_latest_value() only when the Attribute has no latest value.
+            if not attr.attrv_list:
+                return attr.get_latest_value(is_readonly=True)
+
+            attrv = next(
+                (x for x in attr.attrv_list if x.id == attr.latest_value_id),
+                attr.attrv_list[-1],
+            )
+            return attrv if attrv.data_type == attr.schema.type else None
+
         def get_attr_value(attr: Attribute) -> EntryAttributeValue:
-            attrv = attr.get_latest_value(is_readonly=True)
+            attrv = get_latest_attrv(attr)
 
             if not attrv:
                 return {}
@@ -374,7 +386,11 @@ class EntryRetrieveSerializer(EntryBaseSerializer):
                     }
 
                 elif attr.schema.type & AttrTypeValue["group"]:
-                    groups = [Group.objects.get(id=x.value) for x in attrv.data_array.all()]
+                    groups = [
+                        models_by_id[Group][int(x.value)]
+                        for x in attrv.data_array.all()
+                        if int(x.value) in models_by_id[Group]
+                    ]
                     return {
                         "as_array_group": [
                             {
@@ -386,7 +402,11 @@ class EntryRetrieveSerializer(EntryBaseSerializer):
                     }
 
                 elif attr.schema.type & AttrTypeValue["role"]:
-                    roles = [Role.objects.get(id=x.value) for x in attrv.data_array.all()]
+                    roles = [
+                        models_by_id[Role][int(x.value)]
+                        for x in attrv.data_array.all()
+                        if int(x.value) in models_by_id[Role]
+                    ]
                     return {
                         "as_array_role": [
                             {
@@ -438,8 +458,12 @@ class EntryRetrieveSerializer(EntryBaseSerializer):
             elif attr.schema.type & AttrTypeValue["date"]:
                 return {"as_string": attrv.date if attrv.date else ""}
 
-            elif attr.schema.type & AttrTypeValue["group"] and attrv.value:
-                group = Group.objects.get(id=attrv.value)
+            elif (
+                attr.schema.type & AttrTypeValue["group"]
+                and attrv.value
+                and int(attrv.value) in models_by_id[Group]
+            ):
+                group = models_by_id[Group][int(attrv.value)]
                 return {
                     "as_group": {
                         "id": group.id,
@@ -447,8 +471,12 @@ class EntryRetrieveSerializer(EntryBaseSerializer):
                     }
                 }
 
-            elif attr.schema.type & AttrTypeValue["role"] and attrv.value:
-                role = Role.objects.get(id=attrv.value)
+            elif (
+                attr.schema.type & AttrTypeValue["role"]
+                and attrv.value
+                and int(attrv.value) in models_by_id[Role]
+            ):
+                role = models_by_id[Role][int(attrv.value)]
                 return {
                     "as_role": {
                         "id": role.id,
@@ -500,17 +528,59 @@ class EntryRetrieveSerializer(EntryBaseSerializer):
 
             raise ValidationError(f"unexpected type: {type}")
 
+        # This loads all latest values, their array children and referral entries with
+        # their schemas at once, so the number of queries doesn't depend on the number
+        # of attributes and the length of array values.
+        attrv_prefetch = Prefetch(
+            "values",
+            queryset=AttributeValue.objects.filter(is_latest=True)
+            .select_related("referral__entry__schema")
+            .prefetch_related(
+                Prefetch(
+                    "data_array",
+                    queryset=AttributeValue.objects.select_related("referral__entry__schema"),
+                )
+            )
+            .order_by("id"),
+            to_attr="attrv_list",
+        )
         attr_prefetch = Prefetch(
             "attribute_set",
-            queryset=Attribute.objects.filter(parent_entry=obj),
+            queryset=Attribute.objects.filter(parent_entry=obj).prefetch_related(attrv_prefetch),
             to_attr="attr_list",
         )
-        entity_attrs = (
+        entity_attrs = list(
             obj.schema.attrs.filter(is_active=True)
             .prefetch_related(attr_prefetch)
             .order_by("index")
         )
 
+        # This loads all groups and roles that are referred from the latest values at once
+        model_ids: Dict[Any, set] = {Group: set(), Role: set()}
+        for entity_attr in entity_attrs:
+            model = (
+                Group
+                if entity_attr.type & AttrTypeValue["group"]
+                else Role
+                if entity_attr.type & AttrTypeValue["role"]
+                else None
+            )
+            if not model:
+                continue
+
+            for attr in entity_attr.attr_list[:1]:
+                for attrv in attr.attrv_list:
+                    values = (
+                        [x.value for x in attrv.data_array.all()]
+                        if entity_attr.type & AttrTypeValue["array"]
+                        else [attrv.value]
+                    )
+                    model_ids[model] |= set([int(x) for x in values if x and x.isdigit()])
+
+        models_by_id = {
+            model: model.objects.in_bulk(ids) if ids else {} for (model, ids) in model_ids.items()
+        }
+
         attrinfo: List[EntryAttributeType] = []
         for entity_attr in entity_attrs:
             attr = entity_attr.attr_list[0] if entity_attr.attr_list else None
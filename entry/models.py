@@ -1,3 +1,5 @@
+import heapq
+import itertools
 import re
 from collections.abc import Iterable
 from datetime import date, datetime
@@ -5,19 +7,22 @@ from typing import Any, Optional, Tuple
 
 from django.conf import settings
 from django.core.cache import cache
-from django.db import models
-from django.db.models import Prefetch, Q
+from django.db import models, transaction
+from django.db.models import Max, OuterRef, Prefetch, Q, Subquery
 
 from acl.models import ACLBase
 from airone.lib import auto_complement
-from airone.lib.acl import ACLObjType, ACLType
+from airone.lib.acl import ACLObjType, ACLType, filter_permitted
 from airone.lib.elasticsearch import (
     ESS,
+    execute_queries_in_pages,
     execute_query,
+    execute_query_in_range,
     is_date_check,
+    iterate_search_results,
     make_query,
     make_query_for_simple,
-    make_search_results,
+    make_search_results_for_entities,
     make_search_results_for_simple,
 )
 from airone.lib.types import (
@@ -80,6 +85,15 @@ class AttributeValue(models.Model):
         "AttributeValue", null=True, related_name="child", on_delete=models.SET_NULL
     )
 
+    class Meta:
+        # These are designed for the conditions that are frequently used to get latest values
+        # of Attributes, referrals of Entries and children of array values.
+        indexes = [
+            models.Index(fields=["parent_attr", "is_latest"], name="attrv_parent_attr_latest"),
+            models.Index(fields=["referral", "is_latest"], name="attrv_referral_latest"),
+            models.Index(fields=["parent_attrv", "is_latest"], name="attrv_parent_attrv_latest"),
+        ]
+
     @classmethod
     def get_default_value(kls, attr):
         """
@@ -118,6 +132,26 @@ class AttributeValue(models.Model):
 
         return cloned_value
 
+    def _build_clone(self, user, **extra_params):
+        # This makes an unsaved copy of this value as clone() does, to create them in bulk
+        cloned_value = AttributeValue(
+            **{
+                x.attname: getattr(self, x.attname)
+                for x in AttributeValue._meta.concrete_fields
+                if not x.primary_key
+            }
+        )
+
+        # set extra configure
+        for (k, v) in extra_params.items():
+            setattr(cloned_value, k, v)
+
+        # update basic parameters to new one
+        cloned_value.created_user = user
+        cloned_value.created_time = datetime.now()
+
+        return cloned_value
+
     def get_value(self, with_metainfo=False, serialize=False, is_active=True):
         """
         This returns registered value according to the type of Attribute
@@ -422,6 +456,121 @@ class AttributeValue(models.Model):
 
         return (True, None)
 
+    @classmethod
+    def get_with_archived(kls, attrv_id):
+        """This returns AttributeValue, or ArchivedAttributeValue when it has been archived"""
+        return (
+            kls.objects.filter(id=attrv_id).first()
+            or ArchivedAttributeValue.objects.filter(id=attrv_id).first()
+        )
+
+
+class ArchivedAttributeValue(models.Model):
+    """This is an archive tier of superseded AttributeValues.
+
+    AttributeValues that are no longer latest and older than a certain age are moved here
+    with their child values of data_array (c.f. ArchivedAttributeValue.archive). These keep
+    the original IDs, and have the same interface with AttributeValue to read their values.
+    So histories and reverting are able to handle them as AttributeValue.
+    """
+
+    id = models.IntegerField(primary_key=True)
+    value = models.TextField()
+    referral = models.ForeignKey(
+        ACLBase,
+        null=True,
+        related_name="referred_archived_attr_value",
+        on_delete=models.SET_NULL,
+    )
+    created_time = models.DateTimeField()
+    created_user = models.ForeignKey(User, on_delete=models.DO_NOTHING, related_name="+")
+    parent_attr = models.ForeignKey(
+        "Attribute", on_delete=models.DO_NOTHING, related_name="archived_values"
+    )
+    status = models.IntegerField(default=0)
+    boolean = models.BooleanField(default=False)
+    date = models.DateField(null=True)
+    data_type = models.IntegerField(default=0)
+    parent_attrv = models.ForeignKey(
+        "ArchivedAttributeValue", null=True, related_name="child", on_delete=models.CASCADE
+    )
+    archived_time = models.DateTimeField(auto_now_add=True)
+
+    # Archived values are never latest ones
+    is_latest = False
+
+    # These are shared with AttributeValue because they only refer common fields
+    get_status = AttributeValue.get_status
+    get_value = AttributeValue.get_value
+    format_for_history = AttributeValue.format_for_history
+
+    # This corresponds to AttributeValue.data_array
+    @property
+    def data_array(self):
+        return self.child
+
+    @classmethod
+    def archive(kls, expired_time, chunk_size=1000):
+        """This moves superseded AttributeValues created before expired_time to this table.
+
+        Returns:
+            int: the number of archived AttributeValues except for child ones
+        """
+        fields = [
+            "value",
+            "referral_id",
+            "created_time",
+            "created_user_id",
+            "parent_attr_id",
+            "status",
+            "boolean",
+            "date",
+            "data_type",
+        ]
+        count = 0
+        while True:
+            with transaction.atomic():
+                # This excludes the values that are children of others, because they are
+                # archived with their parent ones.
+                parent_ids = list(
+                    AttributeValue.objects.filter(
+                        is_latest=False,
+                        parent_attrv__isnull=True,
+                        attributevalue__isnull=True,
+                        latest_of__isnull=True,
+                        created_time__lt=expired_time,
+                    ).values_list("id", flat=True)[:chunk_size]
+                )
+                if not parent_ids:
+                    return count
+
+                # This maps each child value to its parent. Children might not have
+                # parent_attrv when they were created by an old version.
+                parent_map = dict(
+                    AttributeValue.data_array.through.objects.filter(
+                        from_attributevalue__in=parent_ids
+                    ).values_list("to_attributevalue", "from_attributevalue")
+                )
+                parent_map.update(
+                    AttributeValue.objects.filter(parent_attrv__in=parent_ids).values_list(
+                        "id", "parent_attrv"
+                    )
+                )
+
+                # Parent values have to be created before children that refer them
+                for target_ids in [parent_ids, list(parent_map.keys())]:
+                    kls.objects.bulk_create(
+                        [
+                            kls(parent_attrv_id=parent_map.get(x["id"]), **x)
+                            for x in AttributeValue.objects.filter(id__in=target_ids).values(
+                                "id", *fields
+                            )
+                        ]
+                    )
+
+                AttributeValue.objects.filter(id__in=parent_ids + list(parent_map.keys())).delete()
+                count += len(parent_ids)
+
 
 class Attribute(ACLBase):
     values = models.ManyToManyField(AttributeValue)
@@ -430,6 +579,18 @@ class Attribute(ACLBase):
     schema = models.ForeignKey(EntityAttr, on_delete=models.DO_NOTHING)
     parent_entry = models.ForeignKey("Entry", on_delete=models.DO_NOTHING)
 
+    # This points the AttributeValue whose is_latest flag is set to get it by a join without
+    # scanning values. This is None for Attributes that have no value or haven't been updated
+    # since this was introduced (c.f. Attribute.update_latest_value_pointers).
+    latest_value = models.ForeignKey(
+        AttributeValue, null=True, related_name="latest_of", on_delete=models.SET_NULL
+    )
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["parent_entry", "schema"], name="attr_parent_entry_schema"),
+        ]
+
     def __init__(self, *args, **kwargs):
         super(Attribute, self).__init__(*args, **kwargs)
         self.objtype = ACLObjType.EntryAttr
@@ -651,10 +812,16 @@ class Attribute(ACLBase):
 
             attrv = AttributeValue.objects.create(**params)
             self.values.add(attrv)
+            self.unset_latest_flag(exclude_id=attrv.id)
 
             return attrv
 
-        attrv = self.values.filter(is_latest=True).last()
+        # This refers the latest_value pointer from database instead of this instance, because
+        # it might be updated through another instance of this Attribute.
+        attrv = AttributeValue.objects.filter(latest_of=self).first()
+        if not attrv:
+            attrv = self.values.filter(is_latest=True).last()
+
         if attrv:
             # When a type of attribute value is clear, a new Attribute value will be created
             if attrv.data_type != self.schema.type:
@@ -700,49 +867,146 @@ class Attribute(ACLBase):
                 }
             )
             self.values.add(attrv)
+            self._set_latest_value(attrv.id)
 
         return attrv
 
     # NOTE: Type-Write
     def clone(self, user, **extra_params):
-        if not user.has_permission(self, ACLType.Readable) or not user.has_permission(
-            self.schema, ACLType.Readable
-        ):
-            return None
+        cloned_attrs = Attribute.clone_in_bulk(user, [self], **extra_params)
 
-        # We can't clone an instance by the way (.pk=None and save) like AttributeValue,
-        # since the subclass instance refers to the parent_link's primary key during save.
-        params = {
-            "name": self.name,
-            "created_user": user,
-            "schema": self.schema,
-            "parent_entry": self.parent_entry,
-        }
-        params.update(extra_params)
-        cloned_attr = Attribute.objects.create(**params)
+        return cloned_attrs[0] if cloned_attrs else None
 
-        attrv = self.get_latest_value()
-        if attrv:
-            new_attrv = attrv.clone(user, parent_attr=cloned_attr)
+    @classmethod
+    def clone_in_bulk(kls, user, attrs, **extra_params):
+        """This clones Attributes with their latest values, and returns the cloned ones.
+
+        Attributes that user doesn't have permission to read are skipped. Permissions are
+        checked at once, and the values, array children and relations between them are
+        created in bulk in one transaction. Only Attributes themselves are created one by one,
+        because bulk_create() doesn't support multi-table inherited models.
+        """
+        attrs = list(attrs)
+        permitted_ids = user.get_permitted_ids(attrs, ACLType.Readable)
+        attrs = [x for x in attrs if x.id in permitted_ids]
+
+        latest_values = AttributeValue.objects.in_bulk(
+            [x.latest_value_id for x in attrs if x.latest_value_id]
+        )
+
+        with transaction.atomic():
+            cloned_pairs = []
+            for attr in attrs:
+                # We can't clone an instance by the way (.pk=None and save) like AttributeValue,
+                # since the subclass instance refers to the parent_link's primary key during save.
+                params = {
+                    "name": attr.name,
+                    "created_user": user,
+                    "schema": attr.schema,
+                }
+                if "parent_entry" not in extra_params:
+                    params["parent_entry"] = attr.parent_entry
+                params.update(extra_params)
+                cloned_attr = Attribute.objects.create(**params)
+
+                attrv = latest_values.get(attr.latest_value_id)
+                if not attrv or attrv.data_type != attr.schema.type:
+                    # This is for the Attribute which doesn't have valid latest_value pointer
+                    attrv = attr.get_latest_value()
+
+                cloned_pairs.append((attr, cloned_attr, attrv))
+
+            # bulk_create() doesn't set IDs of created values on MySQL, so they are read again
+            # by the parent_attr that refers to just created Attribute.
+            AttributeValue.objects.bulk_create(
+                [
+                    attrv._build_clone(user, parent_attr=cloned_attr)
+                    for (_, cloned_attr, attrv) in cloned_pairs
+                    if attrv
+                ]
+            )
+            new_values = {
+                x.parent_attr_id: x
+                for x in AttributeValue.objects.filter(
+                    parent_attr__in=[x.id for (_, x, _) in cloned_pairs]
+                )
+            }
 
             # When the Attribute is array, this method also clone co-AttributeValues
-            if self.schema.type & AttrTypeValue["array"]:
-                for co_attrv in attrv.data_array.all():
-                    new_co_attrv = co_attrv.clone(
-                        user, parent_attr=cloned_attr, parent_attrv=new_attrv
+            new_parents = {
+                attrv.id: new_values[cloned_attr.id]
+                for (attr, cloned_attr, attrv) in cloned_pairs
+                if attrv and attr.schema.type & AttrTypeValue["array"]
+            }
+            AttributeValue.objects.bulk_create(
+                [
+                    x.to_attributevalue._build_clone(
+                        user,
+                        parent_attr_id=new_parents[x.from_attributevalue_id].parent_attr_id,
+                        parent_attrv=new_parents[x.from_attributevalue_id],
+                    )
+                    for x in AttributeValue.data_array.through.objects.filter(
+                        from_attributevalue__in=new_parents.keys()
+                    )
+                    .select_related("to_attributevalue")
+                    .order_by("id")
+                ]
+            )
+
+            Attribute.values.through.objects.bulk_create(
+                [
+                    Attribute.values.through(attribute_id=x.parent_attr_id, attributevalue_id=x.id)
+                    for x in new_values.values()
+                ]
+            )
+            AttributeValue.data_array.through.objects.bulk_create(
+                [
+                    AttributeValue.data_array.through(
+                        from_attributevalue_id=x.parent_attrv_id, to_attributevalue_id=x.id
                     )
-                    new_attrv.data_array.add(new_co_attrv)
+                    for x in AttributeValue.objects.filter(
+                        parent_attrv__in=[x.id for x in new_parents.values()]
+                    ).order_by("id")
+                ]
+            )
+
+            cloned_attrs = [x for (_, x, _) in cloned_pairs]
+            for cloned_attr in cloned_attrs:
+                if cloned_attr.id in new_values:
+                    cloned_attr.latest_value_id = new_values[cloned_attr.id].id
+            Attribute.objects.bulk_update(cloned_attrs, ["latest_value"])
 
-            cloned_attr.values.add(new_attrv)
+        return cloned_attrs
 
-        return cloned_attr
+    def _set_latest_value(self, attrv_id):
+        self.latest_value_id = attrv_id
+        Attribute.objects.filter(id=self.id).update(latest_value=attrv_id)
 
     def unset_latest_flag(self, exclude_id=None):
+        """This clears is_latest flag of values except for exclude_id, and points it as the latest.
+
+        This clears all values that have is_latest flag instead of the one latest_value points,
+        so that a value left by concurrent updates is also repaired. It's cheap because of the
+        index of (parent_attr, is_latest).
+        """
         exclude = Q()
         if exclude_id:
             exclude = Q(id=exclude_id)
         self.values.filter(is_latest=True).exclude(exclude).update(is_latest=False)
 
+        self._set_latest_value(exclude_id)
+
+    @classmethod
+    def update_latest_value_pointers(kls):
+        """This sets latest_value of Attributes that don't have it from is_latest flag"""
+        kls.objects.filter(latest_value__isnull=True).update(
+            latest_value=Subquery(
+                AttributeValue.objects.filter(attribute=OuterRef("pk"), is_latest=True)
+                .order_by("-id")
+                .values("id")[:1]
+            )
+        )
+
     def _validate_value(self, value):
         def _is_group_object(val, model):
             return isinstance(val, model) or isinstance(val, int) or isinstance(val, str) or not val
@@ -1382,6 +1646,7 @@ class Entry(ACLBase):
                 attr_value.set_status(AttributeValue.STATUS_DATA_ARRAY_PARENT)
 
                 newattr.values.add(attr_value)
+                newattr._set_latest_value(attr_value.id)
 
             # When multiple requests to add new Attribute came here, multiple Attriutes
             # might be existed. If there were, this would delete new one.
@@ -1389,6 +1654,12 @@ class Entry(ACLBase):
 
     # NOTE: Type-Read
     def get_available_attrs(self, user, permission=ACLType.Readable):
+        """This returns information and the latest value of each Attribute of this entry.
+
+        All values, array children, referrals, groups and roles are loaded at once, and
+        permissions are also checked at once. So the number of queries doesn't depend on
+        the number of Attributes and the length of array values.
+        """
         # To avoid unnecessary DB access for caching referral entries
         ret_attrs = []
         attrv_prefetch = Prefetch(
@@ -1405,11 +1676,48 @@ class Entry(ACLBase):
             ),
             to_attr="attr_list",
         )
-        for entity_attr in (
+        entity_attrs = list(
             self.schema.attrs.filter(is_active=True)
             .prefetch_related(attr_prefetch)
             .order_by("index")
-        ):
+        )
+
+        # check permissions of Attributes, or EntityAttrs for the ones that don't exist
+        permitted_ids = user.get_permitted_ids(
+            [x.attr_list[0] if x.attr_list else x for x in entity_attrs], permission
+        )
+
+        # load all groups and roles that the latest values refer
+        model_ids = {Group: set(), Role: set()}
+        for entity_attr in entity_attrs:
+            for attr in entity_attr.attr_list[:1]:
+                for attrv in attr.attrv_list[-1:]:
+                    model = (
+                        Group
+                        if attrv.data_type & AttrTypeValue["group"]
+                        else Role
+                        if attrv.data_type & AttrTypeValue["role"]
+                        else None
+                    )
+                    if not model:
+                        continue
+
+                    values = (
+                        [x.value for x in attrv.data_array.all()]
+                        if attrv.data_type & AttrTypeValue["array"]
+                        else [attrv.value]
+                    )
+                    model_ids[model] |= set([x for x in values if x and x.isdigit()])
+
+        models_by_id = {
+            model: model.objects.filter(id__in=ids, is_active=True).in_bulk()
+            for (model, ids) in model_ids.items()
+        }
+
+        def _get_model_instance(model, value):
+            return models_by_id[model].get(int(value)) if value and value.isdigit() else None
+
+        for entity_attr in entity_attrs:
             attrinfo = {}
             attrinfo["id"] = ""
             attrinfo["entity_attr_id"] = entity_attr.id
@@ -1423,13 +1731,13 @@ class Entry(ACLBase):
             # check that attribute exists
             attr = entity_attr.attr_list[0] if entity_attr.attr_list else None
             if not attr:
-                attrinfo["is_readble"] = user.has_permission(entity_attr, permission)
+                attrinfo["is_readble"] = entity_attr.id in permitted_ids
                 ret_attrs.append(attrinfo)
                 continue
             attrinfo["id"] = attr.id
 
             # check permission of attributes
-            if not user.has_permission(attr, permission):
+            if attr.id not in permitted_ids:
                 attrinfo["is_readble"] = False
                 ret_attrs.append(attrinfo)
                 continue
@@ -1488,31 +1796,25 @@ class Entry(ACLBase):
                 )
 
             elif last_value.data_type == AttrTypeValue["group"] and last_value.value:
-                attrinfo["last_value"] = Group.objects.filter(
-                    id=last_value.value, is_active=True
-                ).first()
+                attrinfo["last_value"] = _get_model_instance(Group, last_value.value)
 
             elif last_value.data_type == AttrTypeValue["array_group"]:
                 attrinfo["last_value"] = [
                     x
                     for x in [
-                        Group.objects.filter(id=v.value, is_active=True).first()
-                        for v in last_value.data_array.all()
+                        _get_model_instance(Group, v.value) for v in last_value.data_array.all()
                     ]
                     if x
                 ]
 
             elif last_value.data_type == AttrTypeValue["role"] and last_value.value:
-                attrinfo["last_value"] = Role.objects.filter(
-                    id=last_value.value, is_active=True
-                ).first()
+                attrinfo["last_value"] = _get_model_instance(Role, last_value.value)
 
             elif last_value.data_type == AttrTypeValue["array_role"]:
                 attrinfo["last_value"] = [
                     x
                     for x in [
-                        Role.objects.filter(id=v.value, is_active=True).first()
-                        for v in last_value.data_array.all()
+                        _get_model_instance(Role, v.value) for v in last_value.data_array.all()
                     ]
                     if x
                 ]
@@ -1553,10 +1855,12 @@ class Entry(ACLBase):
             )
         ]
 
+        snapshot_values = self.get_snapshot_values(attrs)
+
         returning_attrs = []
         for attr in attrs:
-            attrv = attr.get_latest_value(is_readonly=True)
-            if attrv is None:
+            snapshot_value = snapshot_values[attr.id]
+            if snapshot_value is None:
                 returning_attrs.append(
                     {
                         "name": attr.schema.name,
@@ -1568,7 +1872,9 @@ class Entry(ACLBase):
                 returning_attrs.append(
                     {
                         "name": attr.schema.name,
-                        "value": attrv.get_value(serialize=True, with_metainfo=with_metainfo),
+                        "value": snapshot_value[
+                            "value_with_metainfo" if with_metainfo else "value"
+                        ],
                     }
                 )
 
@@ -1586,9 +1892,7 @@ class Entry(ACLBase):
         super(Entry, self).delete(*args, **kwargs)
 
         # update Elasticsearch index info which refered this entry not to refer this link
-        es_object = ESS()
-        for entry in [x for x in self.get_referred_objects() if x.id != self.id]:
-            entry.register_es(es=es_object)
+        Entry.register_es_in_bulk(self.get_referred_objects().exclude(id=self.id))
 
         # also delete each attributes
         for attr in self.attrs.filter(is_active=True):
@@ -1624,9 +1928,7 @@ class Entry(ACLBase):
             attr.restore()
 
         # update Elasticsearch index info which refered this entry to refer this link
-        es_object = ESS()
-        for entry in [x for x in self.get_referred_objects()]:
-            entry.register_es(es=es_object)
+        Entry.register_es_in_bulk(self.get_referred_objects())
 
         # update entry information to Elasticsearch
         self.register_es()
@@ -1651,13 +1953,15 @@ class Entry(ACLBase):
             "status": status,
         }
         params.update(extra_params)
-        cloned_entry = Entry.objects.create(**params)
-
-        for attr in self.attrs.filter(is_active=True):
-            cloned_attr = attr.clone(user, parent_entry=cloned_entry)
+        with transaction.atomic():
+            cloned_entry = Entry.objects.create(**params)
 
-            if cloned_attr:
-                cloned_entry.attrs.add(cloned_attr)
+            cloned_attrs = Attribute.clone_in_bulk(
+                user,
+                self.attrs.filter(is_active=True).select_related("schema"),
+                parent_entry=cloned_entry,
+            )
+            cloned_entry.attrs.add(*cloned_attrs)
 
         cloned_entry.del_status(Entry.STATUS_CREATING)
         return cloned_entry
@@ -1670,21 +1974,187 @@ class Entry(ACLBase):
         # that are added after creating this entry.
         self.complement_attrs(user)
 
-        for attr in self.attrs.filter(is_active=True, schema__is_active=True):
-            if not user.has_permission(attr, ACLType.Readable):
-                continue
+        attrs = list(
+            filter_permitted(
+                user,
+                self.attrs.filter(is_active=True, schema__is_active=True).select_related("schema"),
+                ACLType.Readable,
+            )
+        )
+        snapshot_values = self.get_snapshot_values(attrs)
+
+        for attr in attrs:
+            snapshot_value = snapshot_values[attr.id]
+            if snapshot_value is None:
+                # This creates a blank AttributeValue for the Attribute that has no value
+                latest_value = attr.get_latest_value()
+                if latest_value:
+                    attrinfo[attr.schema.name] = latest_value.get_value()
+                else:
+                    attrinfo[attr.schema.name] = None
+
+            elif attr.schema.type == AttrTypeValue["date"]:
+                # The value of date is serialized as a string in the snapshot
+                attrinfo[attr.schema.name] = (
+                    date.fromisoformat(snapshot_value["value"])
+                    if snapshot_value["value"] != "None"
+                    else None
+                )
 
-            latest_value = attr.get_latest_value()
-            if latest_value:
-                attrinfo[attr.schema.name] = latest_value.get_value()
             else:
-                attrinfo[attr.schema.name] = None
+                attrinfo[attr.schema.name] = snapshot_value["value"]
 
         return {"name": self.name, "attrs": attrinfo}
 
+    def get_snapshot_values(self, attrs):
+        """This returns serialized latest values of specified Attributes from EntrySnapshot.
+
+        This never writes the snapshot. The value of an Attribute is made from AttributeValue
+        instead when the snapshot doesn't have it, or Attribute.latest_value has been changed
+        since it was made. So changed values are always returned even if the snapshot is
+        outdated (c.f. update_snapshot() for when it's written and discarded).
+
+        Returns:
+            dict[int, dict]: "value" and "value_with_metainfo" keyed by each Attribute ID.
+                             This is None for the Attribute that has no value.
+        """
+        snapshot = EntrySnapshot.objects.filter(entry=self).first()
+        stored_values = snapshot.values if snapshot else {}
+
+        def _get_value(attr):
+            stored_value = stored_values.get(str(attr.id), {})
+            if attr.latest_value_id and stored_value.get("attrv_id") == attr.latest_value_id:
+                return stored_value["value"]
+
+            return self._make_snapshot_value(attr)
+
+        return {x.id: _get_value(x) for x in attrs}
+
+    def update_snapshot(self):
+        """This rebuilds EntrySnapshot from the latest values of this entry.
+
+        The snapshot depends on names of referred entries, groups and roles as well as values
+        of this entry. So this is called by register_es(), which runs whenever a value is
+        changed and for referring entries whenever those names are changed. On the other
+        hand, register_es_in_bulk() discards snapshots not to make them for every entry.
+        """
+        stored_values = {
+            str(x.id): {"attrv_id": x.latest_value_id, "value": self._make_snapshot_value(x)}
+            for x in self.attrs.filter(
+                is_active=True, schema__is_active=True, latest_value__isnull=False
+            ).select_related("schema")
+        }
+        EntrySnapshot.objects.update_or_create(entry=self, defaults={"values": stored_values})
+
+    def _make_snapshot_value(self, attr):
+        attrv = attr.get_latest_value(is_readonly=True)
+        if attrv is None:
+            return None
+
+        return {
+            "value": attrv.get_value(serialize=True),
+            "value_with_metainfo": attrv.get_value(serialize=True, with_metainfo=True),
+        }
+
     # NOTE: Type-Write
     def get_es_document(self, es=None):
         """This processing registers entry information to Elasticsearch"""
+        return Entry.get_es_documents([self])[self.id]
+
+    @classmethod
+    def get_es_documents(kls, entries):
+        """This builds documents to register to Elasticsearch for each specified entries.
+
+        This loads schemas, attributes, latest values, array children, referrals, groups
+        and roles of all entries at once. So the number of queries that this sends doesn't
+        depend on the number of entries and attributes.
+
+        Args:
+            entries (QuerySet or list(Entry) or list(int)): target entries or their IDs
+
+        Returns:
+            dict[int, dict]: documents for Elasticsearch keyed by each entry ID
+        """
+        if isinstance(entries, models.QuerySet):
+            entries = list(entries)
+        elif entries and not all([isinstance(x, Entry) for x in entries]):
+            entries = list(Entry.objects.filter(id__in=entries))
+
+        if not entries:
+            return {}
+
+        entry_ids = [x.id for x in entries]
+        schemas = Entity.objects.in_bulk(set([x.schema_id for x in entries]))
+
+        # get active EntityAttrs of each schema
+        entity_attrs = {}
+        for rel in Entity.attrs.through.objects.filter(
+            entity_id__in=schemas.keys(), entityattr__is_active=True
+        ).select_related("entityattr"):
+            entity_attrs.setdefault(rel.entity_id, []).append(rel.entityattr)
+
+        # get Attribute that has the smallest ID for each EntityAttr of each entries,
+        # which is same with the one that entry.attrs.filter(schema=...).first() returns
+        attrs = {}
+        for rel in (
+            Entry.attrs.through.objects.filter(entry_id__in=entry_ids, attribute__is_active=True)
+            .select_related("attribute")
+            .order_by("attribute_id")
+        ):
+            attrs.setdefault((rel.entry_id, rel.attribute.schema_id), rel.attribute)
+
+        # get the latest AttributeValue of each Attributes in the same way of get_latest_value()
+        attr_ids = [x.id for x in attrs.values()]
+        latest_attrv_ids = dict(
+            Attribute.values.through.objects.filter(
+                attribute_id__in=attr_ids, attributevalue__is_latest=True
+            )
+            .order_by("attributevalue_id")
+            .values_list("attribute_id", "attributevalue_id")
+        )
+        attr_ids_without_latest = set(attr_ids) - set(latest_attrv_ids.keys())
+        if attr_ids_without_latest:
+            latest_attrv_ids.update(
+                Attribute.values.through.objects.filter(attribute_id__in=attr_ids_without_latest)
+                .values("attribute_id")
+                .annotate(attrv_id=Max("attributevalue_id"))
+                .values_list("attribute_id", "attrv_id")
+            )
+        attrvs = {
+            x.id: x
+            for x in AttributeValue.objects.filter(id__in=latest_attrv_ids.values())
+            .select_related("referral")
+            .prefetch_related(
+                Prefetch("data_array", queryset=AttributeValue.objects.select_related("referral"))
+            )
+        }
+
+        # get Groups and Roles that are referred from the latest values at once
+        referred_ids = {AttrTypeValue["group"]: set(), AttrTypeValue["role"]: set()}
+        for attr in attrs.values():
+            attrv = attrvs.get(latest_attrv_ids.get(attr.id))
+            if not attrv:
+                continue
+
+            for (model_type, ids) in referred_ids.items():
+                if attrv.data_type & model_type:
+                    ids.update(
+                        [
+                            int(x.value)
+                            for x in [attrv] + list(attrv.data_array.all())
+                            if x.value.isdigit()
+                        ]
+                    )
+
+        referred_objects = {
+            AttrTypeValue["group"]: Group.objects.filter(
+                id__in=referred_ids[AttrTypeValue["group"]], is_active=True
+            ).in_bulk(),
+            AttrTypeValue["role"]: Role.objects.filter(
+                id__in=referred_ids[AttrTypeValue["role"]], is_active=True
+            ).in_bulk(),
+        }
+
         # This innner method truncates value in taking multi-byte in account
         def truncate(value):
             while len(value.encode("utf-8")) > ESS.MAX_TERM_SIZE:
@@ -1704,9 +2174,9 @@ class Entry(ACLBase):
                 else False,
             }
 
-            def _set_attrinfo_data(model):
-                if attrv.value:
-                    obj = model.objects.filter(id=attrv.value, is_active=True).first()
+            def _set_attrinfo_data(model_type):
+                if attrv.value and attrv.value.isdigit():
+                    obj = referred_objects[model_type].get(int(attrv.value))
                     if obj:
                         attrinfo["value"] = truncate(obj.name)
                         attrinfo["referral_id"] = obj.id
@@ -1748,10 +2218,10 @@ class Entry(ACLBase):
                     attrinfo["referral_id"] = attrv.referral.id
 
             elif entity_attr.type & AttrTypeValue["group"]:
-                _set_attrinfo_data(Group)
+                _set_attrinfo_data(AttrTypeValue["group"])
 
             elif entity_attr.type & AttrTypeValue["role"]:
-                _set_attrinfo_data(Role)
+                _set_attrinfo_data(AttrTypeValue["role"])
 
             # Basically register attribute information whatever value doesn't exist
             if not (entity_attr.type & AttrTypeValue["array"] and not is_recursive):
@@ -1761,9 +2231,10 @@ class Entry(ACLBase):
                 entity_attr.type & AttrTypeValue["array"] and not is_recursive and attrv is not None
             ):
                 # Here is the case of parent array, set each child values
+                # (the blank AttributeValue, which isn't saved, has no child)
                 [
                     _set_attrinfo(entity_attr, attr, x, container, True)
-                    for x in attrv.data_array.all()
+                    for x in (attrv.data_array.all() if attrv.id else [])
                 ]
 
                 # If there is no value in container,
@@ -1771,38 +2242,95 @@ class Entry(ACLBase):
                 if not [x for x in container if x["name"] == entity_attr.name]:
                     container.append(attrinfo)
 
-        document = {
-            "entity": {"id": self.schema.id, "name": self.schema.name},
-            "name": self.name,
-            "attr": [],
-            "is_readble": True
-            if (self.is_public or self.default_permission >= ACLType.Readable.id)
-            else False,
-        }
+        documents = {}
+        for entry in entries:
+            schema = schemas[entry.schema_id]
+            document = {
+                "entity": {"id": schema.id, "name": schema.name},
+                "name": entry.name,
+                "attr": [],
+                "is_readble": True
+                if (entry.is_public or entry.default_permission >= ACLType.Readable.id)
+                else False,
+            }
+
+            # The reason why this is a beat around the bush processing is for the case that
+            # Attibutes objects are not existed in attr parameter because of delay processing.
+            # If this entry doesn't have an Attribute object associated with an EntityAttr,
+            # this registers blank value to the Elasticsearch.
+            for entity_attr in entity_attrs.get(schema.id, []):
+                attrv = None
+
+                attr = attrs.get((entry.id, entity_attr.id))
+                if attr:
+                    attrv = attrvs.get(latest_attrv_ids.get(attr.id))
 
-        # The reason why this is a beat around the bush processing is for the case that Attibutes
-        # objects are not existed in attr parameter because of delay processing. If this entry
-        # doesn't have an Attribute object associated with an EntityAttr, this registers blank
-        # value to the Elasticsearch.
-        for entity_attr in self.schema.attrs.filter(is_active=True):
-            attrv = None
+                    # When there is no available value, Attribute.get_latest_value() creates
+                    # a blank one. This emulates it not to send any query to create it.
+                    if attrv is None or attrv.data_type != entity_attr.type:
+                        attrv = AttributeValue(value="", data_type=entity_attr.type)
 
-            attr = self.attrs.filter(schema=entity_attr, is_active=True).first()
-            if attr:
-                attrv = attr.get_latest_value()
+                _set_attrinfo(entity_attr, attr, attrv, document["attr"])
 
-            _set_attrinfo(entity_attr, attr, attrv, document["attr"])
+            documents[entry.id] = document
 
-        return document
+        return documents
 
     def register_es(self, es=None, skip_refresh=False):
         if not es:
             es = ESS()
 
+        # This rebuilds the snapshot too, because names of referred objects might be changed
+        self.update_snapshot()
+
         es.index(doc_type="entry", id=self.id, body=self.get_es_document(es))
         if not skip_refresh:
             es.refresh()
 
+    @classmethod
+    def register_es_in_bulk(
+        kls, entries, es=None, chunk_size=None, max_chunk_bytes=None, skip_refresh=False
+    ):
+        """This registers documents of the specified entries through the bulk API.
+
+        Documents are built by get_es_documents() for each chunk of entries while the
+        previous chunk is sent, so this is able to handle a large QuerySet without holding
+        all documents in memory.
+
+        Returns:
+            tuple(int, list(dict)): same as ESS.bulk_index()
+        """
+        if not es:
+            es = ESS()
+
+        chunk_size = chunk_size or ESS.BULK_CHUNK_SIZE
+        if isinstance(entries, models.QuerySet):
+            entries = entries.iterator(chunk_size=chunk_size)
+
+        def _get_documents(chunk):
+            # This discards snapshots too, because names of referred objects might be changed
+            EntrySnapshot.objects.filter(entry__in=chunk).delete()
+
+            return kls.get_es_documents(chunk).items()
+
+        def _iterate_documents():
+            chunk = []
+            for entry in entries:
+                chunk.append(entry)
+                if len(chunk) >= chunk_size:
+                    yield from _get_documents(chunk)
+                    chunk = []
+
+            if chunk:
+                yield from _get_documents(chunk)
+
+        return es.bulk_index(
+            _iterate_documents(),
+            chunk_size=chunk_size,
+            max_chunk_bytes=max_chunk_bytes,
+            skip_refresh=skip_refresh,
+        )
+
     def unregister_es(self, es=None):
         if not es:
             es = ESS()
@@ -1810,7 +2338,23 @@ class Entry(ACLBase):
         es.delete(doc_type="entry", id=self.id, ignore=[404])
         es.refresh(ignore=[404])
 
-    def get_value_history(self, user, count=CONFIG.MAX_HISTORY_COUNT, index=0):
+    def get_value_history(
+        self, user, count=CONFIG.MAX_HISTORY_COUNT, index=0, before_attrv_id=None
+    ):
+        """This returns changes of attribute values from the newest one.
+
+        Values are read in order of (created_time, id) from both AttributeValue and
+        ArchivedAttributeValue in one pass, and each of them is paired with the previous
+        value of the same Attribute. Permissions are checked once for each Attribute.
+
+        Args:
+            count (int): the maximum number of changes to return
+            index (int): the number of changes to skip
+            before_attrv_id (int): returns changes older than the value of this ID, which is
+                                   the "attrv_id" of the last change that caller has got.
+                                   This is faster than index for long histories.
+        """
+
         def _get_values(attrv):
             return {
                 "attrv_id": attrv.id,
@@ -1819,39 +2363,84 @@ class Entry(ACLBase):
                 "created_user": attrv.created_user.username,
             }
 
+        def _get_values_queries(query):
+            return [
+                model.objects.filter(query, parent_attrv__isnull=True)
+                .select_related("created_user")
+                .order_by("-created_time", "-id")
+                for model in [AttributeValue, ArchivedAttributeValue]
+            ]
+
+        attrs = {
+            x.id: x
+            for x in filter_permitted(
+                user,
+                self.attrs.filter(is_active=True, schema__is_active=True).select_related("schema"),
+                ACLType.Readable,
+            )
+        }
+
+        query = Q(parent_attr__in=attrs.keys())
+        if before_attrv_id:
+            before_attrv = AttributeValue.get_with_archived(before_attrv_id)
+            if before_attrv:
+                query &= Q(created_time__lt=before_attrv.created_time) | Q(
+                    created_time=before_attrv.created_time, id__lt=before_attrv.id
+                )
+
+        # Each of them is limited because the changes to return must be in the range
+        all_attrv = heapq.merge(
+            *[x[: index + count] for x in _get_values_queries(query)],
+            key=lambda x: (x.created_time, x.id),
+            reverse=True,
+        )
+
+        # This keeps changes that are waiting for the previous value of each Attribute
         ret_values = []
-        all_attrv = AttributeValue.objects.filter(
-            parent_attr__in=self.attrs.all(), parent_attrv__isnull=True
-        ).order_by("-created_time")[index:]
+        waiting_values = {}
+        for attrv in itertools.islice(all_attrv, index, None):
+            waiting_value = waiting_values.pop(attrv.parent_attr_id, None)
+            if waiting_value:
+                waiting_value["prev"] = _get_values(attrv)
 
-        for (i, attrv) in enumerate(all_attrv):
             if len(ret_values) >= count:
                 break
 
-            attr = attrv.parent_attr
-            if (
-                attr.is_active
-                and attr.schema.is_active
-                and user.has_permission(attr, ACLType.Readable)
-                and user.has_permission(attr.schema, ACLType.Readable)
-            ):
-
-                # try to get next attrv
-                next_attrv = None
-                for _attrv in all_attrv[(i + 1) :]:
-                    if _attrv.parent_attr == attr:
-                        next_attrv = _attrv
-                        break
+            attr = attrs[attrv.parent_attr_id]
+            ret_values.append(
+                {
+                    "attr_id": attr.id,
+                    "attr_name": attr.schema.name,
+                    "attr_type": attr.schema.type,
+                    "curr": _get_values(attrv),
+                    "prev": None,
+                }
+            )
+            waiting_values[attr.id] = ret_values[-1]
 
-                ret_values.append(
-                    {
-                        "attr_id": attr.id,
-                        "attr_name": attr.schema.name,
-                        "attr_type": attr.schema.type,
-                        "curr": _get_values(attrv),
-                        "prev": _get_values(next_attrv) if next_attrv else None,
-                    }
-                )
+        # This gets the previous values that are not reached above for each Attribute
+        for (attr_id, waiting_value) in waiting_values.items():
+            curr = waiting_value["curr"]
+            prev_attrv = max(
+                [
+                    x
+                    for x in [
+                        y.first()
+                        for y in _get_values_queries(
+                            Q(parent_attr=attr_id)
+                            & (
+                                Q(created_time__lt=curr["created_time"])
+                                | Q(created_time=curr["created_time"], id__lt=curr["attrv_id"])
+                            )
+                        )
+                    ]
+                    if x
+                ],
+                key=lambda x: (x.created_time, x.id),
+                default=None,
+            )
+            if prev_attrv:
+                waiting_value["prev"] = _get_values(prev_attrv)
 
         return ret_values
 
@@ -1870,9 +2459,9 @@ class Entry(ACLBase):
 
         Do the following:
         1. Create a query for Elasticsearch search. (make_query)
-        2. Execute the created query. (execute_query)
+        2. Execute the created queries of all Entities at once. (execute_queries_in_pages)
         3. Search the reference entry, Check permissions,
-           process the search results, and return. (make_search_results)
+           process the search results, and return. (make_search_results_for_entities)
 
         Args:
             user (:obj:`str`, optional): User who executed the process
@@ -1910,24 +2499,77 @@ class Entry(ACLBase):
         if not hint_attrs:
             hint_attrs = []
 
-        results = {
-            "ret_count": 0,
-            "ret_values": [],
-        }
+        # retrieve data from database on the basis of the result of elasticsearch, which are
+        # merged in the order of entry name
+        return make_search_results_for_entities(
+            user,
+            [
+                (pages, entity_hint_attrs)
+                for (entity_hint_attrs, pages) in kls._search_pages_of_entities(
+                    user, hint_entity_ids, hint_attrs, entry_name, is_output_all
+                )
+            ],
+            limit,
+            hint_referral,
+        )
+
+    @classmethod
+    def iterate_search_entries(
+        kls,
+        user,
+        hint_entity_ids,
+        hint_attrs=None,
+        entry_name=None,
+        hint_referral=False,
+        is_output_all=False,
+    ):
+        """This yields each search result of advanced search without limit.
+
+        Unlike search_entries(), results are read from Elasticsearch page by page while
+        they are consumed, so this is able to handle all results (e.g. to export them)
+        with bounded memory. Results are sorted by name in each Entity.
+
+        Returns:
+            Iterator[dict[str, any]]: same as each item of 'ret_values' of search_entries()
+        """
+        if not hint_attrs:
+            hint_attrs = []
+
+        for (entity_hint_attrs, pages) in kls._search_pages_of_entities(
+            user, hint_entity_ids, hint_attrs, entry_name, is_output_all
+        ):
+            yield from iterate_search_results(user, pages, entity_hint_attrs, hint_referral)
+
+    @classmethod
+    def _search_pages_of_entities(
+        kls, user, hint_entity_ids, hint_attrs, entry_name, is_output_all
+    ):
+        """This returns search results of each Entity which user can read.
+
+        Each of them is a tuple of hint_attrs for the Entity and an iterator of search result
+        pages of Elasticsearch. The hint_attrs is a copy of the specified one that has
+        'is_readble' for the Entity (and all attributes of the Entity when is_output_all is
+        set). The first pages of all Entities are read through one multi search request.
+        """
+        entities_hint_attrs = []
+        queries = []
         for hint_entity_id in hint_entity_ids:
             # Check for has permission to Entity
             entity = Entity.objects.filter(id=hint_entity_id, is_active=True).first()
             if not (entity and user.has_permission(entity, ACLType.Readable)):
                 continue
 
+            entity_attrs = {}
+            for entity_attr in entity.attrs.filter(is_active=True).order_by("id"):
+                entity_attrs.setdefault(entity_attr.name, entity_attr)
+
             # Check for has permission to EntityAttr
-            for hint_attr in hint_attrs:
+            entity_hint_attrs = [dict(x) for x in hint_attrs]
+            for hint_attr in entity_hint_attrs:
                 if "name" not in hint_attr:
                     continue
 
-                hint_entity_attr = entity.attrs.filter(
-                    name=hint_attr["name"], is_active=True
-                ).first()
+                hint_entity_attr = entity_attrs.get(hint_attr["name"])
                 hint_attr["is_readble"] = (
                     True
                     if (
@@ -1937,19 +2579,15 @@ class Entry(ACLBase):
                 )
 
             # make query for elasticsearch to retrieve data user wants
-            query = make_query(entity, hint_attrs, entry_name)
-
-            # sending request to elasticsearch with making query
-            resp = execute_query(query)
-
-            if "status" in resp and resp["status"] == 404:
-                continue
+            queries.append(make_query(entity, entity_hint_attrs, entry_name))
 
             # Check for has permission to EntityAttr, when is_output_all flag
             if is_output_all:
-                for entity_attr in entity.attrs.filter(is_active=True):
-                    if entity_attr.name not in [x["name"] for x in hint_attrs if "name" in x]:
-                        hint_attrs.append(
+                for entity_attr in entity_attrs.values():
+                    if entity_attr.name not in [
+                        x["name"] for x in entity_hint_attrs if "name" in x
+                    ]:
+                        entity_hint_attrs.append(
                             {
                                 "name": entity_attr.name,
                                 "is_readble": True
@@ -1958,11 +2596,19 @@ class Entry(ACLBase):
                             }
                         )
 
-            # retrieve data from database on the basis of the result of elasticsearch
-            search_result = make_search_results(user, resp, hint_attrs, limit, hint_referral)
-            results["ret_count"] += search_result["ret_count"]
-            results["ret_values"].extend(search_result["ret_values"])
-            limit -= search_result["ret_count"]
+            entities_hint_attrs.append(entity_hint_attrs)
+
+        # sending request to elasticsearch with making queries, whose results are read
+        # page by page while they are consumed
+        results = []
+        for (entity_hint_attrs, pages) in zip(
+            entities_hint_attrs, execute_queries_in_pages(queries)
+        ):
+            first_page = next(pages)
+            if "status" in first_page and first_page["status"] == 404:
+                continue
+
+            results.append((entity_hint_attrs, itertools.chain([first_page], pages)))
 
         return results
 
@@ -2008,18 +2654,16 @@ class Entry(ACLBase):
             }
 
         """
-        # by elasticsearch limit, from + size must be less than or equal to max_result_window
-        if offset + limit > settings.ES_CONFIG["MAXIMUM_RESULTS_NUM"]:
-            return {
-                "ret_count": 0,
-                "ret_values": [],
-            }
-
         query = make_query_for_simple(
             hint_attr_value, hint_entity_name, exclude_entity_names, offset
         )
 
-        resp = execute_query(query, limit)
+        # by elasticsearch limit, from + size must be less than or equal to max_result_window.
+        # Results beyond it are read page by page from the head of them.
+        if offset + limit > settings.ES_CONFIG["MAXIMUM_RESULTS_NUM"]:
+            resp = execute_query_in_range(query, offset, limit)
+        else:
+            resp = execute_query(query, limit)
 
         if "status" in resp and resp["status"] == 404:
             return {
@@ -2077,3 +2721,16 @@ class Entry(ACLBase):
             parent_attr__schema__is_active=True,
             parent_attr__parent_entry=self,
         ).last()
+
+
+class EntrySnapshot(models.Model):
+    """This is a materialized snapshot of serialized latest values of an Entry.
+
+    The values are keyed by Attribute ID, and each of them has the ID of AttributeValue
+    that it's made from to detect it's outdated. This is written by Entry.update_snapshot()
+    and only read by Entry.get_snapshot_values().
+    """
+
+    entry = models.OneToOneField(Entry, on_delete=models.CASCADE, related_name="snapshot")
+    values = models.JSONField(default=dict)
+    updated_time = models.DateTimeField(auto_now=True)
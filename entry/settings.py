@@ -9,6 +9,8 @@ CONFIG = Settings(
             "MAX_LABEL_STRING": 45,
         },
         "MAX_HISTORY_COUNT": 10,
+        "ARCHIVE_VALUE_AGE_DAYS": 365,
+        "COPY_ENTRY_CHUNK_SIZE": 20,
         "MAX_QUERY_SIZE": 249,  # '.*' + '[aA]'*249 + '.*' = 1000
         "EMPTY_SEARCH_CHARACTER": "\\",
         "EMPTY_SEARCH_CHARACTER_CODE": chr(165),
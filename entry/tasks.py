@@ -1,14 +1,14 @@
 import csv
-import io
 import json
 from datetime import datetime
 
 import yaml
+from django.core.cache import cache
 from rest_framework.exceptions import ValidationError
 
 import custom_view
 from airone.celery import app
-from airone.lib.acl import ACLType
+from airone.lib.acl import ACLType, filter_permitted
 from airone.lib.event_notification import (
     notify_entry_create,
     notify_entry_delete,
@@ -25,6 +25,7 @@ from entry.api_v2.serializers import (
     EntryUpdateSerializer,
 )
 from entry.models import Attribute, Entry
+from entry.settings import CONFIG
 from job.models import Job
 from user.models import User
 
@@ -199,8 +200,7 @@ def _do_import_entries_v2(job: Job):
 
         # abort processing when job is canceled
         if job.is_canceled():
-            job.status = Job.STATUS["CANCELED"]
-            job.save(update_fields=["status"])
+            job.update(Job.STATUS["CANCELED"])
             return
 
         entry_data["schema"] = entity
@@ -393,6 +393,23 @@ def restore_entry(self, job_id):
         job.update(Job.STATUS["DONE"])
 
 
+def _get_copy_entry_cache_key(job, name):
+    return "job_%d_copy_entry_%s" % (job.id, name)
+
+
+def _finish_copy_entry(job):
+    total_count = len(json.loads(job.params)["new_name_list"])
+    copied_count = cache.get(_get_copy_entry_cache_key(job, "copied")) or 0
+
+    if job.is_canceled():
+        job.update(text="Copy completed [%5d/%5d]" % (copied_count, total_count))
+    else:
+        job.update(
+            status=Job.STATUS["DONE"],
+            text="Copy completed [%5d/%5d]" % (copied_count, total_count),
+        )
+
+
 @app.task(bind=True)
 def copy_entry(self, job_id):
     job = Job.objects.get(id=job_id)
@@ -401,30 +418,51 @@ def copy_entry(self, job_id):
         # update job status
         job.update(Job.STATUS["PROCESSING"])
 
-        user = User.objects.get(id=job.user.id)
-        src_entry = Entry.objects.get(id=job.target.id)
-
+        # This splits new names into chunks, which are copied by copy_entry_chunk tasks
+        # in parallel across workers.
         params = json.loads(job.params)
-        total_count = len(params["new_name_list"])
-        for (index, new_name) in enumerate(params["new_name_list"]):
-            # abort processing when job is canceled
-            if job.is_canceled():
-                job.text = "Copy completed [%5d/%5d]" % (index, total_count)
-                job.save(update_fields=["text"])
-                return
+        chunk_size = CONFIG.COPY_ENTRY_CHUNK_SIZE
+        chunks = [
+            params["new_name_list"][i : i + chunk_size]
+            for i in range(0, len(params["new_name_list"]), chunk_size)
+        ]
+        if not chunks:
+            _finish_copy_entry(job)
+            return
 
-            job.text = "Now copying... (progress: [%5d/%5d])" % (index + 1, total_count)
-            job.save(update_fields=["text"])
+        # These counters aggregate progress of the chunks. The chunk task which decreases
+        # the remaining count to zero finishes this job.
+        timeout = Job._get_job_timeout()
+        cache.set(_get_copy_entry_cache_key(job, "copied"), 0, timeout)
+        cache.set(_get_copy_entry_cache_key(job, "remaining"), len(chunks), timeout)
 
-            params["new_name"] = new_name
-            job_do_copy_entry = Job.new_do_copy(user, src_entry, new_name, params)
-            job_do_copy_entry.run(will_delay=False)
+        for new_names in chunks:
+            copy_entry_chunk.delay(job.id, new_names)
 
-        # update job status and save it
-        job.update(
-            status=Job.STATUS["DONE"],
-            text="Copy completed [%5d/%5d]" % (total_count, total_count),
-        )
+
+@app.task(bind=True)
+def copy_entry_chunk(self, job_id, new_names):
+    job = Job.objects.get(id=job_id)
+
+    user = User.objects.get(id=job.user.id)
+    src_entry = Entry.objects.get(id=job.target.id)
+
+    params = json.loads(job.params)
+    total_count = len(params["new_name_list"])
+    for new_name in new_names:
+        # abort processing when job is canceled
+        if job.is_canceled():
+            break
+
+        params["new_name"] = new_name
+        job_do_copy_entry = Job.new_do_copy(user, src_entry, new_name, params)
+        job_do_copy_entry.run(will_delay=False)
+
+        copied_count = cache.incr(_get_copy_entry_cache_key(job, "copied"))
+        job.update(text="Now copying... (progress: [%5d/%5d])" % (copied_count, total_count))
+
+    if cache.decr(_get_copy_entry_cache_key(job, "remaining")) <= 0:
+        _finish_copy_entry(job)
 
 
 @app.task(bind=True)
@@ -499,59 +537,61 @@ def export_entries(self, job_id):
     entity = Entity.objects.get(id=job.target.id)
     params = json.loads(job.params)
 
-    exported_data = []
-
-    # This variable is used for job status check. When it's checked at every loop, this might send
-    # tons of query to the database. To prevent the sort of tragedy situation, checking status of
-    # this job should be skipped some times (which is specified in Job.STATUS_CHECK_FREQUENCY).
-    #
-    # NOTE:
-    #   This doesn't use enumerate() method to count loop. Because when a QuerySet value is
-    #   passed to the argument of enumerate() method, Django try to get result at once (this never
-    #   do lazy evaluation).
-    export_item_counter = 0
-    for entry in Entry.objects.filter(schema=entity, is_active=True):
-        # abort processing when job is canceled
-        if export_item_counter % Job.STATUS_CHECK_FREQUENCY == 0 and job.is_canceled():
-            return
-
-        if user.has_permission(entry, ACLType.Readable):
-            exported_data.append(entry.export(user))
-
-        # increment loop counter
-        export_item_counter += 1
-
-    output = None
-    if params["export_format"] == "csv":
-        # newline is blank because csv module performs universal newlines
-        # https://docs.python.org/ja/3/library/csv.html#id3
-        output = io.StringIO(newline="")
-        writer = csv.writer(output)
+    def data2str(data):
+        if not data:
+            return ""
+        return str(data)
+
+    # The result is written to the job cache incrementally. CSV rows are written every time
+    # an entry is exported, so exported data isn't kept in memory in that case.
+    with job.open_cache() as output:
+        writer = None
+        if params["export_format"] == "csv":
+            # the stream of job cache is opened with blank newline parameter because csv module
+            # performs universal newlines https://docs.python.org/ja/3/library/csv.html#id3
+            writer = csv.writer(output)
+
+            attrs = [x.name for x in entity.attrs.filter(is_active=True)]
+            writer.writerow(["Name"] + attrs)
+
+        exported_data = []
+
+        # This variable is used for job status check. When it's checked at every loop, this
+        # might send tons of query to the database. To prevent the sort of tragedy situation,
+        # checking status of this job should be skipped some times (which is specified in
+        # Job.STATUS_CHECK_FREQUENCY).
+        #
+        # NOTE:
+        #   This doesn't use enumerate() method to count loop. Because when a QuerySet value is
+        #   passed to the argument of enumerate() method, Django try to get result at once
+        #   (this never do lazy evaluation).
+        export_item_counter = 0
+        for entry in filter_permitted(
+            user, Entry.objects.filter(schema=entity, is_active=True), ACLType.Readable
+        ):
+            # abort processing when job is canceled (the result is discarded by open_cache)
+            if export_item_counter % Job.STATUS_CHECK_FREQUENCY == 0 and job.is_canceled():
+                return
 
-        attrs = [x.name for x in entity.attrs.filter(is_active=True)]
-        writer.writerow(["Name"] + attrs)
+            data = entry.export(user)
+            if writer:
+                writer.writerow(
+                    [data["name"]]
+                    + [data2str(data["attrs"][x]) for x in attrs if x in data["attrs"]]
+                )
+            else:
+                exported_data.append(data)
 
-        def data2str(data):
-            if not data:
-                return ""
-            return str(data)
+            # increment loop counter
+            export_item_counter += 1
 
-        for data in exported_data:
-            writer.writerow(
-                [data["name"]] + [data2str(data["attrs"][x]) for x in attrs if x in data["attrs"]]
-            )
-    else:
-        output = io.StringIO()
-        output.write(
+        if not writer:
             yaml.dump(
                 {entity.name: exported_data},
+                output,
                 default_flow_style=False,
                 allow_unicode=True,
             )
-        )
-
-    if output:
-        job.set_cache(output.getvalue())
 
     # update job status and save it except for the case that target job is canceled.
     if not job.is_canceled():
@@ -569,7 +609,7 @@ def register_referrals(self, job_id):
     # register entries data which refer target entry to elasticsearch
     entry = Entry.objects.filter(id=job.target.id, is_active=True).first()
     if entry:
-        [r.register_es() for r in entry.get_referred_objects()]
+        Entry.register_es_in_bulk(entry.get_referred_objects())
 
     if not job.is_canceled():
         job.update(Job.STATUS["DONE"])
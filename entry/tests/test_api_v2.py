@@ -394,6 +394,59 @@ class ViewTest(AironeViewTest):
         resp = self.client.get("/entry/api/v2/%d/" % entry.id)
         self.assertEqual(resp.status_code, 200)
 
+    def test_retrieve_entry_with_constant_queries(self):
+        ref_entries = [self.add_entry(self.user, "r-%d" % i, self.ref_entity) for i in range(1, 10)]
+        groups = [Group.objects.create(name="group-%d" % i) for i in range(1, 10)]
+        roles = [Role.objects.create(name="role-%d" % i) for i in range(1, 10)]
+
+        def _prepare_retrieve(count):
+            entry: Entry = self.add_entry(
+                self.user,
+                "entry-%d" % count,
+                self.entity,
+                values={
+                    "ref": self.ref_entry.id,
+                    "name": {"name": "hoge", "id": self.ref_entry.id},
+                    "group": self.group.id,
+                    "groups": [x.id for x in ([self.group] + groups)[:count]],
+                    "refs": [x.id for x in ([self.ref_entry] + ref_entries)[:count]],
+                    "names": [
+                        {"name": "name-%d" % i, "id": x.id}
+                        for (i, x) in enumerate(([self.ref_entry] + ref_entries)[:count])
+                    ],
+                    "role": self.role.id,
+                    "roles": [x.id for x in ([self.role] + roles)[:count]],
+                },
+            )
+            return lambda: self.client.get("/entry/api/v2/%d/" % entry.id)
+
+        # checks the number of queries doesn't depend on the length of array values
+        [_, resp] = self.assertConstantQueries(_prepare_retrieve, [1, 10])
+        self.assertEqual(resp.status_code, 200)
+
+        resp_data = resp.json()
+
+        attrs = {x["schema"]["name"]: x["value"] for x in resp_data["attrs"]}
+        self.assertEqual(
+            attrs["groups"]["as_array_group"],
+            [{"id": x.id, "name": x.name} for x in [self.group] + groups],
+        )
+        self.assertEqual(
+            attrs["roles"]["as_array_role"],
+            [{"id": x.id, "name": x.name} for x in [self.role] + roles],
+        )
+        self.assertEqual(
+            attrs["refs"]["as_array_object"],
+            [
+                {
+                    "id": x.id,
+                    "name": x.name,
+                    "schema": {"id": self.ref_entity.id, "name": self.ref_entity.name},
+                }
+                for x in [self.ref_entry] + ref_entries
+            ],
+        )
+
     def test_retrieve_entry_with_invalid_param(self):
         resp = self.client.get("/entry/api/v2/%s/" % "hoge")
         self.assertEqual(resp.status_code, 404)
@@ -1101,6 +1154,7 @@ class ViewTest(AironeViewTest):
         self.assertTrue(mock_task.called)
 
     @mock.patch("entry.tasks.copy_entry.delay", mock.Mock(side_effect=tasks.copy_entry))
+    @mock.patch("entry.tasks.copy_entry_chunk.delay", mock.Mock(side_effect=tasks.copy_entry_chunk))
     def test_copy_entry(self):
         entry: Entry = self.add_entry(self.user, "entry", self.entity)
         params = {"copy_entry_names": ["copy1", "copy2"]}
@@ -1116,6 +1170,42 @@ class ViewTest(AironeViewTest):
             Entry.objects.filter(name="copy2", schema=self.entity, is_active=True).exists()
         )
 
+    @mock.patch("entry.tasks.CONFIG.COPY_ENTRY_CHUNK_SIZE", 1)
+    @mock.patch("entry.tasks.copy_entry.delay", mock.Mock(side_effect=tasks.copy_entry))
+    def test_copy_entry_in_chunks(self):
+        entry: Entry = self.add_entry(self.user, "entry", self.entity)
+        params = {"copy_entry_names": ["copy1", "copy2", "copy3"]}
+
+        with mock.patch("entry.tasks.copy_entry_chunk.delay") as mock_chunk_task:
+            resp = self.client.post(
+                "/entry/api/v2/%s/copy/" % entry.id, json.dumps(params), "application/json"
+            )
+        self.assertEqual(resp.status_code, 200)
+
+        # checks new names are split into chunks that are sent as separate tasks
+        job = Job.objects.get(operation=JobOperation.COPY_ENTRY.value, target=entry)
+        self.assertEqual(
+            [x.args for x in mock_chunk_task.call_args_list],
+            [(job.id, ["copy1"]), (job.id, ["copy2"]), (job.id, ["copy3"])],
+        )
+
+        # checks progress of each chunk is aggregated to the parent job
+        tasks.copy_entry_chunk(*mock_chunk_task.call_args_list[0].args)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.STATUS["PROCESSING"])
+        self.assertEqual(job.text, "Now copying... (progress: [    1/    3])")
+
+        # checks canceling parent job stops all remaining chunks
+        job.update(Job.STATUS["CANCELED"])
+        for call_args in mock_chunk_task.call_args_list[1:]:
+            tasks.copy_entry_chunk(*call_args.args)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.STATUS["CANCELED"])
+        self.assertEqual(job.text, "Copy completed [    1/    3]")
+        self.assertTrue(Entry.objects.filter(name="copy1", schema=self.entity).exists())
+        self.assertFalse(Entry.objects.filter(name__in=["copy2", "copy3"]).exists())
+
     def test_copy_entry_without_permission(self):
         entry: Entry = self.add_entry(self.user, "entry", self.entity)
         params = {"copy_entry_names": ["copy1"]}
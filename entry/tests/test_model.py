@@ -1,17 +1,30 @@
-from datetime import date
-from unittest import skip
+import json
+from datetime import date, timedelta
+from unittest import mock, skip
 
 from django.conf import settings
 from django.core.cache import cache
+from django.db import connection
+from django.db.models import Q
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 
 from acl.models import ACLBase
 from airone.lib.acl import ACLObjType, ACLType
+from airone.lib.elasticsearch import ESS
 from airone.lib.test import AironeTestCase
 from airone.lib.types import AttrTypeArrObj, AttrTypeArrStr, AttrTypeObj, AttrTypeStr, AttrTypeValue
 from entity.models import Entity, EntityAttr
-from entry.models import Attribute, AttributeValue, Entry
+from entry.models import (
+    ArchivedAttributeValue,
+    Attribute,
+    AttributeValue,
+    Entry,
+    EntrySnapshot,
+)
 from entry.settings import CONFIG
 from group.models import Group
+from job.models import Job
 from role.models import Role
 from user.models import User
 
@@ -757,6 +770,157 @@ class ModelTest(AironeTestCase):
         self.assertEqual([x["curr"]["value"] for x in history], ["value-0"])
         self.assertEqual([x["prev"] for x in history], [None])
 
+    def test_get_value_history_with_keyset_pagination(self):
+        user = User.objects.create(username="user")
+        entity = self.create_entity(
+            self._user, "Entity", [{"name": "attr1"}, {"name": "attr2"}, {"name": "private"}]
+        )
+        entity.attrs.filter(name="private").update(is_public=False)
+        entry = self.add_entry(self._user, "entry", entity)
+        for index in range(20):
+            for attr_name in ["attr1", "attr2", "private"]:
+                attr = entry.attrs.get(schema__name=attr_name)
+                attr.add_value(self._user, "%s-%d" % (attr_name, index))
+
+        # checks values of the Attribute which user doesn't have permission are not returned
+        history = entry.get_value_history(user, count=40)
+        self.assertEqual(len(history), 40)
+        self.assertEqual(
+            [x["curr"]["value"] for x in history[:4]],
+            ["attr2-19", "attr1-19", "attr2-18", "attr1-18"],
+        )
+        self.assertEqual(
+            [x["prev"]["value"] if x["prev"] else None for x in history[:2] + history[-2:]],
+            ["attr2-18", "attr1-18", None, None],
+        )
+
+        # checks the result of keyset pagination is same with the one of index
+        for index in [0, 10, 30]:
+            page = entry.get_value_history(user, count=10, index=index)
+            self.assertEqual(page, history[index : index + 10])
+
+            if index:
+                self.assertEqual(
+                    entry.get_value_history(
+                        user, count=10, before_attrv_id=history[index - 1]["curr"]["attrv_id"]
+                    ),
+                    page,
+                )
+
+        # checks the number of queries doesn't depend on the length of history
+        with CaptureQueriesContext(connection) as ctx_head:
+            entry.get_value_history(user, count=2)
+        with CaptureQueriesContext(connection) as ctx_tail:
+            entry.get_value_history(user, count=2, before_attrv_id=history[20]["curr"]["attrv_id"])
+        self.assertLessEqual(len(ctx_tail.captured_queries), len(ctx_head.captured_queries) + 2)
+
+    def test_get_value_history_with_archived_values(self):
+        entity = self.create_entity(
+            self._user,
+            "Entity",
+            [{"name": "str"}, {"name": "arr", "type": AttrTypeValue["array_string"]}],
+        )
+        entry = self.add_entry(self._user, "entry", entity)
+        AttributeValue.objects.filter(parent_attr__parent_entry=entry).update(
+            created_time=timezone.now() - timedelta(days=20)
+        )
+        for (index, attr_name, value) in [
+            (0, "str", "foo"),
+            (1, "arr", ["a", "b"]),
+            (2, "str", "bar"),
+            (3, "arr", ["c"]),
+            (4, "str", "baz"),
+        ]:
+            attrv = entry.attrs.get(schema__name=attr_name).add_value(self._user, value)
+
+            # This makes values to be created at different time from older ones
+            AttributeValue.objects.filter(Q(id=attrv.id) | Q(parent_attrv=attrv)).update(
+                created_time=timezone.now() - timedelta(days=(10 - index))
+            )
+
+        history = entry.get_value_history(self._user, count=10)
+        self.assertEqual(
+            [x["curr"]["value"] for x in history], ["baz", ["c"], "bar", ["a", "b"], "foo", []]
+        )
+
+        # checks only superseded values older than expired time are archived with children
+        self.assertEqual(ArchivedAttributeValue.archive(timezone.now() - timedelta(days=8.5)), 3)
+        self.assertEqual(
+            sorted(
+                [x.get_value() for x in ArchivedAttributeValue.objects.filter(parent_attrv=None)],
+                key=str,
+            ),
+            [["a", "b"], [], "foo"],
+        )
+        self.assertEqual(ArchivedAttributeValue.objects.count(), 5)
+        self.assertFalse(AttributeValue.objects.filter(id=history[3]["curr"]["attrv_id"]).exists())
+        self.assertIsInstance(
+            AttributeValue.get_with_archived(history[3]["curr"]["attrv_id"]),
+            ArchivedAttributeValue,
+        )
+
+        # checks history is same with the one before archiving
+        self.assertEqual(entry.get_value_history(self._user, count=10), history)
+
+        # checks the latest values are never archived
+        self.assertEqual(ArchivedAttributeValue.archive(timezone.now()), 1)
+        self.assertEqual(entry.attrs.get(schema__name="str").get_latest_value().value, "baz")
+        self.assertEqual(entry.attrs.get(schema__name="arr").get_latest_value().get_value(), ["c"])
+
+    def test_query_plans_use_indexes(self):
+        entity = self.create_entity(
+            self._user,
+            "Entity",
+            [
+                {"name": "str"},
+                {"name": "arr", "type": AttrTypeValue["array_object"], "ref": self._entity},
+            ],
+        )
+        for index in range(50):
+            entry = self.add_entry(self._user, "e-%d" % index, entity)
+            for attr_name, value in [("str", "foo"), ("arr", [self._entry]), ("str", "bar")]:
+                entry.attrs.get(schema__name=attr_name).add_value(self._user, value)
+
+        attr = entry.attrs.get(schema__name="str")
+        latest_arr_value = entry.attrs.get(schema__name="arr").get_latest_value()
+        for (queryset, index_name) in [
+            (
+                AttributeValue.objects.filter(parent_attr=attr, is_latest=True),
+                "attrv_parent_attr_latest",
+            ),
+            (
+                AttributeValue.objects.filter(referral=self._entry, is_latest=False),
+                "attrv_referral_latest",
+            ),
+            (
+                AttributeValue.objects.filter(parent_attrv=latest_arr_value, is_latest=False),
+                "attrv_parent_attrv_latest",
+            ),
+            (
+                Attribute.objects.filter(parent_entry=entry, schema=attr.schema),
+                "attr_parent_entry_schema",
+            ),
+            (ACLBase.objects.filter(name="e-0", is_active=True), "aclbase_name_active"),
+        ]:
+            # This checks the index is actually chosen for the table of the query. The "key"
+            # field of EXPLAIN has it, unlike "possible_keys" which has every usable one.
+            used_keys = self._get_used_keys(json.loads(queryset.explain(format="json")))
+            self.assertEqual(used_keys.get(queryset.model._meta.db_table), index_name)
+
+    def _get_used_keys(self, plan):
+        """This returns a dict of table name and the index used for it in the EXPLAIN plan"""
+        used_keys = {}
+        if isinstance(plan, dict):
+            if "table_name" in plan:
+                used_keys[plan["table_name"]] = plan.get("key")
+            plan = list(plan.values())
+
+        if isinstance(plan, list):
+            for item in plan:
+                used_keys.update(self._get_used_keys(item))
+
+        return used_keys
+
     def test_delete_entry(self):
         entity = Entity.objects.create(name="ReferredEntity", created_user=self._user)
         entry = Entry.objects.create(name="entry", created_user=self._user, schema=entity)
@@ -1059,6 +1223,45 @@ class ModelTest(AironeTestCase):
                 self.assertEqual(co_attrv.parent_attr, cloned_attr)
                 self.assertEqual(co_attrv.parent_attrv, cloned_attrv)
 
+    def test_clone_entry_with_constant_queries(self):
+        entity = self.create_entity(
+            self._user,
+            "Entity",
+            [
+                {"name": "str", "type": AttrTypeValue["string"]},
+                {"name": "arr", "type": AttrTypeValue["array_string"]},
+            ],
+        )
+
+        def _prepare_clone(count):
+            entry = self.add_entry(
+                self._user,
+                "entry-%d" % count,
+                entity,
+                values={"str": "foo", "arr": ["value-%d" % i for i in range(count)]},
+            )
+            return lambda: entry.clone(self._user, name="cloned-%d" % count)
+
+        # checks the number of queries doesn't depend on the length of array values
+        [_, cloned_entry] = self.assertConstantQueries(_prepare_clone, [1, 20])
+
+        # checks values and relations of them are cloned
+        self.assertEqual(
+            cloned_entry.get_attrv("str").parent_attr, cloned_entry.attrs.get(schema__name="str")
+        )
+        self.assertEqual(cloned_entry.get_attrv("str").value, "foo")
+
+        cloned_attr = cloned_entry.attrs.get(schema__name="arr")
+        cloned_attrv = cloned_attr.get_latest_value()
+        self.assertEqual(cloned_attr.latest_value, cloned_attrv)
+        self.assertEqual(list(cloned_attr.values.all()), [cloned_attrv])
+        self.assertEqual(
+            [x.value for x in cloned_attrv.data_array.all()], ["value-%d" % i for i in range(20)]
+        )
+        for co_attrv in cloned_attrv.data_array.all():
+            self.assertEqual(co_attrv.parent_attr, cloned_attr)
+            self.assertEqual(co_attrv.parent_attrv, cloned_attrv)
+
     def test_clone_entry_with_non_permitted_attributes(self):
         # set EntityAttr attr3 is not public
         attr_infos = [
@@ -1451,6 +1654,52 @@ class ModelTest(AironeTestCase):
             elif attr["name"] == "arr_name":
                 self.assertEqual(attr["last_value"], [{"value": "hoge"}])
 
+    def test_get_available_attrs_with_constant_queries(self):
+        user = User.objects.create(username="hoge")
+        entity = self.create_entity(
+            user,
+            "Entity",
+            [
+                {"name": "group", "type": AttrTypeValue["group"]},
+                {"name": "arr_group", "type": AttrTypeValue["array_group"]},
+                {"name": "role", "type": AttrTypeValue["role"]},
+                {"name": "arr_role", "type": AttrTypeValue["array_role"]},
+            ],
+        )
+        groups = [Group.objects.create(name="group-%d" % i) for i in range(10)]
+        roles = [Role.objects.create(name="role-%d" % i) for i in range(10)]
+
+        def _prepare_available_attrs(count):
+            entry = self.add_entry(
+                user,
+                "entry-%d" % count,
+                entity,
+                values={
+                    "group": groups[0],
+                    "arr_group": groups[:count],
+                    "role": roles[0],
+                    "arr_role": roles[:count],
+                },
+            )
+            return lambda: {x["name"]: x["last_value"] for x in entry.get_available_attrs(user)}
+
+        # checks the number of queries doesn't depend on the length of array values
+        [values_small, values_large] = self.assertConstantQueries(_prepare_available_attrs, [1, 10])
+
+        self.assertEqual(values_large["group"], groups[0])
+        self.assertEqual(values_large["arr_group"], groups)
+        self.assertEqual(values_large["role"], roles[0])
+        self.assertEqual(values_large["arr_role"], roles)
+        self.assertEqual(values_small["arr_group"], groups[:1])
+
+        # inactive groups and roles are not returned
+        groups[1].delete()
+        roles[1].delete()
+        entry = Entry.objects.get(name="entry-10")
+        values = {x["name"]: x["last_value"] for x in entry.get_available_attrs(user)}
+        self.assertEqual(values["arr_group"], [groups[0]] + groups[2:])
+        self.assertEqual(values["arr_role"], [roles[0]] + roles[2:])
+
     def test_get_value_of_attrv(self):
         user = User.objects.create(username="hoge")
 
@@ -2558,6 +2807,104 @@ class ModelTest(AironeTestCase):
         res = self._es.get(index=settings.ES_CONFIG["INDEX"], doc_type="entry", id=entry.id)
         self.assertEqual(res["_source"]["attr"][0]["value"], "fuga")
 
+    def test_register_es_in_bulk(self):
+        user = User.objects.create(username="hoge")
+
+        entity = self.create_entity(user, "entity", [{"name": "attr"}])
+        entries = []
+        for index in range(5):
+            entry = Entry.objects.create(name="e-%d" % index, schema=entity, created_user=user)
+            entry.complement_attrs(user)
+            entry.attrs.first().add_value(user, "value-%d" % index)
+            entries.append(entry)
+
+        # register documents with small chunk size to send multiple bulk requests
+        (success_count, errors) = Entry.register_es_in_bulk(
+            Entry.objects.filter(schema=entity), chunk_size=2
+        )
+        self.assertEqual(success_count, 5)
+        self.assertEqual(errors, [])
+
+        # checks all documents are registered as same as register_es() does
+        for (index, entry) in enumerate(entries):
+            res = self._es.get(index=settings.ES_CONFIG["INDEX"], doc_type="entry", id=entry.id)
+            self.assertEqual(res["_source"]["name"], entry.name)
+            self.assertEqual(res["_source"]["attr"][0]["value"], "value-%d" % index)
+
+        ret = Entry.search_entries(user, [entity.id], [{"name": "attr"}])
+        self.assertEqual(ret["ret_count"], 5)
+
+    def test_get_es_documents(self):
+        user = User.objects.create(username="hoge")
+        ref_entity = self.create_entity(user, "ref_entity")
+        ref_entry = self.add_entry(user, "ref", ref_entity)
+        group = Group.objects.create(name="group")
+        role = Role.objects.create(name="role")
+
+        entity = self.create_entity(
+            user,
+            "entity",
+            [
+                dict(x, ref=ref_entity) if x["type"] & AttrTypeValue["object"] else x
+                for x in self.ALL_TYPED_ATTR_PARAMS_FOR_CREATING_ENTITY
+            ],
+        )
+
+        def _create_entries(count):
+            return [
+                self.add_entry(
+                    user,
+                    "e-%d" % index,
+                    entity,
+                    values={
+                        "val": "hoge",
+                        "vals": ["foo", "bar"],
+                        "ref": ref_entry,
+                        "refs": [ref_entry],
+                        "name": {"name": "hoge", "id": ref_entry},
+                        "names": [{"name": "foo", "id": ref_entry}],
+                        "group": group,
+                        "groups": [group],
+                        "bool": True,
+                        "text": "fuga",
+                        "date": date(2018, 12, 31),
+                        "role": role,
+                        "roles": [role],
+                    },
+                )
+                for index in range(count)
+            ]
+
+        entries = _create_entries(1)
+        with CaptureQueriesContext(connection) as ctx_single:
+            documents = Entry.get_es_documents([x.id for x in entries])
+
+        # checks returned document has values of all attributes
+        attrinfo = {x["name"]: x for x in documents[entries[0].id]["attr"]}
+        self.assertEqual(attrinfo["val"]["value"], "hoge")
+        self.assertEqual(
+            sorted([x["value"] for x in documents[entries[0].id]["attr"] if x["name"] == "vals"]),
+            ["bar", "foo"],
+        )
+        self.assertEqual(attrinfo["ref"]["referral_id"], ref_entry.id)
+        self.assertEqual(attrinfo["names"]["key"], "foo")
+        self.assertEqual(attrinfo["group"]["value"], group.name)
+        self.assertEqual(attrinfo["groups"]["referral_id"], group.id)
+        self.assertEqual(attrinfo["role"]["value"], role.name)
+        self.assertEqual(attrinfo["roles"]["referral_id"], role.id)
+        self.assertEqual(attrinfo["bool"]["value"], "True")
+        self.assertEqual(attrinfo["date"]["date_value"], date(2018, 12, 31))
+
+        # checks the number of queries doesn't depend on the number of entries
+        entries += _create_entries(10)
+        with CaptureQueriesContext(connection) as ctx_multiple:
+            documents = Entry.get_es_documents(Entry.objects.filter(schema=entity))
+
+        self.assertEqual(len(documents), 11)
+        self.assertEqual(len(ctx_single.captured_queries), len(ctx_multiple.captured_queries))
+        for entry in entries:
+            self.assertEqual(documents[entry.id], entry.get_es_document())
+
     def test_search_entries_from_elasticsearch(self):
         user = User.objects.create(username="hoge")
 
@@ -2814,6 +3161,91 @@ class ModelTest(AironeTestCase):
         for i in range(6):
             self.assertEqual(resp["ret_values"][i]["entry"]["name"], "AAA%d" % i)
 
+    @mock.patch.object(ESS, "SEARCH_PAGE_SIZE", 2)
+    def test_search_entries_in_pages(self):
+        user = User.objects.create(username="hoge")
+
+        entity = Entity.objects.create(name="EntityA", created_user=user)
+        for i in [3, 0, 4, 1, 2]:
+            Entry.objects.create(name="e-%d" % i, schema=entity, created_user=user).register_es()
+
+        # checks results are read across pages and they are sorted by name
+        resp = Entry.search_entries(user, [entity.id])
+        self.assertEqual(resp["ret_count"], 5)
+        self.assertEqual(
+            [x["entry"]["name"] for x in resp["ret_values"]], ["e-0", "e-1", "e-2", "e-3", "e-4"]
+        )
+
+        # checks ret_count is the number of all results even though it's limited
+        resp = Entry.search_entries(user, [entity.id], limit=3)
+        self.assertEqual(resp["ret_count"], 5)
+        self.assertEqual([x["entry"]["name"] for x in resp["ret_values"]], ["e-0", "e-1", "e-2"])
+
+        # checks iterate_search_entries yields all results lazily
+        results = Entry.iterate_search_entries(user, [entity.id])
+        self.assertEqual(next(results)["entry"]["name"], "e-0")
+        self.assertEqual([x["entry"]["name"] for x in results], ["e-1", "e-2", "e-3", "e-4"])
+
+    def test_search_entries_with_multiple_entities(self):
+        user = User.objects.create(username="hoge")
+
+        entities = [self.create_entity(user, "Entity%d" % x, [{"name": "attr"}]) for x in range(2)]
+        for index in range(6):
+            self.add_entry(user, "e-%d" % index, entities[index % 2], values={"attr": "value"})
+
+        msearch = ESS.msearch
+        with mock.patch.object(ESS, "msearch", autospec=True, side_effect=msearch) as mock_msearch:
+            with mock.patch.object(ESS, "search", autospec=True) as mock_search:
+                ret = Entry.search_entries(user, [x.id for x in entities], [{"name": "attr"}], 4)
+
+        # checks all Entities are searched through one request
+        self.assertEqual(mock_msearch.call_count, 1)
+        self.assertFalse(mock_search.called)
+
+        # checks results are merged in the order of name
+        self.assertEqual(ret["ret_count"], 6)
+        self.assertEqual(
+            [(x["entry"]["name"], x["entity"]["name"]) for x in ret["ret_values"]],
+            [("e-0", "Entity0"), ("e-1", "Entity1"), ("e-2", "Entity0"), ("e-3", "Entity1")],
+        )
+        self.assertTrue(all([x["attrs"]["attr"]["value"] == "value" for x in ret["ret_values"]]))
+
+    def test_search_entries_with_constant_queries(self):
+        user = User.objects.create(username="hoge")
+        role = Role.objects.create(name="role")
+        role.users.add(user)
+        ref_entity = self.create_entity(
+            user, "RefEntity", [{"name": "ref", "type": AttrTypeValue["object"]}]
+        )
+
+        def _prepare_search(count):
+            name = "E%d" % count
+            entity = self.create_entity(
+                user, name, [{"name": "attr", "type": AttrTypeValue["string"]}]
+            )
+            for index in range(count):
+                entry = self.add_entry(user, "e-%d" % index, entity, values={"attr": "value"})
+                self.add_entry(user, "ref-%s-%d" % (name, index), ref_entity, {"ref": entry})
+
+                # make permissions of Entry and Attribute to be checked in the searching
+                for aclobj in [entry, entry.attrs.get(schema__name="attr")]:
+                    aclobj.is_public = False
+                    aclobj.save()
+                    role.permissions.add(aclobj.readable)
+                entry.register_es()
+
+            return lambda: Entry.search_entries(
+                user, [entity.id], [{"name": "attr"}], hint_referral=""
+            )
+
+        # checks the number of queries doesn't depend on the number of results
+        for ret in self.assertConstantQueries(_prepare_search, [1, 10]):
+            self.assertTrue(all([x["is_readble"] for x in ret["ret_values"]]))
+            self.assertTrue(
+                all([x["attrs"]["attr"]["value"] == "value" for x in ret["ret_values"]])
+            )
+            self.assertTrue(all([len(x["referrals"]) == 1 for x in ret["ret_values"]]))
+
     def test_search_entries_with_date(self):
         user = User.objects.create(username="hoge")
 
@@ -2917,6 +3349,35 @@ class ModelTest(AironeTestCase):
         self.assertEqual(attrv, attr.get_latest_value())
         self.assertEqual(attr.values.count(), 1)
 
+    def test_latest_value_pointer(self):
+        user = User.objects.create(username="hoge")
+        entity = self.create_entity(user, "entity", [{"name": "attr"}])
+        entry = self.add_entry(user, "entry", entity, values={"attr": "foo"})
+
+        attr = entry.attrs.get(schema__name="attr")
+        self.assertEqual(attr.latest_value.value, "foo")
+
+        # checks the latest value is read with one query
+        attrv = attr.add_value(user, "bar")
+        self.assertEqual(attr.latest_value, attrv)
+        self.assertEqual(list(attr.values.filter(is_latest=True)), [attrv])
+        with self.assertNumQueries(1):
+            self.assertEqual(attr.get_latest_value(), attrv)
+
+        # checks the value is read from database even if it's updated through another instance
+        attrv = Attribute.objects.get(id=attr.id).add_value(user, "baz")
+        self.assertEqual(attr.get_latest_value(), attrv)
+
+        # checks is_latest flag that is left by concurrent updates is repaired by the next one
+        attr.values.exclude(id=attrv.id).update(is_latest=True)
+        attrv = attr.add_value(user, "qux")
+        self.assertEqual(list(attr.values.filter(is_latest=True)), [attrv])
+
+        # checks update_latest_value_pointers() sets pointer from is_latest flag
+        Attribute.objects.filter(id=attr.id).update(latest_value=None)
+        Attribute.update_latest_value_pointers()
+        self.assertEqual(Attribute.objects.get(id=attr.id).latest_value, attrv)
+
     def test_get_latest_value_with_readonly(self):
         user = User.objects.create(username="hoge")
         entity = self.create_entity_with_all_type_attributes(user)
@@ -3414,6 +3875,72 @@ class ModelTest(AironeTestCase):
                 [info["value"]],
             )
 
+    def test_to_dict_entry_with_snapshot(self):
+        user = User.objects.create(username="hoge")
+        ref_entity = self.create_entity(user, "RefEntity")
+        ref_entry = self.add_entry(user, "r0", ref_entity)
+        entity = self.create_entity(
+            user,
+            "Entity",
+            [
+                {"name": "str"},
+                {"name": "date", "type": AttrTypeValue["date"]},
+                {"name": "obj", "type": AttrTypeValue["object"], "ref": ref_entity},
+            ],
+        )
+        entry = self.add_entry(
+            user, "entry", entity, values={"str": "foo", "date": "2018-12-31", "obj": ref_entry}
+        )
+
+        def _get_values(ret_dict):
+            return {x["name"]: x["value"] for x in ret_dict["attrs"]}
+
+        # checks the snapshot is made at registering entry, and values are read from it
+        self.assertTrue(EntrySnapshot.objects.filter(entry=entry).exists())
+        expected_values = {"str": "foo", "date": "2018-12-31", "obj": "r0"}
+        with mock.patch.object(AttributeValue, "get_value") as mock_get_value:
+            self.assertEqual(_get_values(entry.to_dict(user)), expected_values)
+            self.assertEqual(
+                entry.export(user)["attrs"], {"str": "foo", "date": date(2018, 12, 31), "obj": "r0"}
+            )
+            self.assertFalse(mock_get_value.called)
+
+        # checks reading values never writes the snapshot
+        snapshot = EntrySnapshot.objects.get(entry=entry)
+        with mock.patch.object(EntrySnapshot, "save") as mock_save:
+            entry.attrs.get(schema__name="str").add_value(user, "bar")
+
+            # checks the changed value is returned even if the snapshot is outdated
+            self.assertEqual(_get_values(entry.to_dict(user))["str"], "bar")
+            self.assertFalse(mock_save.called)
+        self.assertEqual(EntrySnapshot.objects.get(entry=entry).values, snapshot.values)
+
+        # checks the snapshot is rebuilt when the entry is registered
+        entry.register_es()
+        with mock.patch.object(AttributeValue, "get_value") as mock_get_value:
+            self.assertEqual(_get_values(entry.to_dict(user))["str"], "bar")
+            self.assertFalse(mock_get_value.called)
+
+    def test_to_dict_entry_with_snapshot_after_renaming_referral(self):
+        user = User.objects.create(username="hoge")
+        ref_entity = self.create_entity(user, "RefEntity")
+        ref_entry = self.add_entry(user, "r0", ref_entity)
+        entity = self.create_entity(
+            user, "Entity", [{"name": "obj", "type": AttrTypeValue["object"], "ref": ref_entity}]
+        )
+        entry = self.add_entry(user, "entry", entity, values={"obj": ref_entry})
+        self.assertEqual(entry.to_dict(user)["attrs"][0]["value"], "r0")
+
+        # rename referred entry, which registers referring entries to Elasticsearch
+        ref_entry.name = "r1"
+        ref_entry.save()
+        Job.new_register_referrals(user, ref_entry).run(will_delay=False)
+
+        # checks the snapshot of referring entry is discarded not to return the previous name
+        self.assertFalse(EntrySnapshot.objects.filter(entry=entry).exists())
+        self.assertEqual(entry.to_dict(user)["attrs"][0]["value"], "r1")
+        self.assertEqual(entry.export(user)["attrs"], {"obj": "r1"})
+
     def test_to_dict_entry_with_metainfo_param(self):
         user = User.objects.create(username="hoge")
         test_group = Group.objects.create(name="test-group")
@@ -4144,13 +4671,19 @@ class ModelTest(AironeTestCase):
 
         # param larger than max_result_window
         ret = Entry.search_entries_for_simple("e-", limit=500001)
-        self.assertEqual(ret["ret_count"], 0)
-        self.assertEqual(ret["ret_values"], [])
+        self.assertEqual(ret["ret_count"], 10)
+        self.assertEqual([x["name"] for x in ret["ret_values"]], ["e-%s" % x for x in range(0, 10)])
 
         ret = Entry.search_entries_for_simple("e-", offset=500001)
-        self.assertEqual(ret["ret_count"], 0)
+        self.assertEqual(ret["ret_count"], 10)
         self.assertEqual(ret["ret_values"], [])
 
+        # results beyond max_result_window are read page by page
+        with mock.patch.object(ESS, "SEARCH_PAGE_SIZE", 3):
+            ret = Entry.search_entries_for_simple("e-", limit=500000, offset=4)
+        self.assertEqual(ret["ret_count"], 10)
+        self.assertEqual([x["name"] for x in ret["ret_values"]], ["e-%s" % x for x in range(4, 10)])
+
     def test_get_es_document(self):
         user = User.objects.create(username="hoge")
         test_group = Group.objects.create(name="test-group")
@@ -2927,6 +2927,7 @@ class ViewTest(AironeViewTest):
         self.assertEqual(resp.status_code, 400)
 
     @patch("entry.tasks.copy_entry.delay", Mock(side_effect=tasks.copy_entry))
+    @patch("entry.tasks.copy_entry_chunk.delay", Mock(side_effect=tasks.copy_entry_chunk))
     def test_post_copy_with_valid_entry(self):
         user = self.admin_login()
 
@@ -751,7 +751,7 @@ def revert_attrv(request, recv_data):
     if not request.user.has_permission(attr, ACLType.Writable):
         return HttpResponse("You don't have permission to update this Attribute", status=400)
 
-    attrv = AttributeValue.objects.filter(id=recv_data["attrv_id"]).first()
+    attrv = AttributeValue.get_with_archived(recv_data["attrv_id"])
     if not attrv or attrv.parent_attr.id != attr.id:
         return HttpResponse("Specified AttributeValue-id is invalid", status=400)
 
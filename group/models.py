@@ -3,7 +3,7 @@ import sys
 from datetime import datetime
 
 from django.contrib.auth.models import Group as DjangoGroup
-from django.db import models
+from django.db import models, transaction
 from django.db.models import Q
 
 from airone.lib.types import AttrTypeValue
@@ -15,6 +15,67 @@ class Group(DjangoGroup):
         "Group", on_delete=models.DO_NOTHING, related_name="subordinates", null=True
     )
 
+    def save(self, *args, **kwargs):
+        # This updates GroupHierarchy before saving changed parent_group, which makes the
+        # handlers of post_save signal (c.f. acl/signals.py) refer to the updated one.
+        update_fields = kwargs.get("update_fields")
+        is_moved = self.pk and (update_fields is None or "parent_group" in update_fields)
+        if is_moved:
+            self.update_hierarchy()
+
+        is_created = not self.pk
+        super(Group, self).save(*args, **kwargs)
+
+        if is_created:
+            self.update_hierarchy()
+
+    def update_hierarchy(self, with_subordinates=True):
+        """This rebuilds GroupHierarchy of this group and its subordinates.
+
+        This refers parent_group of this instance instead of the saved one, and that of the
+        other groups from database. Even when groups are looped, the scan is stopped at the
+        group that has already been appeared.
+        """
+        parent_ids = {self.id: self.parent_group_id}
+
+        def _scan_superior_group_ids(group_id):
+            ancestor_ids = set()
+            while True:
+                if group_id not in parent_ids:
+                    parent_ids[group_id] = (
+                        Group.objects.filter(id=group_id)
+                        .values_list("parent_group", flat=True)
+                        .first()
+                    )
+
+                group_id = parent_ids[group_id]
+                if not group_id or group_id in ancestor_ids:
+                    return ancestor_ids
+
+                ancestor_ids.add(group_id)
+
+        target_ids = set([self.id])
+        if with_subordinates:
+            target_ids |= set(
+                GroupHierarchy.objects.filter(ancestor=self).values_list("descendant", flat=True)
+            )
+
+        with transaction.atomic():
+            GroupHierarchy.objects.filter(descendant__in=target_ids).delete()
+            GroupHierarchy.objects.bulk_create(
+                [
+                    GroupHierarchy(ancestor_id=ancestor_id, descendant_id=target_id)
+                    for target_id in target_ids
+                    for ancestor_id in _scan_superior_group_ids(target_id)
+                ]
+            )
+
+    @classmethod
+    def update_all_hierarchies(kls):
+        # Subordinates are not referred from GroupHierarchy because it might not be built yet
+        for group in kls.objects.all():
+            group.update_hierarchy(with_subordinates=False)
+
     def delete(self):
         """
         Override Model.delete method of Django
@@ -43,12 +104,9 @@ class Group(DjangoGroup):
         if target_obj.is_public:
             return True
 
-        return any(
-            [
-                permission_level.id <= x.get_aclid()
-                for x in self.permissions.all()
-                if target_obj.id == x.get_objid()
-            ]
+        # import acl.models here to prevent circular import
+        return permission_level.id <= importlib.import_module("acl.models").ACLPermission.get_acl(
+            target_obj.id, permission__group=self
         )
 
     def get_referred_entries(self, entity_name=None):
@@ -81,3 +139,19 @@ class Group(DjangoGroup):
                 "parent_attr__parent_entry", flat=True
             )
         )
+
+
+class GroupHierarchy(models.Model):
+    """This is a closure table of Group hierarchy, which has a pair of each group and all its
+    hierarchical superior groups to get them in one query (c.f. User.belonging_groups).
+    """
+
+    ancestor = models.ForeignKey(
+        Group, on_delete=models.CASCADE, related_name="descendant_relations"
+    )
+    descendant = models.ForeignKey(
+        Group, on_delete=models.CASCADE, related_name="ancestor_relations"
+    )
+
+    class Meta:
+        unique_together = ("ancestor", "descendant")
@@ -1,7 +1,7 @@
 from airone.lib.test import AironeTestCase
 from airone.lib.types import AttrTypeValue
 from entry.models import Entry
-from group.models import Group
+from group.models import Group, GroupHierarchy
 from user.models import User
 
 
@@ -54,6 +54,54 @@ class ModelTest(AironeTestCase):
             self.assertFalse(group.is_active)
             self.assertGreater(group.name.find("_deleted_"), 0)
 
+    def test_group_hierarchy(self):
+        def _get_ancestor_names(group):
+            return sorted(
+                [
+                    x.ancestor.name
+                    for x in GroupHierarchy.objects.filter(
+                        descendant=group, ancestor__is_active=True
+                    )
+                ]
+            )
+
+        self.assertEqual(_get_ancestor_names(self.group3), ["group0", "group2"])
+        self.assertEqual(
+            sorted([g.name for g in self.user1.belonging_groups()]), ["group0", "group2", "group3"]
+        )
+
+        # checks hierarchy of subordinates are also updated when parent_group is changed
+        self.group2.parent_group = self.group1
+        self.group2.save()
+        self.assertEqual(_get_ancestor_names(self.group2), ["group0", "group1"])
+        self.assertEqual(_get_ancestor_names(self.group3), ["group0", "group1", "group2"])
+
+        # checks hierarchy is updated when intermediate group is deleted
+        self.group2.delete()
+        self.assertEqual(_get_ancestor_names(self.group3), ["group0", "group1"])
+        self.assertEqual(
+            sorted([g.name for g in self.user1.belonging_groups()]), ["group0", "group1", "group3"]
+        )
+
+        # checks update_all_hierarchies() rebuilds the same hierarchy
+        GroupHierarchy.objects.all().delete()
+        Group.update_all_hierarchies()
+        self.assertEqual(_get_ancestor_names(self.group3), ["group0", "group1"])
+
+    def test_belonging_groups_with_constant_queries(self):
+        groups = [self.group3]
+        for index in range(10):
+            groups.append(self._create_group("subordinate%d" % index, groups[-1]))
+
+        user = self._create_user("user2")
+        user.groups.add(groups[1])
+        with self.assertNumQueries(1):
+            self.assertEqual(len(user.belonging_groups()), 4)
+
+        user.groups.set([groups[-1]])
+        with self.assertNumQueries(1):
+            self.assertEqual(len(user.belonging_groups()), 13)
+
     def test_get_referred_entries_through_group_attr(self):
         for index in range(3):
             entity = self.create_entity(
@@ -1,12 +1,16 @@
+import gzip
 import json
+import os
 import pickle
 import time
+from contextlib import contextmanager
 from datetime import date, datetime, timedelta
 from enum import Enum
 from importlib import import_module
 
 import pytz
 from django.conf import settings
+from django.core.cache import cache
 from django.db import models
 
 from acl.models import ACLBase
@@ -60,6 +64,9 @@ class Job(models.Model):
     # This value could be overwrite by settings
     DEFAULT_JOB_TIMEOUT = 86400
 
+    # This is the time (monotonic seconds) that status was synced for is_canceled()
+    _status_synced_at = None
+
     # This caches each task module to be able to call them from Job instance
     _TASK_MODULE = {}
 
@@ -81,6 +88,15 @@ class Job(models.Model):
         "WARNING": 7,
     }
 
+    # This value indicates that there is no more processing for a job
+    FINISHED_STATUSES = [
+        STATUS["DONE"],
+        STATUS["ERROR"],
+        STATUS["TIMEOUT"],
+        STATUS["CANCELED"],
+        STATUS["WARNING"],
+    ]
+
     # In some jobs sholdn't make user aware of existence because of user experience
     # (e.g. re-registrating elasticsearch data of entries which refer to changed name entry).
     # These are the jobs that should be proceeded transparently.
@@ -129,53 +145,104 @@ class Job(models.Model):
     # When this has another job, this job have to wait until it would be finished.
     dependent_job = models.ForeignKey("Job", null=True, on_delete=models.SET_NULL)
 
+    # This indicates that this job is parked until dependent_job would be finished.
+    # The parked job is sent to run again by release_waiting_jobs() of the dependent job.
+    is_waiting = models.BooleanField(default=False)
+
     def may_schedule(self):
         # Operations that can run in parallel exclude checking for dependent jobs
         if self.operation in self.PARALLELIZABLE_OPERATIONS:
             return False
 
-        # When there is dependent job, this re-send a request to run same job
+        # When there is dependent job, this parks this job instead of re-sending a request
+        # to run same job. It will be sent again when the dependent job is finished.
         if self.dependent_job and not self.dependent_job.is_finished():
-            # This delay is needed to prevent sending excessive message to MQ
-            # when there are many dependent jobs.
-            time.sleep(JOB_CONFIG.RESCHEDULING_DELAY_SECONDS)
+            self.is_waiting = True
+            self.save(update_fields=["is_waiting"])
 
-            # This sends request to reschedule this job.
-            self.run()
+            # This checks dependent job again not to miss its finishing between checking
+            # its status and parking this job. When it has already been finished, this job
+            # can proceed unless release_waiting_jobs() has taken over running this job.
+            if self.dependent_job.is_finished() and self._unpark():
+                return False
 
             return True
         else:
             return False
 
+    def _unpark(self):
+        # This clears is_waiting flag atomically, so only one of the callers can proceed
+        # the parked job even when some processes try to release it at the same time.
+        return Job.objects.filter(id=self.id, is_waiting=True).update(is_waiting=False) > 0
+
+    def release_waiting_jobs(self):
+        """This sends the jobs which are parked until this job is finished to run again"""
+        for job in Job.objects.filter(dependent_job=self, is_waiting=True):
+            if job._unpark():
+                job.run()
+
+    @classmethod
+    def release_all_waiting_jobs(kls, target=None):
+        """This releases parked jobs whose dependent job has already been finished.
+
+        The waiting jobs are usually released when the dependent job updates its status.
+        But this is necessary for the ones that lost it (e.g. it was timed out or its worker
+        was killed). This is called for the target whenever a new job is created for it.
+        """
+        query = {"is_waiting": True}
+        if target:
+            query["target"] = target
+
+        for job in kls.objects.filter(**query).select_related("dependent_job"):
+            if (not job.dependent_job or job.dependent_job.is_finished()) and job._unpark():
+                job.run()
+
     def is_timeout(self):
         # Sync updated_at time information with the data which is stored in database
         self.refresh_from_db(fields=["updated_at"])
 
+        return self._is_expired()
+
+    def _is_expired(self):
         task_expiry = self.updated_at + timedelta(seconds=self._get_job_timeout())
 
         return datetime.now(pytz.timezone(settings.TIME_ZONE)) > task_expiry
 
     def is_finished(self):
-        # Sync status flag information with the data which is stored in database
-        self.refresh_from_db(fields=["status"])
+        # Sync status and updated_at information with the data which is stored in database
+        self.refresh_from_db(fields=["status", "updated_at"])
 
-        # This value indicates that there is no more processing for a job
-        finished_status = [
-            Job.STATUS["DONE"],
-            Job.STATUS["ERROR"],
-            Job.STATUS["TIMEOUT"],
-            Job.STATUS["CANCELED"],
-            Job.STATUS["WARNING"],
-        ]
-
-        return self.status in finished_status or self.is_timeout()
+        return self.status in self.FINISHED_STATUSES or self._is_expired()
 
     def is_canceled(self):
-        # Sync status flag information with the data which is stored in database
-        self.refresh_from_db(fields=["status"])
+        """This checks whether this job is canceled at low cost.
+
+        This is called repeatedly in the loop of long-running tasks. So this refers the
+        status that is shared through cache instead of database, and the result is reused
+        for STATUS_CHECK_INTERVAL_SECONDS in this instance.
+        """
+        if (
+            self._status_synced_at is None
+            or time.monotonic() - self._status_synced_at >= JOB_CONFIG.STATUS_CHECK_INTERVAL_SECONDS
+        ):
+            status = cache.get(self._get_status_cache_key())
+            if status is None:
+                # Sync status flag information with the data which is stored in database
+                self.refresh_from_db(fields=["status"])
+                self._set_status_cache()
+            else:
+                self.status = status
+
+            self._status_synced_at = time.monotonic()
 
         return self.status == Job.STATUS["CANCELED"]
 
+    def _get_status_cache_key(self):
+        return "job_status_%s" % self.id
+
+    def _set_status_cache(self):
+        cache.set(self._get_status_cache_key(), self.status, self._get_job_timeout())
+
     def proceed_if_ready(self):
         # In this case, job is finished (might be canceled or proceeded same job by other process)
         if self.is_finished() or self.status == Job.STATUS["PROCESSING"]:
@@ -208,6 +275,15 @@ class Job(models.Model):
 
         self.save(update_fields=update_fields)
 
+        # This shares changed status with the other processes that check it via is_canceled()
+        if "status" in update_fields:
+            self._set_status_cache()
+            self._status_synced_at = time.monotonic()
+
+        # This sends the jobs that have been waiting for this job to run
+        if "status" in update_fields and self.status in self.FINISHED_STATUSES:
+            self.release_waiting_jobs()
+
     def to_json(self):
         # For advanced search results export, target is assumed to be empty.
         return {
@@ -252,6 +328,10 @@ class Job(models.Model):
         # set dependent job to prevent running tasks simultaneously which set to target same one.
         dependent_job = None
         if target:
+            # This releases jobs for the target that have been left parked because their
+            # dependent job was finished without releasing them.
+            kls.release_all_waiting_jobs(target=target)
+
             threshold = datetime.now(pytz.timezone(settings.TIME_ZONE)) - timedelta(
                 seconds=kls._get_job_timeout()
             )
@@ -272,7 +352,12 @@ class Job(models.Model):
             "dependent_job": dependent_job,
         }
 
-        return kls.objects.create(**params)
+        job = kls.objects.create(**params)
+
+        # This overwrites the status which might be left in cache with the same job ID
+        job._set_status_cache()
+
+        return job
 
     @classmethod
     def get_task_module(kls, component):
@@ -462,16 +547,76 @@ class Job(models.Model):
             user, target, JobOperation.NOTIFY_DELETE_ENTRY.value, text, params
         )
 
+    def _get_cache_path(self, suffix=".gz"):
+        return "%s/job_%d%s" % (settings.AIRONE["FILE_STORE_PATH"], self.id, suffix)
+
+    @contextmanager
+    def open_cache(self):
+        """This returns a text stream to write the result of this job incrementally.
+
+        Written data is compressed by gzip, and it's made available when the block exits
+        without any error. The result of canceled job is discarded.
+        """
+        tmp_path = self._get_cache_path(".gz.tmp")
+        try:
+            with gzip.open(tmp_path, "wt", encoding="utf-8", newline="") as fp:
+                yield fp
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+        if self.is_canceled():
+            os.remove(tmp_path)
+        else:
+            os.replace(tmp_path, self._get_cache_path())
+
     def set_cache(self, value):
-        with open("%s/job_%d" % (settings.AIRONE["FILE_STORE_PATH"], self.id), "wb") as fp:
-            pickle.dump(value, fp)
+        with self.open_cache() as fp:
+            fp.write(value)
+
+    def iterate_cache(self, chunk_size=None):
+        """This returns an iterator of the result of this job which is read chunk by chunk.
+
+        This raises OSError (FileNotFoundError) immediately when the result doesn't exist.
+        """
+        # This is for the result that was stored by pickle before it was compressed
+        legacy_path = self._get_cache_path("")
+        if not os.path.exists(self._get_cache_path()) and os.path.exists(legacy_path):
+            with open(legacy_path, "rb") as fp:
+                return iter([pickle.load(fp)])
+
+        fp = gzip.open(self._get_cache_path(), "rt", encoding="utf-8", newline="")
+
+        def _iterate():
+            with fp:
+                while True:
+                    chunk = fp.read(chunk_size or JOB_CONFIG.CACHE_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    yield chunk
+
+        return _iterate()
 
     def get_cache(self):
-        value = ""
-        with open("%s/job_%d" % (settings.AIRONE["FILE_STORE_PATH"], self.id), "rb") as fp:
-            value = pickle.load(fp)
+        return "".join(self.iterate_cache())
 
-        return value
+    @classmethod
+    def clean_caches(kls, expiration_seconds=None):
+        """This removes results of jobs that were stored before expiration_seconds ago"""
+        threshold = time.time() - (expiration_seconds or JOB_CONFIG.CACHE_EXPIRATION_SECONDS)
+
+        removed_count = 0
+        with os.scandir(settings.AIRONE["FILE_STORE_PATH"]) as it:
+            for entry in it:
+                if (
+                    entry.name.startswith("job_")
+                    and entry.is_file()
+                    and entry.stat().st_mtime < threshold
+                ):
+                    os.remove(entry.path)
+                    removed_count += 1
+
+        return removed_count
 
     @classmethod
     def _get_job_timeout(kls):
@@ -5,6 +5,8 @@ CONFIG = Settings(
         "MAX_LIST_VIEW": 50,
         "MAX_LIST_NAV": 10,
         "RECENT_SECONDS": 3600,
-        "RESCHEDULING_DELAY_SECONDS": 1,
+        "STATUS_CHECK_INTERVAL_SECONDS": 1,
+        "CACHE_CHUNK_SIZE": 65536,
+        "CACHE_EXPIRATION_SECONDS": 604800,
     }
 )
@@ -1,4 +1,6 @@
 import json
+import os
+import time
 
 import mock
 from django.conf import settings
@@ -8,6 +10,7 @@ from airone.lib.test import AironeTestCase
 from entity.models import Entity
 from entry.models import Entry
 from job.models import Job, JobOperation
+from job.settings import CONFIG as JOB_CONFIG
 from user.models import User
 
 
@@ -75,6 +78,44 @@ class ModelTest(AironeTestCase):
             job.set_cache(json.dumps(value))
             self.assertEqual(job.get_cache(), json.dumps(value))
 
+    def test_cache_written_incrementally(self):
+        job = Job.new_export(self.guest, text="hoge")
+
+        with job.open_cache() as fp:
+            for i in range(3):
+                fp.write("line-%d\r\n" % i)
+
+            # the result isn't available until it's completely written
+            with self.assertRaises(FileNotFoundError):
+                job.get_cache()
+
+        self.assertEqual(
+            list(job.iterate_cache(chunk_size=8)), ["line-0\r\n", "line-1\r\n", "line-2\r\n"]
+        )
+
+        # the result of canceled job is discarded
+        job = Job.new_export(self.guest, text="hoge")
+        with job.open_cache() as fp:
+            fp.write("partial")
+            job.update(Job.STATUS["CANCELED"])
+
+        with self.assertRaises(FileNotFoundError):
+            job.iterate_cache()
+
+    def test_clean_caches(self):
+        [job1, job2] = [Job.new_export(self.guest, text="hoge") for _ in range(2)]
+        job1.set_cache("foo")
+        job2.set_cache("bar")
+
+        # makes the result of job1 be expired
+        expired_time = time.time() - JOB_CONFIG.CACHE_EXPIRATION_SECONDS - 1
+        os.utime(job1._get_cache_path(), (expired_time, expired_time))
+
+        self.assertEqual(Job.clean_caches(), 1)
+        with self.assertRaises(FileNotFoundError):
+            job1.get_cache()
+        self.assertEqual(job2.get_cache(), "bar")
+
     def test_dependent_job(self):
         (job1, job2) = [Job.new_edit(self.guest, self.entry) for x in range(2)]
         self.assertIsNone(job1.dependent_job)
@@ -126,6 +167,23 @@ class ModelTest(AironeTestCase):
         # confirms that is_canceled would be true by changing job status parameter
         self.assertTrue(job.is_canceled())
 
+    def test_is_canceled_by_other_process(self):
+        job = Job.new_create(self.guest, self.entry)
+        job_in_task = Job.objects.get(id=job.id)
+
+        with mock.patch("job.models.time.monotonic", return_value=100):
+            with self.assertNumQueries(0):
+                self.assertFalse(job_in_task.is_canceled())
+
+            # cancel request from another process isn't checked until the interval passes
+            Job.objects.get(id=job.id).update(Job.STATUS["CANCELED"])
+            with self.assertNumQueries(0):
+                self.assertFalse(job_in_task.is_canceled())
+
+        with mock.patch("job.models.time.monotonic", return_value=101):
+            with self.assertNumQueries(0):
+                self.assertTrue(job_in_task.is_canceled())
+
     def test_update_method(self):
         job = Job.new_create(self.guest, self.entry, "original text")
         self.assertEqual(job.status, Job.STATUS["PREPARING"])
@@ -202,12 +260,6 @@ class ModelTest(AironeTestCase):
         self.assertTrue(job.proceed_if_ready())
 
     def test_may_schedule(self):
-        # This describes how many times run method of Job called.
-        self.test_data = 0
-
-        def side_effect():
-            self.test_data += 1
-
         [job1, job2] = [Job.new_create(self.guest, self.entry) for _ in range(2)]
 
         # Checks dependent_job parameters of both entries are set properly
@@ -215,20 +267,70 @@ class ModelTest(AironeTestCase):
         self.assertEqual(job2.dependent_job.id, job1.id)
 
         with mock.patch.object(Job, "run") as mock_run:
-            mock_run.side_effect = side_effect
-
-            # job1 doesn't have dependent job and ready to run so this never be rescheduled
+            # job1 doesn't have dependent job and ready to run so this never be parked
             self.assertTrue(job1.proceed_if_ready())
             self.assertFalse(job1.may_schedule())
-            self.assertEqual(self.test_data, 0)
+            self.assertFalse(job1.is_waiting)
 
-            # job2 depends on job1 so this will be rescheduled by calling run method
+            # job2 depends on job1 so this will be parked without sending a request to run
             self.assertTrue(job2.may_schedule())
-            self.assertEqual(self.test_data, 1)
-
-            # This checks proceed_if_ready() method also call rescheduling method
             self.assertFalse(job2.proceed_if_ready())
-            self.assertEqual(self.test_data, 2)
+            self.assertTrue(Job.objects.get(id=job2.id).is_waiting)
+            self.assertFalse(mock_run.called)
+
+            # job2 is sent to run again when job1 is finished
+            job1.update(Job.STATUS["PROCESSING"])
+            self.assertFalse(mock_run.called)
+            job1.update(Job.STATUS["DONE"])
+            self.assertEqual(mock_run.call_count, 1)
+            self.assertFalse(Job.objects.get(id=job2.id).is_waiting)
+
+            # released job isn't sent twice and it's ready to run
+            job1.release_waiting_jobs()
+            self.assertEqual(mock_run.call_count, 1)
+            self.assertTrue(job2.proceed_if_ready())
+
+    def test_may_schedule_when_dependent_job_is_finished_while_parking(self):
+        [job1, job2] = [Job.new_create(self.guest, self.entry) for _ in range(2)]
+
+        # This emulates job1 is finished just after job2 checks its status
+        with mock.patch.object(Job, "run") as mock_run:
+            with mock.patch.object(Job, "is_finished", side_effect=[False, True]):
+                self.assertFalse(job2.may_schedule())
+
+            self.assertFalse(Job.objects.get(id=job2.id).is_waiting)
+            self.assertFalse(mock_run.called)
+
+    def test_release_all_waiting_jobs(self):
+        [job1, job2] = [Job.new_create(self.guest, self.entry) for _ in range(2)]
+        self.assertTrue(job2.may_schedule())
+
+        with mock.patch.object(Job, "run") as mock_run:
+            # parked job is left while the dependent job is running
+            Job.release_all_waiting_jobs()
+            self.assertFalse(mock_run.called)
+
+            # parked job is released when the dependent job is finished without updating status
+            with mock.patch.object(Job, "_is_expired", return_value=True):
+                Job.release_all_waiting_jobs()
+            self.assertEqual(mock_run.call_count, 1)
+            self.assertFalse(Job.objects.get(id=job2.id).is_waiting)
+
+    def test_release_waiting_jobs_when_new_job_is_created(self):
+        [job1, job2] = [Job.new_create(self.guest, self.entry) for _ in range(2)]
+        self.assertTrue(job2.may_schedule())
+
+        with mock.patch.object(Job, "run") as mock_run:
+            # parked job is left while the dependent job is running
+            Job.new_edit(self.guest, self.entry)
+            self.assertFalse(mock_run.called)
+
+            # parked job is released by a new job for the same target when the dependent job
+            # was finished without updating status (e.g. its worker was killed)
+            with mock.patch.object(Job, "_is_expired", return_value=True):
+                Job.new_edit(self.guest, self.entry)
+            self.assertEqual(mock_run.call_count, 1)
+            self.assertFalse(Job.objects.get(id=job2.id).is_waiting)
 
     def test_may_schedule_with_parallelizable_operation(self):
         [job1, job2] = [Job.new_notify_update_entry(self.guest, self.entry) for _ in range(2)]
@@ -204,7 +204,7 @@ class ViewTest(AironeViewTest):
         resp = self.client.get("/job/download/%d" % job.id)
         self.assertEqual(resp.status_code, 200)
         self.assertEqual(resp["Content-Disposition"], 'attachment; filename="hoge"')
-        self.assertEqual(resp.content.decode("utf8"), "abcd")
+        self.assertEqual(b"".join(resp.streaming_content).decode("utf8"), "abcd")
 
     def test_job_download_exported_search_result(self):
         user = self.guest_login()
@@ -217,7 +217,7 @@ class ViewTest(AironeViewTest):
         resp = self.client.get("/job/download/%d" % job.id)
         self.assertEqual(resp.status_code, 200)
         self.assertEqual(resp["Content-Disposition"], 'attachment; filename="hoge"')
-        self.assertEqual(resp.content.decode("utf8"), "abcd")
+        self.assertEqual(b"".join(resp.streaming_content).decode("utf8"), "abcd")
 
     def test_hidden_jobs_is_not_shown(self):
         user = self.guest_login()
@@ -1,12 +1,11 @@
 import errno
-import io
 from datetime import datetime, timezone
 
 from django.db.models import Q
 from django.http import HttpResponse
 
 # libraries of AirOne
-from airone.lib.http import get_download_response, http_get, render
+from airone.lib.http import get_streaming_download_response, http_get, render
 
 # related models in AirOne
 from job.models import Job, JobOperation
@@ -70,13 +69,13 @@ def download(request, job_id):
     if job.operation not in export_operations:
         return HttpResponse("Target Job has no value to return", status=400)
 
-    # get value associated this Job from cache
-    io_stream = io.StringIO()
+    # get value associated this Job from cache, which is sent chunk by chunk
     try:
-        io_stream.write(job.get_cache())
+        iterator = job.iterate_cache()
     except OSError as e:
         # errno.ENOENT is the errno of FileNotFoundError
         if e.errno == errno.ENOENT:
             return HttpResponse("This result is no longer available", status=400)
+        raise
 
-    return get_download_response(io_stream, job.text)
+    return get_streaming_download_response(iterator, job.text)
@@ -76,12 +76,7 @@ class Role(models.Model):
           this method don't care about hieralchical data structure
           (e.g. Entity/Entry, EntityAttr/Attribute).
         """
-        return any(
-            [
-                permission_level.id <= x.get_aclid()
-                for x in self.permissions.filter(codename__startswith=(str(target_obj.id) + "."))
-            ]
-        )
+        return permission_level.id <= self.get_current_permission(target_obj)
 
     def delete(self):
         """
@@ -98,11 +93,10 @@ class Role(models.Model):
             entry.register_es()
 
     def get_current_permission(self, aclbase):
-        permissions = [x for x in self.permissions.all() if x.get_objid() == aclbase.id]
-        if permissions:
-            return permissions[0].get_aclid()
-        else:
-            return 0
+        # import acl.models here to prevent circular import
+        return importlib.import_module("acl.models").ACLPermission.get_acl(
+            aclbase.id, permission__role=self
+        )
 
     def get_referred_entries(self, entity_name=None):
         # make query to identify AttributeValue that specify this Role instance
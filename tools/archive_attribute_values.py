@@ -0,0 +1,52 @@
+import os
+import sys
+from datetime import timedelta
+from optparse import OptionParser
+
+import configurations
+
+# append airone directory to the default path
+sys.path.append("./")
+
+# prepare to load the data models of AirOne
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "airone.settings")
+os.environ.setdefault("DJANGO_CONFIGURATION", "Dev")
+
+# load AirOne application
+configurations.setup()
+
+from django.utils import timezone  # NOQA
+
+from entry.models import ArchivedAttributeValue  # NOQA
+from entry.settings import CONFIG  # NOQA
+
+
+def get_options():
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option(
+        "--days",
+        type=int,
+        dest="days",
+        default=CONFIG.ARCHIVE_VALUE_AGE_DAYS,
+        help="archive superseded values that were created more than this days ago",
+    )
+    parser.add_option(
+        "--chunk-size",
+        type=int,
+        dest="chunk_size",
+        default=1000,
+        help="number of values to archive in one transaction",
+    )
+
+    (option, _) = parser.parse_args()
+
+    return option
+
+
+if __name__ == "__main__":
+    option = get_options()
+
+    count = ArchivedAttributeValue.archive(
+        timezone.now() - timedelta(days=option.days), option.chunk_size
+    )
+    sys.stdout.write("Archived values: %d\n" % count)
@@ -0,0 +1,40 @@
+import os
+import sys
+from optparse import OptionParser
+
+import configurations
+
+# append airone directory to the default path
+sys.path.append("./")
+
+# prepare to load the data models of AirOne
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "airone.settings")
+os.environ.setdefault("DJANGO_CONFIGURATION", "Dev")
+
+# load AirOne application
+configurations.setup()
+
+from job.models import Job  # NOQA
+from job.settings import CONFIG  # NOQA
+
+
+def get_options():
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option(
+        "--seconds",
+        type=int,
+        dest="seconds",
+        default=CONFIG.CACHE_EXPIRATION_SECONDS,
+        help="remove results of jobs that were stored more than this seconds ago",
+    )
+
+    (option, _) = parser.parse_args()
+
+    return option
+
+
+if __name__ == "__main__":
+    option = get_options()
+
+    count = Job.clean_caches(option.seconds)
+    sys.stdout.write("Removed job results: %d\n" % count)
@@ -0,0 +1,25 @@
+import os
+import sys
+
+import configurations
+
+# append airone directory to the default path
+sys.path.append("./")
+
+# prepare to load the data models of AirOne
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "airone.settings")
+os.environ.setdefault("DJANGO_CONFIGURATION", "Dev")
+
+# load AirOne application
+configurations.setup()
+
+from acl.models import ACLPermission, EffectivePermission  # NOQA
+from group.models import Group  # NOQA
+
+if __name__ == "__main__":
+    # This rebuilds ACLPermission, GroupHierarchy and all EffectivePermissions from Roles,
+    # which is needed to be run once for the data that has been registered before they were
+    # introduced. EffectivePermission has to be built at last because it refers others.
+    ACLPermission.register_all()
+    Group.update_all_hierarchies()
+    EffectivePermission.refresh_all()
@@ -16,34 +16,117 @@ os.environ.setdefault("DJANGO_CONFIGURATION", "Dev")
 configurations.setup()
 
 from django.db.models import Q  # NOQA
+from django.utils import timezone  # NOQA
 
 from airone.lib.elasticsearch import ESS  # NOQA
 from entry.models import Entry  # NOQA
 
 ES_INDEX = django.conf.settings.ES_CONFIG["INDEX"]
 
+# This is the default ratio of documents that are allowed to be missing from the rebuilt index.
+# Entries deleted while rebuilding are not registered, and they are synchronized at the next
+# incremental synchronization.
+REINDEX_TOLERANCE = 0.001
 
-def register_entries(es, target_entities=None):
+
+def register_entries(es, target_entities=None, chunk_size=None, max_chunk_bytes=None):
     db_query = Q(is_active=True)
     if target_entities:
         db_query = Q(db_query, Q(schema__name__in=target_entities))
 
-    current_index = 1
-    total_count = Entry.objects.filter(db_query).count()
-    for entry in Entry.objects.filter(db_query):
-        sys.stdout.write("\rRegister entry: (%6d/%6d)" % (current_index, total_count))
+    entries = Entry.objects.filter(db_query)
+    sys.stdout.write("Register entries: %d\n" % entries.count())
+
+    success_count, errors = Entry.register_es_in_bulk(
+        entries, es=es, chunk_size=chunk_size, max_chunk_bytes=max_chunk_bytes
+    )
+    for error in errors:
+        sys.stdout.write("Failed to register entry(%s): %s\n" % (error["id"], error["error"]))
+
+    sys.stdout.write("Registered entries: %d (failed: %d)\n" % (success_count, len(errors)))
+
+    return (success_count, errors)
+
+
+def reindex_entries(es, chunk_size=None, max_chunk_bytes=None, tolerance=REINDEX_TOLERANCE):
+    """This rebuilds all documents without stopping search (blue/green reindex).
+
+    Documents are registered to a new versioned index while the current one keeps
+    answering search requests. Then the alias is switched to the new index only when
+    all entries, which are active at the start, are registered to it except for the
+    tolerance ratio of them. When it fails, the new index is deleted and the current
+    one is left as it is.
+    """
+    # Changes after this time will be synchronized at the next incremental synchronization
+    started_time = timezone.now()
+    expected_count = Entry.objects.filter(is_active=True).count()
 
-        entry.register_es(es, skip_refresh=True)
+    new_index = es.create_versioned_index()
+    new_es = ESS(index=new_index)
 
-        current_index += 1
+    try:
+        (success_count, errors) = register_entries(
+            new_es, chunk_size=chunk_size, max_chunk_bytes=max_chunk_bytes
+        )
 
-    es.indices.refresh(index=ES_INDEX)
+        # validate the new index has documents of the entries which were active at the start
+        registered_count = new_es.count(index=new_index)["count"]
+        if errors or registered_count < expected_count * (1 - tolerance):
+            sys.stdout.write(
+                "Failed to rebuild index %s (registered: %d, expected: %d)\n"
+                % (new_index, registered_count, expected_count)
+            )
+            es.indices.delete(index=new_index, ignore=[404])
+            return False
+
+        new_es.set_sync_watermark(started_time)
+
+    except Exception:
+        # This deletes the new index not to leave it behind at each failed rebuild. It's
+        # not aliased yet, so search requests are never affected.
+        es.indices.delete(index=new_index, ignore=[404])
+        raise
+
+    es.switch_alias(new_index)
+    sys.stdout.write("Switched index %s to %s\n" % (es._index, new_index))
+
+    return True
 
 
 def get_options():
     parser = OptionParser(usage="%prog [options] [target-Entities]")
-
-    return parser.parse_args()
+    parser.add_option(
+        "--chunk-size",
+        type=int,
+        dest="chunk_size",
+        help="number of documents to send at one bulk request",
+    )
+    parser.add_option(
+        "--max-chunk-bytes",
+        type=int,
+        dest="max_chunk_bytes",
+        help="maximum size in bytes of one bulk request",
+    )
+    parser.add_option(
+        "--zero-downtime",
+        action="store_true",
+        dest="zero_downtime",
+        default=False,
+        help="build documents into a new index then switch the alias to it",
+    )
+    parser.add_option(
+        "--tolerance",
+        type=float,
+        dest="tolerance",
+        default=REINDEX_TOLERANCE,
+        help="ratio of documents allowed to be missing with --zero-downtime (default: %default)",
+    )
+
+    (option, entities) = parser.parse_args()
+    if option.zero_downtime and entities:
+        parser.error("target-Entities can't be specified with --zero-downtime option")
+
+    return (option, entities)
 
 
 if __name__ == "__main__":
@@ -51,10 +134,17 @@ if __name__ == "__main__":
 
     es = ESS()
 
-    # clear previous index
-    es.indices.delete(index=ES_INDEX, ignore=[400, 404])
+    if option.zero_downtime:
+        # rebuild all documents while the current index keeps answering search requests
+        if not reindex_entries(es, option.chunk_size, option.max_chunk_bytes, option.tolerance):
+            sys.exit(1)
+
+    else:
+        started_time = timezone.now()
 
-    # create a new index with mapping
-    es.recreate_index()
+        # clear previous index and create a new one with mapping
+        es.recreate_index()
 
-    register_entries(es, entities)
+        (_, errors) = register_entries(es, entities, option.chunk_size, option.max_chunk_bytes)
+        if not entities and not errors:
+            es.set_sync_watermark(started_time)
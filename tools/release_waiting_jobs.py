@@ -0,0 +1,21 @@
+import os
+import sys
+
+import configurations
+
+# append airone directory to the default path
+sys.path.append("./")
+
+# prepare to load the data models of AirOne
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "airone.settings")
+os.environ.setdefault("DJANGO_CONFIGURATION", "Dev")
+
+# load AirOne application
+configurations.setup()
+
+from job.models import Job  # NOQA
+
+if __name__ == "__main__":
+    # This sends the parked jobs to run again when their dependent job has already been
+    # finished without releasing them (e.g. it was timed out or its worker was killed).
+    Job.release_all_waiting_jobs()
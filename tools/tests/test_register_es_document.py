@@ -0,0 +1,93 @@
+from unittest import mock
+
+from airone.lib.test import AironeTestCase
+from airone.lib.types import AttrTypeValue
+from entry.models import Entry
+from tools import register_es_document
+from tools.register_es_document import reindex_entries
+from user.models import User
+
+
+class RegisterESDocumentTest(AironeTestCase):
+    def setUp(self):
+        super(RegisterESDocumentTest, self).setUp()
+
+        self.user = User.objects.create(username="test")
+        self.entity = self.create_entity(
+            self.user, "Entity", [{"name": "attr", "type": AttrTypeValue["string"]}]
+        )
+        self.entries = [
+            self.add_entry(self.user, "entry-%d" % i, self.entity, values={"attr": "value-%d" % i})
+            for i in range(3)
+        ]
+
+    def test_reindex_entries_with_alias_swap(self):
+        self.assertEqual(self._es.get_aliased_indices(), [])
+
+        self.assertTrue(reindex_entries(self._es))
+
+        # checks the alias points to the new versioned index and it's searchable
+        indices = self._es.get_aliased_indices()
+        self.assertEqual(len(indices), 1)
+        self.assertTrue(indices[0].startswith(self._es._index + "_v"))
+
+        ret = Entry.search_entries(self.user, [self.entity.id], [{"name": "attr"}])
+        self.assertEqual(ret["ret_count"], 3)
+
+        # checks the previous versioned index is deleted at the next reindex
+        self.assertTrue(reindex_entries(self._es))
+        new_indices = self._es.get_aliased_indices()
+        self.assertEqual(len(new_indices), 1)
+        self.assertNotEqual(new_indices, indices)
+        self.assertFalse(self._es.indices.exists(index=indices[0]))
+
+        ret = Entry.search_entries(self.user, [self.entity.id], [{"name": "attr"}])
+        self.assertEqual(ret["ret_count"], 3)
+
+    @mock.patch("tools.register_es_document.register_entries")
+    def test_reindex_entries_with_failure(self, mock_register_entries):
+        mock_register_entries.return_value = (0, [{"id": 1, "status": 500, "error": "error"}])
+
+        self.assertFalse(reindex_entries(self._es))
+
+        # checks the new index is deleted and the current index is left as it is
+        self.assertEqual(self._es.get_aliased_indices(), [])
+        self.assertEqual(self._es.indices.get(index=self._es._index + "_v*"), {})
+
+        ret = Entry.search_entries(self.user, [self.entity.id], [{"name": "attr"}])
+        self.assertEqual(ret["ret_count"], 3)
+
+    @mock.patch("tools.register_es_document.register_entries")
+    def test_reindex_entries_with_exception(self, mock_register_entries):
+        mock_register_entries.side_effect = RuntimeError("connection error")
+
+        with self.assertRaises(RuntimeError):
+            reindex_entries(self._es)
+
+        # checks the new index is deleted and the current index is left as it is
+        self.assertEqual(self._es.get_aliased_indices(), [])
+        self.assertEqual(self._es.indices.get(index=self._es._index + "_v*"), {})
+
+        ret = Entry.search_entries(self.user, [self.entity.id], [{"name": "attr"}])
+        self.assertEqual(ret["ret_count"], 3)
+
+    def test_reindex_entries_with_entries_deleted_while_rebuilding(self):
+        def _register_entries(*args, **kwargs):
+            # This deletes an entry after the rebuild starts
+            Entry.objects.filter(id=self.entries.pop().id).update(is_active=False)
+            return register_entries(*args, **kwargs)
+
+        register_entries = register_es_document.register_entries
+        with mock.patch(
+            "tools.register_es_document.register_entries", side_effect=_register_entries
+        ):
+            # checks the rebuild fails when no document is allowed to be missing
+            self.assertFalse(reindex_entries(self._es, tolerance=0))
+            self.assertEqual(self._es.get_aliased_indices(), [])
+
+            # checks the deleted entry is regarded as missing within the tolerance
+            self.assertTrue(reindex_entries(self._es, tolerance=0.5))
+            self.assertEqual(len(self._es.get_aliased_indices()), 1)
+
+        ret = Entry.search_entries(self.user, [self.entity.id], [{"name": "attr"}])
+        self.assertEqual(ret["ret_count"], 1)
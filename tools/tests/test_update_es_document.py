@@ -1,8 +1,15 @@
+from django.utils import timezone
+
 from airone.lib.test import AironeTestCase
 from airone.lib.types import AttrTypeValue
 from entity.models import Entity, EntityAttr
 from entry.models import Entry
-from tools.update_es_document import delete_unnecessary_documents, register_documents
+from tools.update_es_document import (
+    delete_unnecessary_documents,
+    register_documents,
+    sync_updated_documents,
+    update_all_documents,
+)
 from user.models import User
 
 
@@ -82,3 +89,42 @@ class UpdateESDocuemntlTest(AironeTestCase):
 
         self.assertEqual(ret["ret_count"], 2)
         self.assertFalse(any(x["entry"]["id"] == entry.id for x in ret["ret_values"]))
+
+    def test_sync_updated_documents_without_watermark(self):
+        self.assertIsNone(self._es.get_sync_watermark())
+        self.assertFalse(sync_updated_documents(self._es))
+
+    def test_update_all_documents(self):
+        # checks the watermark isn't set when only some of entities are registered
+        self.assertEqual(update_all_documents(self._es, ["Entity"]), [])
+        self.assertIsNone(self._es.get_sync_watermark())
+
+        self.assertEqual(update_all_documents(self._es), [])
+        self.assertIsNotNone(self._es.get_sync_watermark())
+
+        ret = Entry.search_entries(self.user, [self.entity.id])
+        self.assertEqual(ret["ret_count"], 3)
+
+    def test_sync_updated_documents(self):
+        update_all_documents(self._es)
+        self.assertTrue(sync_updated_documents(self._es))
+
+        synced_time = self._es.get_sync_watermark()
+        self.assertIsNotNone(synced_time)
+
+        # update entry-0 and delete entry-1 without updating their documents
+        self.entries[0].attrs.first().add_value(self.user, "new-attr-value")
+        Entry.objects.filter(id=self.entries[1].id).update(
+            is_active=False, deleted_time=timezone.now()
+        )
+
+        self.assertTrue(sync_updated_documents(self._es))
+        self.assertGreater(self._es.get_sync_watermark(), synced_time)
+
+        ret = Entry.search_entries(self.user, [self.entity.id], [{"name": "attr"}])
+        self.assertEqual(ret["ret_count"], 2)
+
+        values = {x["entry"]["id"]: x["attrs"]["attr"]["value"] for x in ret["ret_values"]}
+        self.assertEqual(
+            values, {self.entries[0].id: "new-attr-value", self.entries[2].id: "value-2"}
+        )
@@ -16,28 +16,32 @@ os.environ.setdefault("DJANGO_CONFIGURATION", "Dev")
 configurations.setup()
 
 from django.db.models import Q  # NOQA
+from django.utils import timezone  # NOQA
 
 from airone.lib.elasticsearch import ESS  # NOQA
-from entry.models import Entry  # NOQA
+from entity.models import Entity  # NOQA
+from entry.models import Attribute, AttributeValue, Entry  # NOQA
 
 ES_INDEX = django.conf.settings.ES_CONFIG["INDEX"]
 
 
-def register_documents(es, es_index, target_entities=None):
+def register_documents(es, es_index, target_entities=None, chunk_size=None, max_chunk_bytes=None):
     db_query = Q(is_active=True)
     if target_entities:
         db_query = Q(db_query, Q(schema__name__in=target_entities))
 
-    current_index = 1
-    total_count = Entry.objects.filter(db_query).count()
-    for entry in Entry.objects.filter(db_query):
-        sys.stdout.write("\rRegister entry: (%6d/%6d)" % (current_index, total_count))
+    entries = Entry.objects.filter(db_query)
+    sys.stdout.write("Register entries: %d\n" % entries.count())
 
-        entry.register_es(es, skip_refresh=True)
+    success_count, errors = Entry.register_es_in_bulk(
+        entries, es=es, chunk_size=chunk_size, max_chunk_bytes=max_chunk_bytes
+    )
+    for error in errors:
+        sys.stdout.write("Failed to register entry(%s): %s\n" % (error["id"], error["error"]))
 
-        current_index += 1
+    sys.stdout.write("Registered entries: %d (failed: %d)\n" % (success_count, len(errors)))
 
-    es.indices.refresh(index=es_index)
+    return (success_count, errors)
 
 
 def delete_unnecessary_documents(es, es_index):
@@ -56,10 +60,133 @@ def delete_unnecessary_documents(es, es_index):
     es.indices.refresh(index=es_index)
 
 
+def update_all_documents(es, target_entities=None, chunk_size=None, max_chunk_bytes=None):
+    """This registers all entries and deletes unnecessary documents.
+
+    The watermark of the incremental synchronization is set only when all entries are
+    registered without any error.
+    """
+    # Changes after this time will be synchronized at the next incremental synchronization
+    started_time = timezone.now()
+
+    # register all entries to Elasticsearch
+    (_, errors) = register_documents(es, es._index, target_entities, chunk_size, max_chunk_bytes)
+
+    # delete document which are already exists in AirOne
+    delete_unnecessary_documents(es, es._index)
+
+    if not target_entities and not errors:
+        es.set_sync_watermark(started_time)
+
+    return errors
+
+
+def sync_updated_documents(es, chunk_size=None, max_chunk_bytes=None):
+    """This synchronizes only documents of entries that are changed since the last sync.
+
+    The last synchronized time (watermark) is stored in the index. This returns False
+    without doing anything when the index has no watermark, then all documents should be
+    registered instead.
+    """
+    synced_time = es.get_sync_watermark()
+    if not synced_time:
+        return False
+
+    # Changes after this time will be synchronized at the next time
+    started_time = timezone.now()
+
+    # collect entries whose documents might be changed since the watermark
+    updated_schema_ids = set(
+        Entity.objects.filter(updated_time__gt=synced_time).values_list("id", flat=True)
+    ) | set(
+        Entity.attrs.through.objects.filter(entityattr__updated_time__gt=synced_time).values_list(
+            "entity_id", flat=True
+        )
+    )
+    updated_entry_ids = (
+        set(
+            Entry.objects.filter(
+                Q(updated_time__gt=synced_time) | Q(schema__in=updated_schema_ids),
+                is_active=True,
+            ).values_list("id", flat=True)
+        )
+        | set(
+            Attribute.objects.filter(
+                updated_time__gt=synced_time, parent_entry__is_active=True
+            ).values_list("parent_entry", flat=True)
+        )
+        | set(
+            AttributeValue.objects.filter(
+                created_time__gt=synced_time, parent_attr__parent_entry__is_active=True
+            ).values_list("parent_attr__parent_entry", flat=True)
+        )
+        # entries that refer changed objects (e.g. renamed entries) in the latest values
+        | set(
+            AttributeValue.objects.filter(
+                Q(is_latest=True) | Q(parent_attrv__is_latest=True),
+                referral__updated_time__gt=synced_time,
+                parent_attr__parent_entry__is_active=True,
+            ).values_list("parent_attr__parent_entry", flat=True)
+        )
+    )
+    sys.stdout.write("Register updated entries: %d\n" % len(updated_entry_ids))
+
+    (_, register_errors) = Entry.register_es_in_bulk(
+        sorted(updated_entry_ids),
+        es=es,
+        chunk_size=chunk_size,
+        max_chunk_bytes=max_chunk_bytes,
+        skip_refresh=True,
+    )
+    for error in register_errors:
+        sys.stdout.write("Failed to register entry(%s): %s\n" % (error["id"], error["error"]))
+
+    # delete documents of entries that are deleted since the watermark
+    deleted_entry_ids = Entry.objects.filter(
+        Q(updated_time__gt=synced_time) | Q(deleted_time__gt=synced_time), is_active=False
+    ).values_list("id", flat=True)
+    sys.stdout.write("Delete deleted entries: %d\n" % len(deleted_entry_ids))
+
+    (_, delete_errors) = es.bulk_delete(
+        deleted_entry_ids.iterator(), chunk_size=chunk_size, max_chunk_bytes=max_chunk_bytes
+    )
+    for error in delete_errors:
+        sys.stdout.write("Failed to delete entry(%s): %s\n" % (error["id"], error["error"]))
+
+    # The watermark isn't updated when there is any error to retry them at the next time
+    if not register_errors and not delete_errors:
+        es.set_sync_watermark(started_time)
+
+    return True
+
+
 def get_options():
     parser = OptionParser(usage="%prog [options] [target-Entities]")
-
-    return parser.parse_args()
+    parser.add_option(
+        "--chunk-size",
+        type=int,
+        dest="chunk_size",
+        help="number of documents to send at one bulk request",
+    )
+    parser.add_option(
+        "--max-chunk-bytes",
+        type=int,
+        dest="max_chunk_bytes",
+        help="maximum size in bytes of one bulk request",
+    )
+    parser.add_option(
+        "--incremental",
+        action="store_true",
+        dest="incremental",
+        default=False,
+        help="synchronize only entries that are changed since the last synchronization",
+    )
+
+    (option, entities) = parser.parse_args()
+    if option.incremental and entities:
+        parser.error("target-Entities can't be specified with --incremental option")
+
+    return (option, entities)
 
 
 if __name__ == "__main__":
@@ -67,8 +194,7 @@ if __name__ == "__main__":
 
     es = ESS()
 
-    # register all entries to Elasticsearch
-    register_documents(es, ES_INDEX, entities)
+    if option.incremental and sync_updated_documents(es, option.chunk_size, option.max_chunk_bytes):
+        sys.exit(0)
 
-    # delete document which are already exists in AirOne
-    delete_unnecessary_documents(es, ES_INDEX)
+    update_all_documents(es, entities, option.chunk_size, option.max_chunk_bytes)
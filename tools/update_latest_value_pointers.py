@@ -0,0 +1,22 @@
+import os
+import sys
+
+import configurations
+
+# append airone directory to the default path
+sys.path.append("./")
+
+# prepare to load the data models of AirOne
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "airone.settings")
+os.environ.setdefault("DJANGO_CONFIGURATION", "Dev")
+
+# load AirOne application
+configurations.setup()
+
+from entry.models import Attribute  # NOQA
+
+if __name__ == "__main__":
+    # This sets latest_value of Attributes from is_latest flag of their AttributeValues,
+    # which is needed to be run once for the data that has been registered before
+    # Attribute.latest_value was introduced.
+    Attribute.update_latest_value_pointers()
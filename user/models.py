@@ -3,6 +3,7 @@ from importlib import import_module
 
 from django.contrib.auth.models import AbstractUser
 from django.db import models
+from django.db.models import Q
 from rest_framework.authtoken.models import Token
 
 from airone.lib.acl import ACLType, ACLTypeBase
@@ -42,19 +43,19 @@ class User(AbstractUser):
     def belonging_groups(self, is_direct_belonging=False):
         """This returns groups that include hierarchical superior groups"""
 
-        def _scan_superior_groups(group, parent_groups):
-            if group.parent_group and group.parent_group not in parent_groups:
-                parent_groups.append(group.parent_group)
-                _scan_superior_groups(group.parent_group, parent_groups)
-
         if is_direct_belonging:
             return self.airone_groups
         else:
-            parent_groups = []
-            for group in self.airone_groups:
-                _scan_superior_groups(group, parent_groups)
-
-            return set(list(self.airone_groups) + parent_groups)
+            # This gets superior groups from GroupHierarchy with directly belonging ones at once
+            group_ids = Group.objects.filter(
+                id__in=self.groups.values("id"), is_active=True
+            ).values("id")
+
+            return set(
+                Group.objects.filter(
+                    Q(id__in=group_ids) | Q(descendant_relations__descendant__in=group_ids)
+                ).distinct()
+            )
 
     def has_permission(self, target_obj, permission_level):
         # A bypass processing to rapidly return.
@@ -87,25 +88,82 @@ class User(AbstractUser):
 
         # This checks Roles that this user and groups, which this user belongs to,
         # have permission of specified permission_level
-        belonged_roles = set(
-            list(self.role.filter(is_active=True))
-            + list(self.admin_role.filter(is_active=True))
-            + sum(
-                [
-                    (
-                        list(g.role.filter(is_active=True))
-                        + list(g.admin_role.filter(is_active=True))
-                    )
-                    for g in self.belonging_groups()
-                ],
-                [],
-            )
+        return self.get_permission_context().is_permitted(target_obj.id, permission_level)
+
+    def get_permission_context(self):
+        """This returns PermissionContext of this user, which is memoized in this instance.
+
+        Because a User instance is created for each request (or each job), permissions
+        are read from database once in it. The memoized one is discarded when any ACL
+        configuration (e.g. members of Roles) is changed in this process.
+        """
+        context = getattr(self, "_permission_context", None)
+        if not context or context.is_expired():
+            context = self._permission_context = PermissionContext(self)
+
+        return context
+
+    def get_belonged_roles(self):
+        """This returns Roles that this user and groups, which this user belongs to, have"""
+        group_ids = [g.id for g in self.belonging_groups()]
+        return set(
+            Role.objects.filter(
+                Q(users=self)
+                | Q(admin_users=self)
+                | Q(groups__in=group_ids)
+                | Q(admin_groups__in=group_ids),
+                is_active=True,
+            ).distinct()
         )
-        for role in belonged_roles:
-            if role.is_permitted(target_obj, permission_level):
-                return True
 
-        return False
+    def get_permitted_ids(self, target_objs, permission_level):
+        """This returns IDs of target_objs that this user has permission_level to access.
+
+        The result is same with calling has_permission() for each of target_objs, but this
+        checks all of them with a constant number of queries.
+        """
+        target_objs = list(target_objs)
+        if self.is_superuser:
+            return set([x.id for x in target_objs])
+
+        try:
+            if not issubclass(permission_level, ACLTypeBase):
+                return set()
+        except TypeError:
+            return set()
+
+        # doesn't permit, access to the children's objects are also not permitted.
+        child_types = (
+            import_module("entry.models").Entry,
+            import_module("entry.models").Attribute,
+        )
+        schema_ids = set([x.schema_id for x in target_objs if isinstance(x, child_types)])
+        permitted_schema_ids = self.get_permitted_ids(
+            import_module("acl.models").ACLBase.objects.filter(id__in=schema_ids),
+            permission_level,
+        )
+
+        permitted_ids = set()
+        undecided_ids = set()
+        for target_obj in target_objs:
+            if isinstance(target_obj, child_types) and (
+                target_obj.schema_id not in permitted_schema_ids
+            ):
+                continue
+
+            if target_obj.is_public or permission_level <= target_obj.default_permission:
+                permitted_ids.add(target_obj.id)
+            else:
+                undecided_ids.add(target_obj.id)
+
+        if not undecided_ids:
+            return permitted_ids
+
+        # This checks Roles have permission of specified permission_level
+        context = self.get_permission_context()
+        return permitted_ids | set(
+            [x for x in undecided_ids if context.is_permitted(x, permission_level)]
+        )
 
     def is_permitted_to_change(
         self, target_obj, expected_permission, will_be_public, default_permission, acl_settings
@@ -186,6 +244,41 @@ class User(AbstractUser):
         return History.register(self, target, History.DEL_ENTRY)
 
 
+class PermissionContext(object):
+    """This holds permissions that a user has through Roles to check them in memory.
+
+    The permissions are the highest ACLType ID for each object, which are read from all
+    Roles that the user and groups, which the user belongs to, have.
+    """
+
+    # This is incremented whenever ACL configuration is changed (c.f. acl/signals.py)
+    # to expire all contexts that are created before it in this process.
+    generation = 0
+
+    def __init__(self, user):
+        self._generation = PermissionContext.generation
+
+        self.role_ids = set([x.id for x in user.get_belonged_roles()])
+        self.permissions = {}
+
+        for (obj_id, acl_id) in (
+            import_module("acl.models")
+            .ACLPermission.objects.filter(permission__role__in=self.role_ids)
+            .values_list("object_id", "acl")
+        ):
+            self.permissions[obj_id] = max(self.permissions.get(obj_id, 0), acl_id)
+
+    @classmethod
+    def expire_all(kls):
+        kls.generation += 1
+
+    def is_expired(self):
+        return self._generation != PermissionContext.generation
+
+    def is_permitted(self, obj_id, permission_level):
+        return permission_level.id <= self.permissions.get(obj_id, 0)
+
+
 class History(models.Model):
     """
     These constants describe operations of History and bit-map construct following
@@ -1,8 +1,10 @@
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from rest_framework.authtoken.models import Token
 from social_django.models import UserSocialAuth
 
-from airone.lib.acl import ACLType
+from airone.lib.acl import ACLType, filter_permitted
 from airone.lib.types import AttrTypeValue
 from entity.models import Entity, EntityAttr
 from entry.models import Entry
@@ -171,6 +173,125 @@ class ModelTest(TestCase):
         role.admin_users.add(user)
         self.assertTrue(user.has_permission(entity, ACLType.Full))
 
+    def test_user_get_permitted_ids(self):
+        user = User.objects.create(username="user")
+        group = Group.objects.create(name="group")
+        role = Role.objects.create(name="Role1")
+        role.groups.add(group)
+        user.groups.add(group)
+
+        entity = Entity.objects.create(name="entity", created_user=user)
+        private_entity = Entity.objects.create(name="private", created_user=user, is_public=False)
+        entries = [
+            Entry.objects.create(name="public", schema=entity, created_user=user),
+            Entry.objects.create(
+                name="default",
+                schema=entity,
+                created_user=user,
+                is_public=False,
+                default_permission=ACLType.Readable.id,
+            ),
+            Entry.objects.create(name="role", schema=entity, created_user=user, is_public=False),
+            Entry.objects.create(name="nothing", schema=entity, created_user=user, is_public=False),
+            Entry.objects.create(name="child", schema=private_entity, created_user=user),
+        ]
+        role.permissions.add(entries[2].readable)
+
+        # checks the result is same with has_permission() for each objects
+        for acltype in [ACLType.Readable, ACLType.Writable]:
+            self.assertEqual(
+                user.get_permitted_ids(entries, acltype),
+                set([x.id for x in entries if user.has_permission(x, acltype)]),
+            )
+        self.assertEqual(
+            user.get_permitted_ids(entries, ACLType.Readable),
+            set([entries[0].id, entries[1].id, entries[2].id]),
+        )
+
+        # checks the number of queries doesn't depend on the number of objects
+        user.get_permission_context()
+        with CaptureQueriesContext(connection) as ctx_all:
+            user.get_permitted_ids(entries, ACLType.Readable)
+        with CaptureQueriesContext(connection) as ctx_part:
+            user.get_permitted_ids(entries[3:], ACLType.Readable)
+        self.assertEqual(len(ctx_all.captured_queries), len(ctx_part.captured_queries))
+
+        user.is_superuser = True
+        self.assertEqual(
+            user.get_permitted_ids(entries, ACLType.Full), set([x.id for x in entries])
+        )
+
+    def test_filter_permitted(self):
+        user = User.objects.create(username="user")
+        role = Role.objects.create(name="Role1")
+        role.users.add(user)
+
+        entity = Entity.objects.create(name="entity", created_user=user)
+        private_entity = Entity.objects.create(name="private", created_user=user, is_public=False)
+        for (name, schema, params) in [
+            ("public", entity, {}),
+            ("default", entity, {"is_public": False, "default_permission": ACLType.Readable.id}),
+            ("role", entity, {"is_public": False}),
+            ("nothing", entity, {"is_public": False}),
+            ("child", private_entity, {}),
+        ]:
+            Entry.objects.create(name=name, schema=schema, created_user=user, **params)
+        role.permissions.add(Entry.objects.get(name="role").writable)
+
+        # checks the result is same with has_permission() for each objects
+        for acltype in [ACLType.Readable, ACLType.Writable, ACLType.Full]:
+            self.assertEqual(
+                sorted([x.name for x in filter_permitted(user, Entry.objects.all(), acltype)]),
+                sorted([x.name for x in Entry.objects.all() if user.has_permission(x, acltype)]),
+            )
+        self.assertEqual(
+            sorted([x.name for x in filter_permitted(user, Entry.objects.all(), ACLType.Readable)]),
+            ["default", "public", "role"],
+        )
+
+        # checks objects are filtered in one query after the context is loaded
+        user.get_permission_context()
+        with self.assertNumQueries(1):
+            list(filter_permitted(user, Entry.objects.all(), ACLType.Readable))
+
+        # checks invalid permission_level
+        self.assertFalse(filter_permitted(user, Entry.objects.all(), None).exists())
+
+        user.is_superuser = True
+        self.assertEqual(
+            filter_permitted(user, Entity.objects.all(), ACLType.Full).count(),
+            Entity.objects.count(),
+        )
+
+    def test_user_has_permission_with_permission_context(self):
+        user = User.objects.create(username="user")
+        group = Group.objects.create(name="group")
+        role = Role.objects.create(name="Role1")
+        entities = [
+            Entity.objects.create(name="e%d" % i, created_user=user, is_public=False)
+            for i in range(5)
+        ]
+        role.permissions.add(entities[0].readable, entities[1].full)
+        role.groups.add(group)
+
+        # User doesn't have permission before belonging to Group
+        self.assertFalse(user.has_permission(entities[0], ACLType.Readable))
+
+        # checks the context is expired when ACL configuration is changed
+        user.groups.add(group)
+        self.assertTrue(user.has_permission(entities[0], ACLType.Readable))
+        self.assertFalse(user.has_permission(entities[0], ACLType.Writable))
+
+        role.permissions.add(entities[2].writable)
+        self.assertTrue(user.has_permission(entities[2], ACLType.Readable))
+
+        # checks permissions are checked without sending query after the context is loaded
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                [user.has_permission(x, ACLType.Writable) for x in entities],
+                [False, True, True, False, False],
+            )
+
     def test_get_all_hierarchical_groups_when_they_are_looped(self):
         """This test try to get hierarchical groups when those are looped like this
         * group0